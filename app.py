@@ -2,23 +2,27 @@
 # -*- coding: utf-8 -*-
 import os
 
-import logging
-from logging.handlers import RotatingFileHandler
-
 from flask import Flask,jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
 
+# 加载环境变量：各服务的全局实例在导入时读取配置，必须在导入 app.* 之前加载
+load_dotenv()
+
 # 导入路由
-from app.main.routes import health_bp, sessions_dp
+from app.main.routes import health_bp, sessions_dp, debug_bp, metrics_bp
 from app.api.v1.routes import api_v1_bp
 
 # 导入并初始化服务
 from app.services.session_service import session_service
 from app.services.chat_service import chat_service
-
-# 加载环境变量
-load_dotenv()
+from app.services.log_service import log_service
+from app.services.profiler_service import profiler_service
+from app.services.cluster_service import cluster_service
+from app.services.loop_watchdog import loop_watchdog
+from app.services.timing_service import timing_service
+from app.services.warmup_service import warmup_service
+from app.services.json_service import FastJSONProvider
 
 # 创建 Flask 应用
 app = Flask(__name__)
@@ -26,31 +30,18 @@ CORS(app)
 
 # 配置 Flask 应用以支持中文显示
 app.config['JSON_AS_ASCII'] = False
+# 使用更快的 JSON 后端（orjson / ujson / 标准库），同样原样输出中文
+app.json = FastJSONProvider(app)
 
 # 配置日志
-# 设置日志文件路径
-log_path = os.environ.get("LOG_PATH", "logs")
-log_name = os.environ.get("LOG_NAME", "anuneko-openai")
-if not os.path.exists(log_path):
-    os.mkdir(log_path)
-
-# 配置文件处理器
-file_handler = RotatingFileHandler(
-    f'{log_path}/{log_name}.log',
-    maxBytes=10240000,  # 10MB
-    backupCount=10
-)
+# 日志经有界队列交给后台线程写入文件，请求线程不会被磁盘 I/O 阻塞
+log_service.init_app(app)
 
-# 设置日志格式
-formatter = logging.Formatter(
-    '[%(asctime)s] [%(levelname)s] %(message)s [in %(pathname)s:%(lineno)d]'
-)
-file_handler.setFormatter(formatter)
-file_handler.setLevel(logging.INFO)
+# 聊天请求的分阶段耗时：Server-Timing 响应头（流式响应在末尾以 SSE 注释返回）和结构化日志
+timing_service.init_app(app)
 
-# 添加处理器到应用日志器
-app.logger.addHandler(file_handler)
-app.logger.setLevel(logging.INFO)
+# 集群模式：非所属节点把聊天与会话请求转发给一致性哈希环上的所属节点
+cluster_service.init_app(app)
 
 # 注册路由
 app.register_blueprint(
@@ -58,6 +49,11 @@ app.register_blueprint(
     url_prefix="/health"
 )
 
+app.register_blueprint(
+    blueprint=metrics_bp,
+    url_prefix="/metrics"
+)
+
 app.register_blueprint(
     blueprint=sessions_dp,
     url_prefix="/sessions"
@@ -69,6 +65,20 @@ app.register_blueprint(
     url_prefix="/v1"
 )
 
+# 性能剖析端点默认关闭，未启用时不注册路由和钩子
+if profiler_service.enabled:
+    app.register_blueprint(
+        blueprint=debug_bp,
+        url_prefix="/debug"
+    )
+    profiler_service.init_app(app)
+
+# 事件循环监控：测量调度延迟、记录阻塞循环的调用栈，统计阻塞等待协程的耗时
+loop_watchdog.start()
+
+# 启动预热：立即加载模型快照，后台刷新模型目录并预建连接与备用会话
+warmup_service.start()
+
 @app.route("/", methods=["GET"])
 def index():
     return jsonify({
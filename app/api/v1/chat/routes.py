@@ -7,8 +7,6 @@ chat_bp = Blueprint("chat", __name__)
 def chat_completions():
     """聊天完成端点"""
     try:
-        request_data = request.get_json()
-        
         # 提取 API Key（从 Authorization 头或 X-API-Key 头）
         api_key = None
         auth_header = request.headers.get("Authorization", "")
@@ -17,12 +15,24 @@ def chat_completions():
         elif request.headers.get("X-API-Key"):
             api_key = request.headers.get("X-API-Key")
         
-        # 将 API Key 传递给服务层
-        result = chat_service.process_chat_request(request_data, api_key)
+        # 携带 Last-Event-ID 的请求是断线重连，直接从重放缓冲续传
+        last_event_id = request.headers.get("Last-Event-ID")
+        if last_event_id:
+            result = chat_service.resume_stream(last_event_id, api_key)
+        else:
+            request_data = request.get_json()
+            # 将 API Key、调度优先级和指定的会话传递给服务层
+            result = chat_service.process_chat_request(
+                request_data, api_key,
+                priority=request.headers.get("X-Priority"),
+                session_id=request.headers.get("X-Session-ID")
+            )
         
-        # 如果结果是元组，说明包含状态码
+        # 如果结果是元组，说明包含状态码（可能还带响应头，如 Retry-After）
         if isinstance(result, tuple) and len(result) == 2:
             return jsonify(result[0]), result[1]
+        if isinstance(result, tuple) and len(result) == 3:
+            return jsonify(result[0]), result[1], result[2]
         
         # 如果结果是字典，说明是正常响应
         if isinstance(result, dict):
@@ -0,0 +1,60 @@
+from flask import request, jsonify
+from typing import Optional
+from app.services.job_service import job_service, JobLimitError
+
+
+def _api_key() -> Optional[str]:
+    """从 Authorization 头或 X-API-Key 头提取 API Key"""
+    auth_header = request.headers.get("Authorization", "")
+    if auth_header.startswith("Bearer "):
+        return auth_header[7:]
+    return request.headers.get("X-API-Key")
+
+
+def _not_found():
+    return jsonify({
+        "error": {
+            "message": "任务不存在或已过期",
+            "type": "invalid_request_error",
+            "code": "job_not_found"
+        }
+    }), 404
+
+
+def submit():
+    """提交异步聊天任务，立即返回任务 ID"""
+    request_data = request.get_json(silent=True)
+    if not request_data or not request_data.get("messages"):
+        return jsonify({"error": {"message": "messages 不能为空", "type": "invalid_request_error"}}), 400
+
+    # 与聊天端点一样，X-Session-ID 头指定续用的会话
+    if request.headers.get("X-Session-ID"):
+        request_data = {**request_data, "session_id": request.headers["X-Session-ID"]}
+
+    try:
+        job = job_service.submit(request_data, _api_key())
+    except JobLimitError as e:
+        return jsonify({"error": {"message": str(e), "type": "server_error", "code": "too_many_jobs"}}), 429, {"Retry-After": "1"}
+    return jsonify(job.to_dict()), 202, {"Location": f"{request.path.rstrip('/')}/{job.id}"}
+
+
+def show(job_id: str):
+    """查询任务状态与结果；带 wait 参数时长轮询，任务结束或超时后返回"""
+    job = job_service.get(job_id, _api_key())
+    if job is None:
+        return _not_found()
+
+    try:
+        wait = min(float(request.args.get("wait", 0)), job_service.MAX_WAIT)
+    except ValueError:
+        return jsonify({"error": {"message": "wait 必须是数字", "type": "invalid_request_error"}}), 400
+    if wait > 0 and not job.done:
+        job.wait(wait)
+    return jsonify(job.to_dict())
+
+
+def delete(job_id: str):
+    """删除任务"""
+    if not job_service.delete(job_id, _api_key()):
+        return _not_found()
+    return jsonify({"id": job_id, "object": "chat.completion.job", "deleted": True})
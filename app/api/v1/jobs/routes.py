@@ -0,0 +1,19 @@
+from flask import Blueprint
+from app.api.v1.jobs import jobs
+
+jobs_bp = Blueprint("jobs", __name__)
+
+@jobs_bp.route("", methods=["POST"])
+def jobs_submit():
+    """提交异步聊天任务端点"""
+    return jobs.submit()
+
+@jobs_bp.route("/<job_id>", methods=["GET"])
+def jobs_show(job_id: str):
+    """查询异步任务端点"""
+    return jobs.show(job_id)
+
+@jobs_bp.route("/<job_id>", methods=["DELETE"])
+def jobs_delete(job_id: str):
+    """删除异步任务端点"""
+    return jobs.delete(job_id)
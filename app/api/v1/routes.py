@@ -1,6 +1,8 @@
 from flask import Blueprint
 from app.api.v1.chat.routes import chat_bp
 from app.api.v1.models.routes import models_bp
+from app.api.v1.ws.routes import ws_bp
+from app.api.v1.jobs.routes import jobs_bp
 
 # 声明 api-v1 蓝图
 api_v1_bp = Blueprint("api_v1", __name__)
@@ -15,4 +17,16 @@ api_v1_bp.register_blueprint(
 api_v1_bp.register_blueprint(
     blueprint=models_bp,
     url_prefix="/models"
-)
\ No newline at end of file
+)
+
+# 注册路由 ws（需要安装 flask-sock）
+api_v1_bp.register_blueprint(
+    blueprint=ws_bp,
+    url_prefix="/ws"
+)
+
+# 注册路由 jobs（异步聊天任务）
+api_v1_bp.register_blueprint(
+    blueprint=jobs_bp,
+    url_prefix="/jobs"
+)
@@ -0,0 +1,10 @@
+from flask import Blueprint
+from app.api.v1.ws import ws
+
+ws_bp = Blueprint("ws", __name__)
+
+if ws.sock is not None:
+    @ws.sock.route("", bp=ws_bp)
+    def chat_socket(connection):
+        """WebSocket 聊天端点"""
+        ws.serve(connection)
@@ -0,0 +1,26 @@
+from flask import request
+from app.services.ws_service import ws_service
+
+# flask-sock 为可选依赖，未安装时不提供 WebSocket 端点
+try:
+    from flask_sock import Sock
+    sock = Sock()
+except ImportError:
+    sock = None
+
+
+def serve(connection):
+    """WebSocket 聊天端点，连接期间绑定同一个会话；X-Session-ID 头或 session_id 查询参数指定续用的会话"""
+    # 浏览器无法自定义 WebSocket 请求头，也允许通过查询参数传递 API Key
+    api_key = None
+    auth_header = request.headers.get("Authorization", "")
+    if auth_header.startswith("Bearer "):
+        api_key = auth_header[7:]
+    elif request.headers.get("X-API-Key"):
+        api_key = request.headers.get("X-API-Key")
+    else:
+        api_key = request.args.get("api_key")
+
+    model = request.args.get("model", "mihoyo-orange_cat")
+    session_id = request.headers.get("X-Session-ID") or request.args.get("session_id")
+    ws_service.serve(connection, api_key, model, session_id)
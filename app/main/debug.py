@@ -0,0 +1,99 @@
+from functools import wraps
+
+from flask import jsonify, request, Response
+from app.services.profiler_service import profiler_service
+from app.services.session_service import session_service
+
+
+def admin_required(func):
+    """仅允许携带正确 X-Admin-Token 的请求访问"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not profiler_service.is_admin(request.headers.get("X-Admin-Token")):
+            return jsonify({
+                "error": {
+                    "message": "需要管理员权限",
+                    "type": "permission_error"
+                }
+            }), 403
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def profile_cpu():
+    """采样 CPU 调用栈"""
+    seconds = request.args.get("seconds", 10, type=float)
+    interval = request.args.get("interval", 0.005, type=float)
+    output_format = request.args.get("format", "collapsed")
+    include_idle_tasks = request.args.get("idle_tasks", "true").lower() == "true"
+
+    profiler = profiler_service.profile_cpu(seconds, interval, include_idle_tasks)
+    if profiler is None:
+        return jsonify({"status": "error", "message": "已有 CPU 采样正在进行"}), 409
+
+    if output_format == "json":
+        return jsonify({
+            "samples": profiler.samples,
+            "interval": profiler.interval,
+            "top": profiler.top_functions(request.args.get("limit", 30, type=int))
+        })
+
+    return Response(
+        profiler.collapsed(),
+        mimetype="text/plain",
+        headers={"Content-Disposition": "attachment; filename=profile.folded"}
+    )
+
+
+def request_profile(profile_id: str):
+    """获取单请求剖析结果（Flask 处理线程与事件循环线程两部分）"""
+    result = profiler_service.get_request_profile(profile_id)
+    if result is None:
+        return jsonify({"status": "error", "message": "剖析结果不存在或已过期"}), 404
+    return Response(result, mimetype="text/plain")
+
+
+def tracemalloc_start():
+    """开始跟踪内存分配"""
+    frames = request.args.get("frames", 25, type=int)
+    return jsonify(profiler_service.start_tracemalloc(frames))
+
+
+def tracemalloc_stop():
+    """停止跟踪内存分配"""
+    return jsonify(profiler_service.stop_tracemalloc())
+
+
+def tracemalloc_snapshot():
+    """保存内存快照"""
+    snapshot_id = profiler_service.take_snapshot()
+    if snapshot_id is None:
+        return jsonify({"status": "error", "message": "tracemalloc 未启动"}), 409
+
+    status = profiler_service.tracemalloc_status()
+    status.update({
+        "snapshot_id": snapshot_id,
+        "sessions": len(session_service.sessions),
+        "api_key_sessions": len(session_service.api_key_sessions)
+    })
+    return jsonify(status)
+
+
+def tracemalloc_diff():
+    """对比内存快照"""
+    base_id = request.args.get("base")
+    group_by = request.args.get("group_by", "lineno")
+    if not base_id:
+        return jsonify({"status": "error", "message": "缺少 base 参数"}), 400
+    if group_by not in ("lineno", "filename", "traceback"):
+        return jsonify({"status": "error", "message": "group_by 只能是 lineno、filename 或 traceback"}), 400
+
+    stats = profiler_service.diff_snapshots(
+        base_id,
+        request.args.get("target"),
+        group_by,
+        request.args.get("limit", 30, type=int)
+    )
+    if stats is None:
+        return jsonify({"status": "error", "message": "快照不存在"}), 404
+    return jsonify({"base": base_id, "target": request.args.get("target"), "stats": stats})
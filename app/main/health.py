@@ -1,5 +1,6 @@
 from flask import jsonify
 from datetime import datetime
+from app.services.health_service import health_service
 
 def check():
     """健康检查端点"""
@@ -7,4 +8,13 @@ def check():
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "version": "1.0.0"
-    })
\ No newline at end of file
+    })
+
+def live():
+    """存活检查端点"""
+    return jsonify(health_service.liveness())
+
+def ready():
+    """就绪检查端点，未就绪时返回 503 供负载均衡摘除实例"""
+    report, is_ready = health_service.readiness()
+    return jsonify(report), (200 if is_ready else 503)
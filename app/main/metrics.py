@@ -0,0 +1,7 @@
+from flask import jsonify
+from app.services.metrics_service import metrics_service
+
+
+def show():
+    """运行指标端点"""
+    return jsonify(metrics_service.snapshot())
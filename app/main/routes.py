@@ -1,10 +1,12 @@
 from flask import Blueprint
 # 导入处理函数
-from app.main import health,sessions
+from app.main import health,sessions,debug,metrics
 
 # 创建蓝图
 health_bp = Blueprint("health", __name__)
 sessions_dp = Blueprint("sessions", __name__)
+debug_bp = Blueprint("debug", __name__)
+metrics_bp = Blueprint("metrics", __name__)
 
 
 # 定义路由
@@ -13,6 +15,23 @@ sessions_dp = Blueprint("sessions", __name__)
 def health_check():
     return health.check()
 
+@health_bp.route("/live", methods=["GET"])
+def liveness_route():
+    """存活检查"""
+    return health.live()
+
+@health_bp.route("/ready", methods=["GET"])
+def readiness_route():
+    """就绪检查"""
+    return health.ready()
+
+
+@metrics_bp.route("", methods=["GET"])
+@metrics_bp.route("/", methods=["GET"])
+def metrics_route():
+    """运行指标"""
+    return metrics.show()
+
 
 @sessions_dp.route("", methods=["GET"])
 @sessions_dp.route("/", methods=["GET"])
@@ -24,3 +43,40 @@ def list_sessions_route():
 def delete_session_route(session_id: str):
     """删除会话"""
     return sessions.delete(session_id)
+
+
+@debug_bp.route("/profile/cpu", methods=["GET"])
+@debug.admin_required
+def profile_cpu_route():
+    """CPU 采样剖析"""
+    return debug.profile_cpu()
+
+@debug_bp.route("/profile/requests/<profile_id>", methods=["GET"])
+@debug.admin_required
+def request_profile_route(profile_id: str):
+    """单请求剖析结果"""
+    return debug.request_profile(profile_id)
+
+@debug_bp.route("/tracemalloc/start", methods=["POST"])
+@debug.admin_required
+def tracemalloc_start_route():
+    """开始内存跟踪"""
+    return debug.tracemalloc_start()
+
+@debug_bp.route("/tracemalloc/stop", methods=["POST"])
+@debug.admin_required
+def tracemalloc_stop_route():
+    """停止内存跟踪"""
+    return debug.tracemalloc_stop()
+
+@debug_bp.route("/tracemalloc/snapshot", methods=["POST"])
+@debug.admin_required
+def tracemalloc_snapshot_route():
+    """保存内存快照"""
+    return debug.tracemalloc_snapshot()
+
+@debug_bp.route("/tracemalloc/diff", methods=["GET"])
+@debug.admin_required
+def tracemalloc_diff_route():
+    """对比内存快照"""
+    return debug.tracemalloc_diff()
@@ -1,9 +1,13 @@
 from flask import jsonify
 from app.services.session_service import session_service
+from app.services.cluster_service import cluster_service
 
 def show():
-    """列出会话"""
+    """列出会话（集群模式下合并所有存活节点的会话）"""
     session_list = session_service.list_sessions()
+    if cluster_service.ENABLED and not cluster_service.is_forwarded():
+        for result in cluster_service.gather("/sessions"):
+            session_list.extend(result.get("sessions", []))
     
     return jsonify({
         "sessions": session_list,
@@ -6,8 +6,95 @@ AnuNeko API Python 封装
 
 import json
 import os
+import time
+import asyncio
+import weakref
+import threading
 import httpx
-from typing import Dict, List, Optional, Union, AsyncGenerator
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Union, AsyncGenerator, AsyncIterator
+
+from app.services import json_service
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.traffic_recorder import RecordingTransport, ReplayTransport, shared_recorder
+from app.services.timing_service import timed
+
+
+class _StallWatchdog:
+    """读取上游流的期限看门狗
+
+    整个流只用一个定时器：每读到一行只刷新截止时间，定时器到点时若尚未超期就顺延，
+    避免为每一行创建任务或定时器。仅在等待读取期间超期才会取消读取任务
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._loop = asyncio.get_running_loop()
+        self._deadline = self._loop.time() + timeout
+        self._task: Optional[asyncio.Task] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._fired = False
+
+    def touch(self) -> None:
+        """收到一行，重新开始计时"""
+        self._deadline = self._loop.time() + self.timeout
+
+    def arm(self) -> None:
+        """开始等待下一行"""
+        if not self.timeout:
+            return
+        self._task = asyncio.current_task()
+        if self._handle is None:
+            self._handle = self._loop.call_at(self._deadline, self._check)
+
+    def disarm(self) -> None:
+        """结束等待"""
+        self._task = None
+
+    def _check(self) -> None:
+        self._handle = None
+        if self._task is None:
+            # 没有在等待读取（调用方正在处理上一行），下次等待时重新计时
+            return
+        if self._loop.time() < self._deadline:
+            self._handle = self._loop.call_at(self._deadline, self._check)
+            return
+        self._fired = True
+        self._task.cancel()
+
+    def consume_timeout(self) -> bool:
+        """本次取消是否由超期引起；是则撤销该取消请求"""
+        if not self._fired:
+            return False
+        self._fired = False
+        task = asyncio.current_task()
+        if task is not None and hasattr(task, "uncancel"):
+            task.uncancel()
+        return True
+
+    def close(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+
+class UpstreamError(Exception):
+    """上游调用失败"""
+
+    status_code = 502
+
+    def __init__(self, message: str, code: str = "upstream_error", status_code: Optional[int] = None):
+        super().__init__(message)
+        self.code = code
+        if status_code is not None:
+            self.status_code = status_code
+
+
+class UpstreamTimeoutError(UpstreamError):
+    """上游未在期限内建立连接或产出内容"""
+
+    status_code = 504
 
 
 class AnuNekoAPI:
@@ -20,19 +107,171 @@ class AnuNekoAPI:
     SELECT_CHOICE_URL = "https://anuneko.com/api/v1/msg/select-choice"
     SELECT_MODEL_URL = "https://anuneko.com/api/v1/user/select_model"
     
-    def __init__(self, token: str = None, cookie: str = None):
+    def __init__(
+        self,
+        token: str = None,
+        cookie: str = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
         """
         初始化 AnuNeko API 客户端
         
         Args:
             token: 账号 Token，如果为 None 则从环境变量 ANUNEKO_TOKEN 获取
             cookie: 可选的 Cookie 值，如果为 None 则从环境变量 ANUNEKO_COOKIE 获取
+            transport: 可选的 httpx 传输层，用于离线基准测试等场景替换真实网络
         """
         self.token = token or os.environ.get("ANUNEKO_TOKEN")
         self.cookie = cookie or os.environ.get("ANUNEKO_COOKIE")
+        # 设置 UPSTREAM_REPLAY_PATH 时用录制文件代替真实上游，UPSTREAM_REPLAY_SPEED 为回放倍速（0 为最快）
+        replay_path = os.environ.get("UPSTREAM_REPLAY_PATH")
+        if transport is None and replay_path:
+            transport = ReplayTransport.from_file(replay_path, float(os.environ.get("UPSTREAM_REPLAY_SPEED", 1)))
+        self.transport = transport
+        # 设置 UPSTREAM_RECORD_PATH 时把真实上游流量录制到该文件
+        record_path = os.environ.get("UPSTREAM_RECORD_PATH")
+        self.recorder = shared_recorder(record_path) if record_path and transport is None else None
         
         if not self.token:
             raise ValueError("Token 未提供，请设置 ANUNEKO_TOKEN 环境变量或直接传入 token 参数")
+        
+        # 上游调用状态（供就绪检查使用）
+        self.max_connections = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", 100))
+        # 流式回复的各阶段期限（秒，0 表示不限）：建立连接、首帧、相邻两帧之间
+        self.connect_timeout = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", 10))
+        self.first_token_timeout = float(os.environ.get("UPSTREAM_FIRST_TOKEN_TIMEOUT", 60))
+        self.idle_timeout = float(os.environ.get("UPSTREAM_IDLE_TIMEOUT", 30))
+        self.in_flight = 0
+        self.last_success_at: Optional[float] = None
+        self.last_failure_at: Optional[float] = None
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5)),
+            reset_timeout=float(os.environ.get("CIRCUIT_RESET_TIMEOUT", 30))
+        )
+        self._state_lock = threading.Lock()
+        # 回复被提前关闭、分支未能确认的上游会话，下一轮需要换新会话（有上限，只保留最近的）
+        self._unconfirmed_chats: "OrderedDict[str, None]" = OrderedDict()
+        # 回复被提前关闭后仍在后台读取剩余流、等待 msg_id 确认分支的上游会话 -> 后台任务
+        self._confirming: Dict[str, "asyncio.Task[None]"] = {}
+        # 上游会话 -> 最近一条回复的备选分支 {"msg_id", "branches": {分支索引: 文本}}，重新生成时直接取用
+        # 只保留最近 BRANCH_CACHE_SIZE 个上游会话的（0 表示不缓存）
+        self.branch_cache_size = int(os.environ.get("BRANCH_CACHE_SIZE", 256))
+        self._alternate_branches: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # 每个事件循环一个共享客户端，连接池在同一循环内跨请求复用
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+    
+    def get_client(self) -> httpx.AsyncClient:
+        """获取当前事件循环上的共享 httpx 客户端"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections
+            )
+            transport = self.transport
+            if self.recorder is not None:
+                transport = RecordingTransport(self.recorder, httpx.AsyncHTTPTransport(limits=limits))
+            client = httpx.AsyncClient(
+                transport=transport,
+                timeout=10,
+                limits=limits
+            )
+            self._clients[loop] = client
+        return client
+    
+    @asynccontextmanager
+    async def _client(self) -> AsyncIterator[httpx.AsyncClient]:
+        """借用共享客户端，退出时不关闭连接池"""
+        yield self.get_client()
+    
+    async def warm_connections(self, count: int) -> int:
+        """并发发起轻量请求，预先建立指定数量的上游连接
+        
+        Args:
+            count: 需要建立的连接数
+            
+        Returns:
+            成功完成的请求数
+        """
+        results = await asyncio.gather(
+            *(self.model_view() for _ in range(count)),
+            return_exceptions=True
+        )
+        return sum(1 for result in results if isinstance(result, dict))
+    
+    async def aclose(self) -> None:
+        """关闭当前事件循环上的共享客户端"""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+    
+    def _begin_call(self) -> bool:
+        """登记一次上游调用，熔断打开时返回 False"""
+        if not self.breaker.allow():
+            return False
+        with self._state_lock:
+            self.in_flight += 1
+        return True
+    
+    def _end_call(self, ok: bool) -> None:
+        """结束一次上游调用并记录结果"""
+        with self._state_lock:
+            self.in_flight -= 1
+        if ok:
+            self.last_success_at = time.time()
+            self.breaker.record_success()
+        else:
+            self.last_failure_at = time.time()
+            self.breaker.record_failure()
+    
+    def _stream_timeout(self) -> httpx.Timeout:
+        """流式请求的 httpx 超时：读超时作为首帧与帧间期限之外的兜底"""
+        read = max(self.first_token_timeout, self.idle_timeout)
+        return httpx.Timeout(
+            10,
+            connect=self.connect_timeout or None,
+            pool=self.connect_timeout or None,
+            read=read if self.first_token_timeout and self.idle_timeout else None
+        )
+    
+    async def _iter_lines(self, resp: httpx.Response) -> AsyncIterator[str]:
+        """逐行读取上游流，首帧与帧间超过期限时抛出 UpstreamTimeoutError"""
+        watchdog = _StallWatchdog(self.first_token_timeout)
+        lines = resp.aiter_lines()
+        phase = "first_token"
+        try:
+            while True:
+                watchdog.arm()
+                try:
+                    line = await lines.__anext__()
+                except StopAsyncIteration:
+                    return
+                except asyncio.CancelledError:
+                    if not watchdog.consume_timeout():
+                        raise
+                    raise UpstreamTimeoutError(
+                        f"上游 {watchdog.timeout:g} 秒内没有产出内容", code=f"upstream_{phase}_timeout"
+                    )
+                finally:
+                    watchdog.disarm()
+                if line and phase == "first_token":
+                    phase = "idle"
+                    watchdog.timeout = self.idle_timeout
+                watchdog.touch()
+                yield line
+        finally:
+            watchdog.close()
+    
+    def _upstream_error(self, error: Exception) -> UpstreamError:
+        """把调用上游时的异常转换为 UpstreamError"""
+        if isinstance(error, UpstreamError):
+            return error
+        if isinstance(error, httpx.ConnectTimeout):
+            return UpstreamTimeoutError("连接上游超时", code="upstream_connect_timeout")
+        if isinstance(error, httpx.TimeoutException):
+            return UpstreamTimeoutError("读取上游超时", code="upstream_idle_timeout")
+        return UpstreamError(f"请求上游失败: {str(error)}")
     
     def build_headers(self, content_type: str = "application/json") -> Dict[str, str]:
         """
@@ -70,15 +309,23 @@ class AnuNekoAPI:
             模型列表，包含模型名称
         """
         headers = self.build_headers()
+        if not self._begin_call():
+            return None
+        
+        ok = False
         try:
-            async with httpx.AsyncClient(timeout=10) as client:
-                resp = await client.get(self.MODEL_VIEW_URL, headers=headers)
+            async with self._client() as client:
+                resp = await client.get(self.MODEL_VIEW_URL, headers=headers, timeout=10)
+                ok = resp.status_code < 500
                 resp_json = resp.json()
                 return resp_json
         except Exception:
             pass
+        finally:
+            self._end_call(ok)
             
         return None
+    @timed("create_session")
     async def create_session(self, model: str = "Orange Cat") -> Optional[str]:
         """
         创建新会话
@@ -91,22 +338,30 @@ class AnuNekoAPI:
         """
         headers = self.build_headers()
         data = json.dumps({"model": model})
+        if not self._begin_call():
+            return None
         
+        ok = False
+        chat_id = None
         try:
-            async with httpx.AsyncClient(timeout=10) as client:
-                resp = await client.post(self.CHAT_API_URL, headers=headers, content=data)
+            async with self._client() as client:
+                resp = await client.post(self.CHAT_API_URL, headers=headers, content=data, timeout=10)
+                ok = resp.status_code < 500
                 resp_json = resp.json()
-                
                 chat_id = resp_json.get("chat_id") or resp_json.get("id")
-                if chat_id:
-                    # 切换模型以确保一致性
-                    await self.switch_model(chat_id, model)
-                    return chat_id
         except Exception:
             pass
+        finally:
+            self._end_call(ok)
+        
+        if chat_id:
+            # 切换模型以确保一致性
+            await self.switch_model(chat_id, model)
+            return chat_id
             
         return None
     
+    @timed("switch_model")
     async def switch_model(self, chat_id: str, model_name: str) -> bool:
         """
         切换模型
@@ -120,16 +375,23 @@ class AnuNekoAPI:
         """
         headers = self.build_headers()
         data = json.dumps({"chat_id": chat_id, "model": model_name})
+        if not self._begin_call():
+            return False
         
+        ok = False
         try:
-            async with httpx.AsyncClient(timeout=10) as client:
-                resp = await client.post(self.SELECT_MODEL_URL, headers=headers, content=data)
+            async with self._client() as client:
+                resp = await client.post(self.SELECT_MODEL_URL, headers=headers, content=data, timeout=10)
+                ok = resp.status_code < 500
                 return resp.status_code == 200
         except:
             pass
+        finally:
+            self._end_call(ok)
             
         return False
     
+    @timed("send_choice")
     async def send_choice(self, msg_id: str, choice_idx: int = 0) -> bool:
         """
         发送选择回复
@@ -143,16 +405,109 @@ class AnuNekoAPI:
         """
         headers = self.build_headers()
         data = json.dumps({"msg_id": msg_id, "choice_idx": choice_idx})
+        if not self._begin_call():
+            return False
         
+        ok = False
         try:
-            async with httpx.AsyncClient(timeout=5) as client:
-                resp = await client.post(self.SELECT_CHOICE_URL, headers=headers, content=data)
+            async with self._client() as client:
+                resp = await client.post(self.SELECT_CHOICE_URL, headers=headers, content=data, timeout=5)
+                ok = resp.status_code < 500
                 return resp.status_code == 200
         except:
             pass
+        finally:
+            self._end_call(ok)
             
         return False
     
+    async def _confirm_early_close(self, session_uuid: str, msg_id: Optional[str]) -> None:
+        """回复被提前关闭（达到长度或停止序列、客户端断开）时确认分支，失败时记为未确认"""
+        if msg_id and await self.send_choice(msg_id):
+            return
+        with self._state_lock:
+            self._unconfirmed_chats[session_uuid] = None
+            while len(self._unconfirmed_chats) > 1024:
+                self._unconfirmed_chats.popitem(last=False)
+    
+    async def _drain_and_confirm(
+        self,
+        session_uuid: str,
+        resp: httpx.Response,
+        lines: AsyncIterator[str],
+        ok: bool
+    ) -> None:
+        """在后台读完被提前关闭的回复流，取得流末尾的 msg_id 后确认分支
+
+        上游通常只在最后一帧给出 msg_id，调用方截断回复时流中还没有它
+        """
+        msg_id = None
+        try:
+            async for line in lines:
+                if not line.startswith("data: "):
+                    continue
+                try:
+                    j = json_service.loads(line[6:])
+                except Exception:
+                    continue
+                if isinstance(j, dict) and "msg_id" in j:
+                    msg_id = j["msg_id"]
+        except Exception as e:
+            ok = False
+            logger.warning(f"读取被提前关闭的回复流失败: {str(e)}", extra={"session_uuid": session_uuid})
+        finally:
+            await lines.aclose()
+            await resp.aclose()
+            self._end_call(ok)
+        try:
+            await self._confirm_early_close(session_uuid, msg_id)
+        finally:
+            self._confirming.pop(session_uuid, None)
+    
+    async def take_unconfirmed(self, session_uuid: str) -> bool:
+        """上游会话是否有未确认的分支（查询后清除），有则继续对话会收到 chat_choice_shown
+
+        上一轮回复仍在后台等待确认时先等它结束
+        """
+        task = self._confirming.get(session_uuid)
+        if task is not None:
+            await asyncio.shield(task)
+        with self._state_lock:
+            return self._unconfirmed_chats.pop(session_uuid, False) is None
+    
+    def _store_alternates(self, session_uuid: str, msg_id: str, branches: Dict[int, List[str]]) -> None:
+        """缓存一条已完整读完的回复的备选分支"""
+        with self._state_lock:
+            self._alternate_branches[session_uuid] = {
+                "msg_id": msg_id,
+                "branches": {idx: "".join(parts) for idx, parts in sorted(branches.items())}
+            }
+            self._alternate_branches.move_to_end(session_uuid)
+            while len(self._alternate_branches) > self.branch_cache_size:
+                self._alternate_branches.popitem(last=False)
+    
+    async def take_alternate(self, session_uuid: str) -> Optional[str]:
+        """取上游会话最近一条回复的下一个未用过的备选分支，并通过 send_choice 选定该分支
+        
+        Returns:
+            分支文本；没有缓存的分支或选定失败时返回 None
+        """
+        with self._state_lock:
+            entry = self._alternate_branches.get(session_uuid)
+            if not entry:
+                return None
+            idx = next(iter(entry["branches"]))
+            text = entry["branches"].pop(idx)
+            msg_id = entry["msg_id"]
+            if not entry["branches"]:
+                del self._alternate_branches[session_uuid]
+        if not await self.send_choice(msg_id, idx):
+            # 选定结果不明，剩下的分支也不再可靠
+            with self._state_lock:
+                self._alternate_branches.pop(session_uuid, None)
+            return None
+        return text
+    
     async def stream_reply(self, session_uuid: str, text: str) -> str:
         """
         流式发送消息并获取回复
@@ -167,22 +522,27 @@ class AnuNekoAPI:
         headers = self.build_headers("text/plain")
         
         url = self.STREAM_API_URL.format(uuid=session_uuid)
-        data = json.dumps({"contents": [text]}, ensure_ascii=False)
+        data = json_service.dumps_bytes({"contents": [text]})
         
         result = ""
         current_msg_id = None
         
+        if not self._begin_call():
+            return "请求失败，请稍后再试。"
+        
+        ok = False
         try:
-            async with httpx.AsyncClient(timeout=None) as client:
-                async with client.stream("POST", url, headers=headers, content=data) as resp:
-                    async for line in resp.aiter_lines():
+            async with self._client() as client:
+                async with client.stream("POST", url, headers=headers, content=data, timeout=self._stream_timeout()) as resp:
+                    ok = resp.status_code < 500
+                    async for line in self._iter_lines(resp):
                         if not line:
                             continue
                         
                         # 处理错误响应
                         if not line.startswith("data: "):
                             try:
-                                error_json = json.loads(line)
+                                error_json = json_service.loads(line)
                                 if error_json.get("code") == "chat_choice_shown":
                                     return "⚠️ 检测到对话分支未选择，请重试或新建会话。"
                             except:
@@ -195,7 +555,7 @@ class AnuNekoAPI:
                             if not raw_json.strip():
                                 continue
                                 
-                            j = json.loads(raw_json)
+                            j = json_service.loads(raw_json)
                             
                             # 只要出现 msg_id 就更新，流最后一条通常是 assistmsg，也就是我们要的 ID
                             if "msg_id" in j:
@@ -218,22 +578,31 @@ class AnuNekoAPI:
                         except:
                             continue
             
-            # 流结束后，如果有 msg_id，自动确认选择第一项，确保下次对话正常
-            if current_msg_id:
-                await self.send_choice(current_msg_id)
-                
         except Exception:
+            ok = False
             return "请求失败，请稍后再试。"
+        finally:
+            self._end_call(ok)
+        
+        # 流结束后，如果有 msg_id，自动确认选择第一项，确保下次对话正常
+        if current_msg_id:
+            await self.send_choice(current_msg_id)
             
         return result
     
-    async def stream_reply_generator(self, session_uuid: str, text: str) -> AsyncGenerator[str, None]:
+    async def stream_reply_generator(
+        self,
+        session_uuid: str,
+        text: Union[str, List[str]],
+        raise_errors: bool = False
+    ) -> AsyncGenerator[str, None]:
         """
         流式发送消息并生成器方式获取回复
         
         Args:
             session_uuid: 会话 UUID
-            text: 要发送的文本
+            text: 要发送的文本，也可以是多段内容（作为 contents 数组发送）
+            raise_errors: 失败时抛出 UpstreamError，而不是把提示文本作为回复片段产出
             
         Yields:
             AI 的回复文本片段
@@ -241,60 +610,108 @@ class AnuNekoAPI:
         headers = self.build_headers("text/plain")
         
         url = self.STREAM_API_URL.format(uuid=session_uuid)
-        data = json.dumps({"contents": [text]}, ensure_ascii=False)
+        contents = text if isinstance(text, list) else [text]
+        data = json_service.dumps_bytes({"contents": contents})
         
         current_msg_id = None
+        # 备选分支（索引 > 0）的片段，回复完整读完后缓存供重新生成使用
+        alternates: Dict[int, List[str]] = {}
+        # 新一轮对话使之前缓存的分支失效
+        with self._state_lock:
+            self._alternate_branches.pop(session_uuid, None)
         
+        if not self._begin_call():
+            if raise_errors:
+                raise UpstreamError("上游暂不可用（熔断中）", code="circuit_open", status_code=503)
+            yield "请求失败，请稍后再试。"
+            return
+        
+        ok = False
+        resp = None
+        lines = None
+        # 提前关闭时由后台任务接管响应流，负责关闭它并结束本次上游调用
+        handed_off = False
         try:
-            async with httpx.AsyncClient(timeout=None) as client:
-                async with client.stream("POST", url, headers=headers, content=data) as resp:
-                    async for line in resp.aiter_lines():
-                        if not line:
+            async with self._client() as client:
+                request = client.build_request("POST", url, headers=headers, content=data, timeout=self._stream_timeout())
+                resp = await client.send(request, stream=True)
+                ok = resp.status_code < 500
+                if not ok and raise_errors:
+                    raise UpstreamError(f"上游返回 HTTP {resp.status_code}")
+                lines = self._iter_lines(resp)
+                async for line in lines:
+                    if not line:
+                        continue
+                    
+                    # 处理错误响应
+                    if not line.startswith("data: "):
+                        try:
+                            error_json = json_service.loads(line)
+                            if error_json.get("code") == "chat_choice_shown":
+                                yield "⚠️ 检测到对话分支未选择，请重试或新建会话。"
+                                return
+                        except:
+                            pass
+                        continue
+                    
+                    # 处理 data: {}
+                    try:
+                        raw_json = line[6:]
+                        if not raw_json.strip():
                             continue
+                            
+                        j = json_service.loads(raw_json)
                         
-                        # 处理错误响应
-                        if not line.startswith("data: "):
-                            try:
-                                error_json = json.loads(line)
-                                if error_json.get("code") == "chat_choice_shown":
-                                    yield "⚠️ 检测到对话分支未选择，请重试或新建会话。"
-                                    return
-                            except:
-                                pass
-                            continue
+                        # 只要出现 msg_id 就更新，流最后一条通常是 assistmsg，也就是我们要的 ID
+                        if "msg_id" in j:
+                            current_msg_id = j["msg_id"]
                         
-                        # 处理 data: {}
-                        try:
-                            raw_json = line[6:]
-                            if not raw_json.strip():
-                                continue
-                                
-                            j = json.loads(raw_json)
-                            
-                            # 只要出现 msg_id 就更新，流最后一条通常是 assistmsg，也就是我们要的 ID
-                            if "msg_id" in j:
-                                current_msg_id = j["msg_id"]
-                            
-                            # 如果有 'c' 字段，说明是多分支内容
-                            # 格式如: {"c":[{"v":"..."},{"v":"...","c":1}]}
-                            if "c" in j and isinstance(j["c"], list):
-                                for choice in j["c"]:
-                                    # 默认选项 idx=0，可能显式 c=0 或隐式(无 c 字段)
-                                    idx = choice.get("c", 0)
-                                    if idx == 0:
-                                        if "v" in choice:
-                                            yield choice["v"]
+                        # 如果有 'c' 字段，说明是多分支内容
+                        # 格式如: {"c":[{"v":"..."},{"v":"...","c":1}]}
+                        if "c" in j and isinstance(j["c"], list):
+                            for choice in j["c"]:
+                                # 默认选项 idx=0，可能显式 c=0 或隐式(无 c 字段)
+                                idx = choice.get("c", 0)
+                                if idx == 0:
+                                    if "v" in choice:
+                                        yield choice["v"]
+                                elif isinstance(choice.get("v"), str) and self.branch_cache_size > 0:
+                                    alternates.setdefault(idx, []).append(choice["v"])
+                        
+                        # 常规内容 (兼容旧格式或无分支情况)
+                        elif "v" in j and isinstance(j["v"], str):
+                            yield j["v"]
                             
-                            # 常规内容 (兼容旧格式或无分支情况)
-                            elif "v" in j and isinstance(j["v"], str):
-                                yield j["v"]
-                                
-                        except:
-                            continue
-            
-            # 流结束后，如果有 msg_id，自动确认选择第一项，确保下次对话正常
-            if current_msg_id:
-                await self.send_choice(current_msg_id)
-                
-        except Exception:
-            yield "请求失败，请稍后再试。"
\ No newline at end of file
+                    except Exception:
+                        # 只跳过无法解析的行，调用方关闭生成器时的 GeneratorExit 必须向外传播
+                        continue
+        
+        except GeneratorExit:
+            # 调用方提前关闭（达到长度或停止序列、客户端断开）：仍需确认分支，会话才能继续使用；
+            # 还没有收到 msg_id 时在后台读完剩余的流再确认，下一轮会先等待确认结束
+            if current_msg_id is None and lines is not None and not resp.is_closed:
+                handed_off = True
+                self._confirming[session_uuid] = asyncio.get_running_loop().create_task(
+                    self._drain_and_confirm(session_uuid, resp, lines, ok)
+                )
+            else:
+                await self._confirm_early_close(session_uuid, current_msg_id)
+            raise
+        except Exception as e:
+            ok = False
+            if raise_errors:
+                raise self._upstream_error(e) from e
+            yield "请求失败，请稍后再试。"
+            return
+        finally:
+            if not handed_off:
+                if lines is not None:
+                    await lines.aclose()
+                if resp is not None:
+                    await resp.aclose()
+                self._end_call(ok)
+        
+        # 流结束后，如果有 msg_id，自动确认选择第一项，确保下次对话正常
+        if current_msg_id:
+            if await self.send_choice(current_msg_id) and alternates:
+                self._store_alternates(session_uuid, current_msg_id, alternates)
\ No newline at end of file
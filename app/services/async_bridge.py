@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+异步桥接
+在后台线程中运行常驻事件循环，Flask 线程通过它执行协程，
+从而让上游连接池可以跨请求复用
+"""
+
+import time
+import asyncio
+import contextvars
+import threading
+import concurrent.futures
+from typing import Any, AsyncGenerator, Awaitable, Callable, Generator, Optional
+
+
+class AsyncBridge:
+    """常驻事件循环桥接类"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # 阻塞调用结束时的回调 (标签, 耗时秒)，供事件循环监控统计
+        self.on_blocking_call: Optional[Callable[[str, float], None]] = None
+
+    @property
+    def thread(self) -> Optional[threading.Thread]:
+        """事件循环线程，尚未启动时为 None"""
+        return self._thread
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """获取常驻事件循环，首次访问时启动后台线程"""
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    ready = threading.Event()
+
+                    def run_loop():
+                        asyncio.set_event_loop(loop)
+                        loop.call_soon(ready.set)
+                        loop.run_forever()
+
+                    self._thread = threading.Thread(target=run_loop, name="anuneko-async-loop", daemon=True)
+                    self._thread.start()
+                    ready.wait()
+                    self._loop = loop
+        return self._loop
+
+    def in_loop_thread(self) -> bool:
+        """当前线程是否就是事件循环线程"""
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro: Awaitable[Any]) -> concurrent.futures.Future:
+        """提交协程到常驻事件循环，立即返回 Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def submit_background(self, coro: Awaitable[Any]) -> concurrent.futures.Future:
+        """提交与当前请求无关的后台协程：不继承当前线程的 contextvars（日志上下文、请求计时）"""
+        return contextvars.Context().run(self.submit, coro)
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None, label: Optional[str] = None) -> Any:
+        """在常驻事件循环中执行协程并阻塞等待结果
+
+        label 为阻塞耗时统计的标签，默认取协程名
+        """
+        if self.in_loop_thread():
+            raise RuntimeError("不能在事件循环线程中阻塞等待协程")
+        if label is None:
+            label = getattr(coro, "__qualname__", type(coro).__name__)
+        start = time.perf_counter()
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+        finally:
+            if self.on_blocking_call is not None:
+                self.on_blocking_call(label, time.perf_counter() - start)
+
+    def iterate(self, agen: AsyncGenerator[Any, None]) -> Generator[Any, None, None]:
+        """以同步生成器的方式逐项消费异步生成器"""
+        label = f"iterate:{getattr(agen, '__qualname__', type(agen).__name__)}"
+        try:
+            while True:
+                try:
+                    yield self.run(agen.__anext__(), label=label)
+                except StopAsyncIteration:
+                    break
+        finally:
+            # 客户端提前断开时关闭异步生成器，释放上游连接
+            self.run(agen.aclose(), label=label)
+
+
+# 全局异步桥接实例
+async_bridge = AsyncBridge()
@@ -4,31 +4,61 @@
 处理聊天完成相关的逻辑
 """
 
-import json
 import time
 import uuid
-import asyncio
-from typing import Dict, Any, Generator
+import os
+import threading
+from typing import Dict, Any, AsyncGenerator, List, Optional
 
 from flask import Response, stream_with_context
 
-from app.services.anuneko_service import AnuNekoAPI
-from app.services.session_service import session_service
+from app.services import json_service
+from app.services.anuneko_service import AnuNekoAPI, UpstreamError
+from app.services.session_service import session_service, SessionNotFoundError
+from app.services.async_bridge import async_bridge
+from app.services.stream_buffer import ReplayBuffer, ReplayExpiredError, stream_buffer_service
+from app.services.hedging_service import hedging_service
+from app.services.priming_service import message_text
+from app.services.template_service import template_service
+from app.services.scheduler_service import scheduler_service
+from app.services.limiter_service import limiter_service
+from app.services.reply_limits import ReplyLimits
+from app.services.model_router import model_router
+from app.services.timing_service import timing_service, current_timing, phase, record
+from app.services.metrics_service import metrics_service
+from app.services.log_service import get_logger
+
+logger = get_logger("chat")
 
 
 class ChatService:
     """聊天服务类"""
     
     def __init__(self):
-        self._anuneko_api: AnuNekoAPI = None
+        # 正在进行中的聊天请求数及容量（供就绪检查使用）
+        self.active_streams = 0
+        self.MAX_CONCURRENT_STREAMS = int(os.environ.get("MAX_CONCURRENT_STREAMS", 64))
+        self._active_lock = threading.Lock()
+        # 上游迟迟没有新内容时发送 SSE 注释心跳的间隔（秒），防止中间代理断开空闲连接
+        self.STREAM_HEARTBEAT_INTERVAL = float(os.environ.get("STREAM_HEARTBEAT_INTERVAL", 15))
+        # 尚未产出任何内容就失败时，换新的上游会话重试的次数
+        self.UPSTREAM_RETRIES = int(os.environ.get("UPSTREAM_RETRIES", 1))
+        # 重新生成请求数及其中直接由缓存的备选分支返回的次数
+        self.regenerate_stats = {"requests": 0, "from_cache": 0}
+    
+    def get_anuneko_api(self, api_key: str = None) -> AnuNekoAPI:
+        """获取 AnuNeko API 实例（与会话服务共用同一个实例，启用租户账号时按 API Key 选择）"""
+        return session_service.get_anuneko_api(api_key)
+    
+    def _stream_started(self) -> None:
+        with self._active_lock:
+            self.active_streams += 1
     
-    def get_anuneko_api(self) -> AnuNekoAPI:
-        """获取 AnuNeko API 实例"""
-        if self._anuneko_api is None:
-            self._anuneko_api = AnuNekoAPI()
-        return self._anuneko_api
+    def _stream_finished(self) -> None:
+        with self._active_lock:
+            self.active_streams -= 1
     
-    def format_openai_response(self, model: str, content: str, session_id: str = None) -> Dict[str, Any]:
+    def format_openai_response(self, model: str, content: str, session_id: str = None, finish_reason: str = "stop") -> Dict[str, Any]:
         """格式化 OpenAI API 响应"""
         return {
             "id": f"chatcmpl-{uuid.uuid4().hex[:8]}",
@@ -42,7 +72,7 @@ class ChatService:
                         "role": "assistant",
                         "content": content
                     },
-                    "finish_reason": "stop"
+                    "finish_reason": finish_reason
                 }
             ],
             "usage": {
@@ -53,10 +83,16 @@ class ChatService:
             "session_id": session_id
         }
     
-    def format_openai_chunk(self, model: str, content: str, session_id: str = None) -> str:
+    def format_openai_chunk(
+        self,
+        model: str,
+        content: str,
+        session_id: str = None,
+        completion_id: str = None
+    ) -> str:
         """格式化 OpenAI API 流式响应块"""
         chunk = {
-            "id": f"chatcmpl-{uuid.uuid4().hex[:8]}",
+            "id": completion_id or f"chatcmpl-{uuid.uuid4().hex[:8]}",
             "object": "chat.completion.chunk",
             "created": int(time.time()),
             "model": model,
@@ -74,10 +110,353 @@ class ChatService:
         if session_id:
             chunk["session_id"] = session_id
         
-        return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        return f"data: {json_service.dumps(chunk)}\n\n"
+    
+    def _upstream_stream(
+        self,
+        session: Dict[str, Any],
+        session_id: str,
+        user_message: str,
+        messages: List[Dict[str, Any]],
+        api_key: str = None
+    ) -> AsyncGenerator[str, None]:
+        """发送一轮用户消息并返回上游回复片段的异步生成器
+        
+        新对话的首轮回复允许对冲请求，备用会话胜出时改绑当前会话；
+        启用历史预热时，首轮请求同时带上 system 提示词和之前的对话；
+        上游会话已预热 system 提示词时不再发送，也不对冲（备用会话没有预热）
+        """
+        is_new_conversation = session.get("turns", 0) == 0
+        session["turns"] = session.get("turns", 0) + 1
+        system_primed = session.get("system_primed", False)
+        if is_new_conversation:
+            text = template_service.first_turn_contents(messages, user_message, system_primed)
+        else:
+            text = user_message
+        return hedging_service.stream(
+            self.get_anuneko_api(session.get("api_key")),
+            session["anuneko_chat_id"],
+            text,
+            session["model"],
+            api_key=api_key,
+            hedge=is_new_conversation and not system_primed,
+            on_switch=lambda chat_id: session_service.rebind_chat(session_id, chat_id)
+        )
+    
+    async def _fresh_chat(self, session_id: str, session: Dict[str, Any], anuneko_model: str = None) -> bool:
+        """为会话换一个新的上游会话，用于首帧前失败时重试；指定 anuneko_model 时同时换用该模型"""
+        anuneko_model = anuneko_model or session["model"]
+        api = self.get_anuneko_api(session.get("api_key"))
+        chat_id = session_service.acquire_spare_chat(anuneko_model) if session_service.is_shared_api(api) else None
+        if chat_id is None:
+            chat_id = await api.create_session(anuneko_model)
+        if chat_id is None:
+            return False
+        session_service.rebind_chat(session_id, chat_id)
+        session["model"] = anuneko_model
+        session["turns"] = 0
+        session["system_primed"] = False
+        return True
+    
+    async def _reply_chunks(
+        self,
+        session: Dict[str, Any],
+        session_id: str,
+        user_message: str,
+        messages: List[Dict[str, Any]],
+        api_key: str = None,
+        interactive: bool = True,
+        regenerate: bool = False,
+        outcome: Optional[Dict[str, Any]] = None
+    ) -> AsyncGenerator[str, None]:
+        """上游回复片段，尚未产出内容就失败或超时时换新的上游会话重试
+        
+        整个回复（含重试）占用一个上游调度名额；重新生成时优先直接返回上一条回复缓存的备选分支，
+        不占用名额也不请求生成
+        
+        Args:
+            outcome: 传入时记录是否请求了上游（upstream）以及产出内容的那次上游请求的首帧耗时（ttft，
+                不含排队时间），供并发限制器采样
+        
+        Raises:
+            UpstreamError: 排队超时、已产出内容后失败，或重试次数用尽
+        """
+        if regenerate:
+            self.regenerate_stats["requests"] += 1
+            alternate = await self.get_anuneko_api(session.get("api_key")).take_alternate(session["anuneko_chat_id"])
+            if alternate is not None:
+                self.regenerate_stats["from_cache"] += 1
+                logger.info("重新生成：使用缓存的备选分支", extra={"session_id": session_id, "reply_chars": len(alternate)})
+                yield alternate
+                return
+        queue_start = time.perf_counter()
+        async with scheduler_service.slot(api_key, interactive):
+            record("queue", time.perf_counter() - queue_start)
+            if await self.get_anuneko_api(session.get("api_key")).take_unconfirmed(session["anuneko_chat_id"]):
+                # 上一轮回复被提前关闭且分支未能确认，原上游会话无法继续对话
+                logger.info("上一轮回复的分支未确认，换新的上游会话", extra={"session_id": session_id})
+                await self._fresh_chat(session_id, session)
+            attempt = 0
+            while True:
+                emitted = False
+                ok = None
+                upstream_start = time.perf_counter()
+                if outcome is not None:
+                    outcome["upstream"] = True
+                first_chunk_at = last_chunk_at = None
+                # 按模型统计进行中的请求、首帧耗时与失败，供模型别名选择负载最轻的模型
+                attempt_model = session["model"]
+                model_router.started(attempt_model)
+                upstream = self._upstream_stream(session, session_id, user_message, messages, api_key)
+                try:
+                    async for chunk in upstream:
+                        last_chunk_at = time.perf_counter()
+                        if not emitted:
+                            emitted = True
+                            first_chunk_at = last_chunk_at
+                            record("ttft", first_chunk_at - upstream_start)
+                            if outcome is not None:
+                                outcome["ttft"] = first_chunk_at - upstream_start
+                        yield chunk
+                    ok = True
+                    return
+                except UpstreamError as e:
+                    ok = False
+                    if emitted or attempt >= self.UPSTREAM_RETRIES:
+                        raise
+                    attempt += 1
+                    logger.warning(
+                        f"上游未产出内容即失败，换新会话重试: {str(e)}",
+                        extra={"code": e.code, "attempt": attempt}
+                    )
+                    fallback = None
+                    if session.get("alias"):
+                        # 使用模型别名的会话改用其他候选模型重试
+                        fallback = model_router.choose(
+                            session["alias"], session_service.MODEL_MAPPING, exclude={attempt_model}
+                        )
+                    if not await self._fresh_chat(session_id, session, fallback):
+                        raise
+                finally:
+                    await upstream.aclose()
+                    model_router.finished(
+                        attempt_model,
+                        first_chunk_at - upstream_start if first_chunk_at is not None else None,
+                        ok
+                    )
+                    if first_chunk_at is not None:
+                        record("stream", last_chunk_at - first_chunk_at)
+    
+    async def _limited(self, upstream: AsyncGenerator[str, None], limits: ReplyLimits) -> AsyncGenerator[str, None]:
+        """按 max_tokens / stop 截断回复，触发限制后立即关闭上游流"""
+        try:
+            async for chunk in upstream:
+                text = limits.feed(chunk)
+                if text:
+                    yield text
+                if limits.finish_reason is not None:
+                    logger.info(
+                        "回复达到限制，提前关闭上游流",
+                        extra={"finish_reason": limits.finish_reason, "estimated_tokens": round(limits.tokens)}
+                    )
+                    return
+            tail = limits.flush()
+            if tail:
+                yield tail
+        finally:
+            await upstream.aclose()
+    
+    async def _admitted(self, upstream: AsyncGenerator[str, None], outcome: Dict[str, Any]) -> AsyncGenerator[str, None]:
+        """透传已通过并发限制的回复，结束时归还名额并把上游首帧耗时与成败反馈给限制器
+
+        outcome 由 _reply_chunks 填写；没有请求上游（如重新生成命中缓存的备选分支、排队超时）时不计入样本
+        """
+        ok = None
+        try:
+            async for chunk in upstream:
+                yield chunk
+            ok = True
+        except UpstreamError:
+            ok = False
+            raise
+        finally:
+            await upstream.aclose()
+            limiter_service.release(outcome.get("ttft"), ok if outcome.get("upstream") else None)
+    
+    async def session_reply(
+        self,
+        session: Dict[str, Any],
+        session_id: str,
+        user_message: str,
+        api_key: str = None
+    ) -> AsyncGenerator[str, None]:
+        """在已绑定的会话上发送一轮消息（供 WebSocket 等长连接使用），计入进行中的聊天请求
+        
+        Raises:
+            UpstreamError: 超过自适应并发上限（code 为 overloaded）或上游失败
+        """
+        if not limiter_service.try_acquire():
+            raise UpstreamError("服务繁忙，请稍后重试", code="overloaded", status_code=503)
+        self._stream_started()
+        outcome: Dict[str, Any] = {}
+        try:
+            async for chunk in self._admitted(self._reply_chunks(
+                session, session_id, user_message, [{"role": "user", "content": user_message}], api_key, outcome=outcome
+            ), outcome):
+                yield chunk
+        finally:
+            self._stream_finished()
+
+    def format_upstream_error(self, error: UpstreamError) -> Dict[str, Any]:
+        """格式化上游错误为 OpenAI 风格的错误体"""
+        return {
+            "error": {
+                "message": str(error),
+                "type": "upstream_error",
+                "code": error.code
+            }
+        }
+    
+    async def _collect_reply(self, upstream: AsyncGenerator[str, None]) -> str:
+        """读完上游回复并拼接为完整文本"""
+        return "".join([chunk async for chunk in upstream])
+    
+    async def _produce_stream(
+        self,
+        buffer: ReplayBuffer,
+        upstream: AsyncGenerator[str, None],
+        model: str,
+        session_id: str,
+        limits: ReplyLimits = None
+    ) -> None:
+        """读取上游流并写入重放缓冲，客户端断开后仍会读完，供重连续传"""
+        self._stream_started()
+        
+        start = time.perf_counter()
+        first_chunk_at = None
+        chunk_count = 0
+        
+        try:
+            async for chunk in upstream:
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                chunk_count += 1
+                buffer.append(self.format_openai_chunk(model, chunk, session_id, buffer.completion_id))
+            
+            # 发送结束块
+            end_chunk = {
+                "id": buffer.completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {},
+                        "finish_reason": (limits and limits.finish_reason) or "stop"
+                    }
+                ]
+            }
+            buffer.append(f"data: {json_service.dumps(end_chunk)}\n\n")
+            buffer.append("data: [DONE]\n\n")
+        except UpstreamError as e:
+            # 以错误帧结束流，客户端不会一直等待
+            logger.warning(f"上游流失败: {str(e)}", extra={"code": e.code, "chunks": chunk_count})
+            buffer.append(f"data: {json_service.dumps(self.format_upstream_error(e))}\n\n")
+            buffer.append("data: [DONE]\n\n")
+        except Exception as e:
+            logger.exception(f"读取上游流失败: {str(e)}")
+        finally:
+            timing = current_timing()
+            if timing is not None:
+                # 流式响应的响应头发出时上游还没开始，完整的耗时分解以末尾的 SSE 注释返回
+                buffer.append(f": server-timing {timing.header()}\n\n")
+                timing_service.log(timing)
+            buffer.finish()
+            self._stream_finished()
+            logger.info(
+                "流式回复结束",
+                extra={
+                    "completion_id": buffer.completion_id,
+                    "chunks": chunk_count,
+                    "ttft_ms": round((first_chunk_at - start) * 1000, 2) if first_chunk_at else None,
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 2)
+                }
+            )
+    
+    def stream_response(self, buffer: ReplayBuffer, from_seq: int) -> Response:
+        """从重放缓冲的 from_seq 开始输出 SSE 事件，每个事件带 id 供断线重连"""
+        def generate():
+            next_seq = from_seq
+            while True:
+                try:
+                    events, finished = buffer.wait_events(next_seq, timeout=self.STREAM_HEARTBEAT_INTERVAL)
+                except ReplayExpiredError as e:
+                    # 客户端读得太慢，未读的事件已被移出缓冲：以错误帧结束，不让异常中断连接
+                    logger.warning(
+                        f"客户端读取落后于重放缓冲: {str(e)}",
+                        extra={"completion_id": buffer.completion_id, "from_seq": next_seq}
+                    )
+                    error = {
+                        "error": {
+                            "message": "客户端读取过慢，部分回复已移出缓冲",
+                            "type": "server_error",
+                            "code": "stream_replay_expired"
+                        }
+                    }
+                    yield f"data: {json_service.dumps(error)}\n\n"
+                    yield "data: [DONE]\n\n"
+                    break
+                if not events and not finished:
+                    yield ": keep-alive\n\n"
+                    continue
+                for seq, data in events:
+                    yield f"id: {buffer.event_id(seq)}\n{data}"
+                    next_seq = seq + 1
+                if finished:
+                    break
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype="text/plain",
+            headers={
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+                "Content-Type": "text/event-stream"
+            }
+        )
     
-    def process_chat_request(self, request_data: Dict[str, Any], api_key: str = None):
-        """处理聊天请求（支持智能会话管理）"""
+    def resume_stream(self, last_event_id: str, api_key: str = None):
+        """根据 Last-Event-ID 从重放缓冲续传，不会再次请求上游"""
+        resolved = stream_buffer_service.resolve(last_event_id, api_key)
+        if resolved is None or not resolved[0].can_resume(resolved[1]):
+            return {
+                "error": {
+                    "message": "流不存在、已过期或续传位置已超出缓冲范围",
+                    "type": "invalid_request_error",
+                    "code": "stream_not_found"
+                }
+            }, 404
+        
+        buffer, from_seq = resolved
+        logger.info(
+            "断线重连续传",
+            extra={"completion_id": buffer.completion_id, "from_seq": from_seq}
+        )
+        return self.stream_response(buffer, from_seq)
+    
+    def process_chat_request(
+        self,
+        request_data: Dict[str, Any],
+        api_key: str = None,
+        priority: str = None,
+        session_id: str = None
+    ):
+        """处理聊天请求（支持智能会话管理）
+        
+        priority 为 interactive / bulk 时指定调度通道，未指定时流式请求走交互通道；
+        指定 session_id（或请求体中带 session_id）时续用该会话，只发送最后一条用户消息
+        """
         if not request_data:
             return {"error": {"message": "请求体不能为空", "type": "invalid_request_error"}}, 400
         
@@ -89,84 +468,83 @@ class ChatService:
         user_message = None
         for msg in reversed(messages):
             if msg.get("role") == "user":
-                user_message = msg.get("content", "")
+                user_message = message_text(msg.get("content", ""))
                 break
         
         if not user_message:
             return {"error": {"message": "未找到用户消息", "type": "invalid_request_error"}}, 400
         
+        try:
+            limits = ReplyLimits.from_request(request_data)
+        except ValueError as e:
+            return {"error": {"message": str(e), "type": "invalid_request_error"}}, 400
+        
+        session_id = session_id or request_data.get("session_id")
+        if session_id is not None and not isinstance(session_id, str):
+            return {"error": {"message": "session_id 必须是字符串", "type": "invalid_request_error"}}, 400
+        
         model = request_data.get("model", "gpt-3.5-turbo")
         stream = request_data.get("stream", False)
+        regenerate = request_data.get("regenerate") is True
+        interactive = stream if priority not in ("interactive", "bulk") else priority == "interactive"
+        
+        # 超过自适应并发上限时立即拒绝，不排队等待
+        if not limiter_service.try_acquire():
+            logger.warning("超过自适应并发上限，拒绝请求", extra={"limit": round(limiter_service.limit, 2)})
+            return limiter_service.overloaded_response()
         
         # 获取或创建会话（传递 API Key 用于智能管理）
-        session_id = session_service.get_session_for_request(request_data, api_key)
+        try:
+            with phase("session"):
+                session_id = session_service.get_session_for_request(request_data, api_key, session_id)
+        except SessionNotFoundError as e:
+            limiter_service.release()
+            return {"error": {"message": str(e), "type": "invalid_request_error", "code": e.code}}, 404
+        except Exception:
+            limiter_service.release()
+            raise
         session = session_service.get_session(session_id)
         
         if stream:
-            # 流式响应
-            def generate():
-                api = self.get_anuneko_api()
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-                try:
-                    async def stream_generator():
-                        async for chunk in api.stream_reply_generator(
-                            session["anuneko_chat_id"], user_message
-                        ):
-                            yield self.format_openai_chunk(model, chunk, session_id)
-                        
-                        # 发送结束块
-                        end_chunk = {
-                            "id": f"chatcmpl-{uuid.uuid4().hex[:8]}",
-                            "object": "chat.completion.chunk",
-                            "created": int(time.time()),
-                            "model": model,
-                            "choices": [
-                                {
-                                    "index": 0,
-                                    "delta": {},
-                                    "finish_reason": "stop"
-                                }
-                            ]
-                        }
-                        yield f"data: {json.dumps(end_chunk, ensure_ascii=False)}\n\n"
-                        yield "data: [DONE]\n\n"
-                    
-                    # 运行异步生成器
-                    async_gen = stream_generator()
-                    while True:
-                        try:
-                            chunk = loop.run_until_complete(async_gen.__anext__())
-                            yield chunk
-                        except StopAsyncIteration:
-                            break
-                finally:
-                    loop.close()
-            
-            return Response(
-                stream_with_context(generate()),
-                mimetype="text/plain",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                    "Content-Type": "text/event-stream"
-                }
+            # 流式响应：上游读取在常驻事件循环中独立进行，事件写入重放缓冲
+            buffer = stream_buffer_service.create(owner=api_key)
+            outcome: Dict[str, Any] = {}
+            upstream = self._reply_chunks(session, session_id, user_message, messages, api_key, interactive, regenerate, outcome)
+            if limits.active:
+                upstream = self._limited(upstream, limits)
+            buffer.task = async_bridge.submit(
+                self._produce_stream(buffer, self._admitted(upstream, outcome), model, session_id, limits)
             )
+            return self.stream_response(buffer, 0)
         else:
             # 非流式响应
-            api = self.get_anuneko_api()
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
+            start = time.perf_counter()
+            self._stream_started()
             try:
-                response = loop.run_until_complete(
-                    api.stream_reply(session["anuneko_chat_id"], user_message)
+                outcome: Dict[str, Any] = {}
+                upstream = self._reply_chunks(session, session_id, user_message, messages, api_key, interactive, regenerate, outcome)
+                if limits.active:
+                    upstream = self._limited(upstream, limits)
+                response = async_bridge.run(self._collect_reply(self._admitted(upstream, outcome)))
+                logger.info(
+                    "非流式回复完成",
+                    extra={
+                        "reply_chars": len(response),
+                        "duration_ms": round((time.perf_counter() - start) * 1000, 2)
+                    }
                 )
-                return self.format_openai_response(model, response, session_id)
+                return self.format_openai_response(model, response, session_id, limits.finish_reason or "stop")
+            except UpstreamError as e:
+                logger.warning(f"非流式回复失败: {str(e)}", extra={"code": e.code})
+                return self.format_upstream_error(e), e.status_code
             finally:
-                loop.close()
+                self._stream_finished()
 
 
 # 全局聊天服务实例
-chat_service = ChatService()
\ No newline at end of file
+chat_service = ChatService()
+metrics_service.register("chat", lambda: {
+    "active_streams": chat_service.active_streams,
+    "max_concurrent_streams": chat_service.MAX_CONCURRENT_STREAMS,
+    "regenerate": dict(chat_service.regenerate_stats)
+})
\ No newline at end of file
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+熔断器
+上游连续失败时快速失败，冷却后放行试探请求
+"""
+
+import time
+import threading
+
+
+class CircuitBreaker:
+    """简单的三态熔断器（closed / open / half_open）"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold: 连续失败多少次后熔断
+            reset_timeout: 熔断后多少秒放行试探请求
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._state = self.CLOSED
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """当前状态，冷却期结束的 open 状态视为 half_open"""
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """是否允许发起上游请求"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at >= self.reset_timeout:
+                # 冷却结束（或上一个试探请求迟迟没有结果），放行一个试探请求
+                self._state = self.HALF_OPEN
+                self.opened_at = now
+                return True
+            return False
+
+    def record_success(self) -> None:
+        """记录一次成功调用"""
+        with self._lock:
+            self.consecutive_failures = 0
+            self._state = self.CLOSED
+
+    def record_failure(self) -> None:
+        """记录一次失败调用"""
+        with self._lock:
+            self.consecutive_failures += 1
+            if self._state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self.opened_at = time.monotonic()
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+集群路由服务
+可选的多实例模式：节点从静态列表互相发现，API Key 与会话 ID 经带虚拟节点的
+一致性哈希环映射到所属节点，非所属节点把聊天与会话请求转发（流式请求逐块代理）
+给所属节点，会话状态因此只需保存在一个进程内；节点上下线时哈希环重新平衡
+"""
+
+import os
+import hmac
+import time
+import uuid
+import bisect
+import hashlib
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+from flask import Flask, Response, request, stream_with_context
+
+from app.services.metrics_service import metrics_service
+from app.services.log_service import get_logger
+
+logger = get_logger("cluster")
+
+# 标记请求已被转发过，接收方一律本地处理，避免成员视图不一致时来回转发；
+# 值为 "<节点地址>;<时间戳>;<签名>"，签名是用 CLUSTER_SECRET 对节点地址和时间戳计算的 HMAC-SHA256
+FORWARDED_HEADER = "X-Cluster-Forwarded"
+# 转发标记的有效期（秒），超过时视为未转发
+FORWARDED_MAX_AGE = 300
+# 不转发的逐跳请求 / 响应头
+HOP_HEADERS = {"host", "connection", "keep-alive", "transfer-encoding", "content-length", "upgrade", "te", "trailer"}
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """带虚拟节点的一致性哈希环"""
+
+    def __init__(self, nodes: Iterable[str], virtual_nodes: int = 128):
+        self.nodes = sorted(set(nodes))
+        points = sorted(
+            (_hash(f"{node}#{i}"), node)
+            for node in self.nodes
+            for i in range(virtual_nodes)
+        )
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        """键所属的节点，环为空时返回 None"""
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+class ClusterService:
+    """集群路由服务类"""
+
+    def __init__(self):
+        self.ENABLED = os.environ.get("CLUSTER_ENABLED", "False").lower() == "true"
+        # 本节点对其他节点可达的地址，如 http://10.0.0.1:8000
+        self.NODE_URL = os.environ.get("CLUSTER_NODE_URL", "").rstrip("/")
+        # 集群全部节点地址（逗号分隔，可以包含本节点）
+        self.PEERS = [
+            peer.strip().rstrip("/")
+            for peer in os.environ.get("CLUSTER_PEERS", "").split(",")
+            if peer.strip()
+        ]
+        self.VIRTUAL_NODES = int(os.environ.get("CLUSTER_VIRTUAL_NODES", 128))
+        # 节点存活探测间隔与超时（秒）
+        self.PROBE_INTERVAL = float(os.environ.get("CLUSTER_PROBE_INTERVAL", 5))
+        self.PROBE_TIMEOUT = float(os.environ.get("CLUSTER_PROBE_TIMEOUT", 2))
+        # 转发时连接所属节点的超时（秒），读取不设超时，由所属节点自己的上游超时与心跳控制
+        self.FORWARD_CONNECT_TIMEOUT = float(os.environ.get("CLUSTER_FORWARD_CONNECT_TIMEOUT", 3))
+        # 节点间共享的密钥，用于签名转发标记；客户端伪造的转发标记不会被信任
+        self.SECRET = os.environ.get("CLUSTER_SECRET", "")
+
+        if self.ENABLED and not self.NODE_URL:
+            logger.error("启用集群模式但未设置 CLUSTER_NODE_URL，集群模式已关闭")
+            self.ENABLED = False
+        if self.ENABLED and not self.SECRET:
+            logger.error("启用集群模式但未设置 CLUSTER_SECRET，集群模式已关闭")
+            self.ENABLED = False
+        if self.NODE_URL and self.NODE_URL not in self.PEERS:
+            self.PEERS.append(self.NODE_URL)
+
+        self.alive = set(self.PEERS)
+        self.ring = HashRing(self.alive, self.VIRTUAL_NODES)
+        self._lock = threading.Lock()
+        self._client: Optional[httpx.Client] = None
+        self._probe_thread: Optional[threading.Thread] = None
+        self.stats = {"local": 0, "forwarded": 0, "forward_errors": 0, "rebalances": 0}
+
+    def owner(self, key: Optional[str]) -> Optional[str]:
+        """键所属节点的地址；未启用集群或没有路由键时返回 None（本地处理）"""
+        if not self.ENABLED or not key:
+            return None
+        return self.ring.owner(key)
+
+    def is_local(self, key: Optional[str]) -> bool:
+        owner = self.owner(key)
+        return owner is None or owner == self.NODE_URL
+
+    def new_session_id(self) -> str:
+        """生成哈希到本节点的会话 ID，之后按会话 ID 的请求会路由回本节点"""
+        session_id = str(uuid.uuid4())
+        if not self.ENABLED:
+            return session_id
+        # 期望尝试次数等于存活节点数
+        for _ in range(len(self.alive) * 16):
+            if self.is_local(session_id):
+                break
+            session_id = str(uuid.uuid4())
+        return session_id
+
+    def set_alive(self, nodes: Iterable[str]) -> None:
+        """更新存活节点，成员变化时重建哈希环"""
+        alive = set(nodes) | {self.NODE_URL}
+        with self._lock:
+            if alive == self.alive:
+                return
+            joined, left = alive - self.alive, self.alive - alive
+            self.alive = alive
+            self.ring = HashRing(alive, self.VIRTUAL_NODES)
+            self.stats["rebalances"] += 1
+        logger.info(
+            "集群成员变化，重新平衡哈希环",
+            extra={"joined": sorted(joined), "left": sorted(left), "members": len(alive)}
+        )
+
+    def mark_down(self, node: str) -> None:
+        """转发失败时立即摘除节点，之后由探测线程在其恢复时重新加入"""
+        self.set_alive(self.alive - {node})
+
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(
+                        timeout=httpx.Timeout(None, connect=self.FORWARD_CONNECT_TIMEOUT),
+                        limits=httpx.Limits(max_connections=256, max_keepalive_connections=64)
+                    )
+        return self._client
+
+    def _probe_loop(self) -> None:
+        while True:
+            alive = []
+            for peer in self.PEERS:
+                if peer == self.NODE_URL:
+                    continue
+                try:
+                    resp = self.client.get(f"{peer}/health/live", timeout=self.PROBE_TIMEOUT)
+                    if resp.status_code == 200:
+                        alive.append(peer)
+                except httpx.HTTPError:
+                    pass
+            self.set_alive(alive)
+            time.sleep(self.PROBE_INTERVAL)
+
+    def routing_key(self) -> Optional[str]:
+        """当前请求的路由键：聊天请求与异步任务按 API Key，会话请求和指定了会话的聊天请求按会话 ID"""
+        path = request.path.rstrip("/")
+        if path == "/v1/chat/completions" and request.method == "POST":
+            session_id = request.headers.get("X-Session-ID")
+            if not session_id:
+                body = request.get_json(silent=True)
+                session_id = body.get("session_id") if isinstance(body, dict) else None
+            if isinstance(session_id, str) and session_id:
+                return session_id
+        if (path == "/v1/chat/completions" and request.method == "POST") or path.startswith("/v1/jobs"):
+            auth_header = request.headers.get("Authorization", "")
+            if auth_header.startswith("Bearer "):
+                return auth_header[7:]
+            return request.headers.get("X-API-Key")
+        if request.path.startswith("/sessions/") and request.method == "DELETE":
+            return request.path[len("/sessions/"):]
+        return None
+
+    def _sign(self, node: str, timestamp: str) -> str:
+        return hmac.new(self.SECRET.encode("utf-8"), f"{node};{timestamp}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def forwarded_marker(self) -> str:
+        """本节点发出的转发标记"""
+        timestamp = str(int(time.time()))
+        return f"{self.NODE_URL};{timestamp};{self._sign(self.NODE_URL, timestamp)}"
+
+    def is_forwarded(self) -> bool:
+        """当前请求是否由集群中的其他节点转发：转发标记来自已知节点、签名正确且未过期"""
+        value = request.headers.get(FORWARDED_HEADER)
+        if not value or not self.SECRET:
+            return False
+        node, _, rest = value.partition(";")
+        timestamp, _, signature = rest.partition(";")
+        if node not in self.PEERS or not timestamp.isdigit():
+            return False
+        if abs(time.time() - int(timestamp)) > FORWARDED_MAX_AGE:
+            return False
+        return hmac.compare_digest(signature, self._sign(node, timestamp))
+
+    def forward(self, node: str) -> Optional[Response]:
+        """把当前请求转发给 node 并逐块透传响应，节点不可达时返回 None"""
+        headers = [
+            (name, value) for name, value in request.headers.items()
+            if name.lower() not in HOP_HEADERS and name.lower() != FORWARDED_HEADER.lower()
+        ]
+        headers.append((FORWARDED_HEADER, self.forwarded_marker()))
+        upstream = self.client.build_request(
+            request.method,
+            node + request.full_path.rstrip("?"),
+            headers=headers,
+            content=request.get_data()
+        )
+        try:
+            resp = self.client.send(upstream, stream=True)
+        except httpx.TransportError as e:
+            self.stats["forward_errors"] += 1
+            logger.warning(f"转发到所属节点失败，改为本地处理: {str(e)}", extra={"node": node})
+            self.mark_down(node)
+            return None
+
+        self.stats["forwarded"] += 1
+
+        def generate():
+            try:
+                for chunk in resp.iter_raw():
+                    yield chunk
+            finally:
+                resp.close()
+
+        return Response(
+            stream_with_context(generate()),
+            status=resp.status_code,
+            headers=[
+                (name, value) for name, value in resp.headers.items()
+                if name.lower() not in HOP_HEADERS
+            ]
+        )
+
+    def gather(self, path: str) -> List[Dict[str, Any]]:
+        """向其他存活节点请求同一只读接口，返回各节点的 JSON 结果（跳过失败的节点）"""
+        results = []
+        for node in sorted(self.alive - {self.NODE_URL}):
+            try:
+                resp = self.client.get(
+                    node + path,
+                    headers={FORWARDED_HEADER: self.forwarded_marker()},
+                    timeout=self.PROBE_TIMEOUT
+                )
+                if resp.status_code == 200:
+                    results.append(resp.json())
+            except (httpx.HTTPError, ValueError) as e:
+                logger.warning(f"获取节点数据失败: {str(e)}", extra={"node": node})
+        return results
+
+    def init_app(self, app: Flask) -> None:
+        """启用时注册转发钩子并启动成员探测线程"""
+        if not self.ENABLED:
+            return
+
+        @app.before_request
+        def route_to_owner():
+            key = self.routing_key()
+            if key is None or self.is_forwarded():
+                return None
+            owner = self.owner(key)
+            if owner == self.NODE_URL:
+                self.stats["local"] += 1
+                return None
+            return self.forward(owner)
+
+        self._probe_thread = threading.Thread(target=self._probe_loop, name="anuneko-cluster-probe", daemon=True)
+        self._probe_thread.start()
+        logger.info("集群模式已启用", extra={"node": self.NODE_URL, "peers": self.PEERS})
+
+    def metrics(self) -> Dict[str, Any]:
+        """集群路由指标"""
+        return {
+            "enabled": self.ENABLED,
+            "node": self.NODE_URL,
+            "members": sorted(self.alive),
+            "peers": len(self.PEERS),
+            **self.stats
+        }
+
+
+# 全局集群路由服务实例
+cluster_service = ClusterService()
+metrics_service.register("cluster", cluster_service.metrics)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+健康检查服务
+区分存活与就绪状态，就绪状态根据饱和度与上游状况判断
+"""
+
+import os
+import time
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from app.services.session_service import session_service
+from app.services.chat_service import chat_service
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.warmup_service import warmup_service
+
+
+class HealthService:
+    """健康检查服务类"""
+
+    VERSION = "1.0.0"
+
+    def __init__(self):
+        # 就绪判断阈值
+        self.MAX_STREAM_UTILIZATION = float(os.environ.get("READY_MAX_STREAM_UTILIZATION", 0.9))
+        self.MAX_POOL_UTILIZATION = float(os.environ.get("READY_MAX_POOL_UTILIZATION", 0.9))
+        # 上游最近失败且超过该秒数没有成功调用时视为失联
+        self.MAX_UPSTREAM_SILENCE = float(os.environ.get("READY_MAX_UPSTREAM_SILENCE", 300))
+        # 模型目录最大年龄（秒），0 表示不检查
+        self.MAX_CATALOG_AGE = float(os.environ.get("READY_MAX_CATALOG_AGE", 0))
+        # 就绪结果缓存时间，探针不会直接触发任何计算或上游调用
+        self.CACHE_TTL = float(os.environ.get("HEALTH_CACHE_TTL", 1.0))
+        self.started_at = time.time()
+        self._cached: Optional[Tuple[float, Dict[str, Any], bool]] = None
+        self._lock = threading.Lock()
+
+    def liveness(self) -> Dict[str, Any]:
+        """存活检查：进程能处理请求即可"""
+        return {
+            "status": "alive",
+            "timestamp": time.time(),
+            "version": self.VERSION
+        }
+
+    def readiness(self) -> Tuple[Dict[str, Any], bool]:
+        """就绪检查，返回 (报告, 是否就绪)"""
+        now = time.monotonic()
+        with self._lock:
+            if self._cached and now - self._cached[0] < self.CACHE_TTL:
+                return self._cached[1], self._cached[2]
+
+        report, ready = self._evaluate()
+        with self._lock:
+            self._cached = (now, report, ready)
+        return report, ready
+
+    def _evaluate(self) -> Tuple[Dict[str, Any], bool]:
+        now = time.time()
+        reasons = []
+
+        # 进行中的聊天请求
+        streams_capacity = chat_service.MAX_CONCURRENT_STREAMS
+        streams_active = chat_service.active_streams
+        stream_utilization = streams_active / streams_capacity if streams_capacity else 0.0
+        if stream_utilization >= self.MAX_STREAM_UTILIZATION:
+            reasons.append("streams_saturated")
+
+        # 只读取已存在的上游客户端，探针不会创建客户端或发起上游请求
+        api = session_service._anuneko_api
+        upstream: Dict[str, Any] = {
+            "connections_in_use": 0,
+            "connections_capacity": None,
+            "circuit_state": CircuitBreaker.CLOSED,
+            "last_success_age_s": None,
+            "last_failure_age_s": None
+        }
+        if api is not None:
+            upstream.update({
+                "connections_in_use": api.in_flight,
+                "connections_capacity": api.max_connections,
+                "circuit_state": api.breaker.state,
+                "last_success_age_s": round(now - api.last_success_at, 1) if api.last_success_at else None,
+                "last_failure_age_s": round(now - api.last_failure_at, 1) if api.last_failure_at else None
+            })
+            if api.max_connections and api.in_flight / api.max_connections >= self.MAX_POOL_UTILIZATION:
+                reasons.append("connection_pool_saturated")
+            if upstream["circuit_state"] == CircuitBreaker.OPEN:
+                reasons.append("circuit_open")
+            # 仅在最近一次调用失败时才把长时间无成功调用视为失联，空闲实例不受影响
+            last_ok = api.last_success_at or self.started_at
+            if api.last_failure_at and last_ok < api.last_failure_at:
+                if now - last_ok > self.MAX_UPSTREAM_SILENCE:
+                    reasons.append("upstream_unreachable")
+
+        updated_at = session_service.model_mapping_updated_at
+        catalog_age = round(now - updated_at, 1) if updated_at else None
+        if self.MAX_CATALOG_AGE and (catalog_age is None or catalog_age > self.MAX_CATALOG_AGE):
+            reasons.append("catalog_stale")
+
+        # 启动预热完成前不接收流量，避免冷启动请求挤在同步路径上
+        if warmup_service.in_progress:
+            reasons.append("warming_up")
+
+        ready = not reasons
+        report = {
+            "status": "ready" if ready else "not_ready",
+            "reasons": reasons,
+            "timestamp": now,
+            "version": self.VERSION,
+            "streams": {
+                "in_flight": streams_active,
+                "capacity": streams_capacity,
+                "utilization": round(stream_utilization, 3)
+            },
+            "upstream": upstream,
+            "catalog": {
+                "models": len(session_service.MODEL_MAPPING),
+                "age_s": catalog_age
+            },
+            "warmup": warmup_service.status(),
+            "spare_sessions": session_service.spare_chat_counts()
+        }
+        return report, ready
+
+
+# 全局健康检查服务实例
+health_service = HealthService()
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+对冲请求服务
+新对话的首个上游回复迟迟没有首帧时，在另一个上游会话上发起同样的请求，
+先产出内容的一方胜出，另一方被取消并丢弃其会话
+"""
+
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from typing import AsyncGenerator, Callable, Deque, List, Optional, Tuple, Union
+
+from app.services.anuneko_service import AnuNekoAPI
+from app.services.session_service import session_service
+from app.services.metrics_service import metrics_service
+from app.services.log_service import get_logger
+
+logger = get_logger("hedging")
+
+
+class HedgeBudget:
+    """按 API Key 限制对冲比例的令牌桶：每个请求积累 ratio 个令牌，每次对冲消耗 1 个
+
+    只记录令牌未满的 Key（令牌满与从未出现等价），最多 max_keys 个，超出时淘汰最久未使用的
+    """
+
+    def __init__(self, ratio: float, burst: float, max_keys: int = 4096):
+        self.ratio = ratio
+        self.burst = burst
+        self.max_keys = max_keys
+        self._tokens: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _set(self, key: str, tokens: float) -> None:
+        """调用方持有锁"""
+        if tokens >= self.burst:
+            self._tokens.pop(key, None)
+            return
+        self._tokens[key] = tokens
+        self._tokens.move_to_end(key)
+        while len(self._tokens) > self.max_keys:
+            self._tokens.popitem(last=False)
+
+    def earn(self, key: str) -> None:
+        with self._lock:
+            self._set(key, min(self.burst, self._tokens.get(key, self.burst) + self.ratio))
+
+    def take(self, key: str) -> bool:
+        with self._lock:
+            tokens = self._tokens.get(key, self.burst)
+            if tokens < 1:
+                return False
+            self._set(key, tokens - 1)
+            return True
+
+
+class HedgingService:
+    """对冲请求服务类"""
+
+    def __init__(self):
+        self.ENABLED = os.environ.get("HEDGING_ENABLED", "False").lower() == "true"
+        # 对冲延迟取最近首帧耗时的该百分位，并限制在 [MIN_DELAY, MAX_DELAY] 之间
+        self.PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", 95))
+        self.MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", 0.5))
+        self.MAX_DELAY = float(os.environ.get("HEDGE_MAX_DELAY", 5))
+        # 样本不足时使用的默认延迟
+        self.DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", 2))
+        self.MIN_SAMPLES = 20
+        self.budget = HedgeBudget(
+            ratio=float(os.environ.get("HEDGE_BUDGET_RATIO", 0.1)),
+            burst=float(os.environ.get("HEDGE_BUDGET_BURST", 3))
+        )
+        self._ttft_samples: Deque[float] = deque(maxlen=500)
+        self.stats = {"hedged": 0, "backup_wins": 0, "budget_denied": 0}
+
+    def record_ttft(self, seconds: float) -> None:
+        """记录一次首帧耗时"""
+        self._ttft_samples.append(seconds)
+
+    def hedge_delay(self) -> float:
+        """根据最近的首帧耗时分布计算对冲延迟"""
+        samples = sorted(self._ttft_samples)
+        if len(samples) < self.MIN_SAMPLES:
+            return self.DEFAULT_DELAY
+        index = min(len(samples) - 1, int(len(samples) * self.PERCENTILE / 100))
+        return max(self.MIN_DELAY, min(self.MAX_DELAY, samples[index]))
+
+    async def stream(
+        self,
+        api: AnuNekoAPI,
+        chat_id: str,
+        text: Union[str, List[str]],
+        anuneko_model: str,
+        api_key: Optional[str] = None,
+        hedge: bool = False,
+        on_switch: Optional[Callable[[str], None]] = None
+    ) -> AsyncGenerator[str, None]:
+        """带对冲的上游流式回复
+
+        Args:
+            api: AnuNeko API 实例
+            chat_id: 主请求使用的上游会话
+            text: 要发送的文本或多段内容
+            anuneko_model: 备用会话使用的模型
+            api_key: 用于对冲预算的 API Key
+            hedge: 是否允许对冲（仅新对话）
+            on_switch: 备用请求胜出时以新会话 ID 回调，用于改绑会话
+
+        Yields:
+            AI 的回复文本片段
+
+        Raises:
+            UpstreamError: 上游调用失败或超过期限
+        """
+        start = time.perf_counter()
+        primary = api.stream_reply_generator(chat_id, text, raise_errors=True)
+        budget_key = api_key or ""
+        if hedge:
+            self.budget.earn(budget_key)
+
+        primary_first = asyncio.ensure_future(primary.__anext__())
+        winner = primary
+        first_task = primary_first
+        try:
+            if hedge and self.ENABLED:
+                done, _ = await asyncio.wait({primary_first}, timeout=self.hedge_delay())
+                if not done:
+                    if self.budget.take(budget_key):
+                        winner, first_task = await self._race(api, primary, primary_first, text, anuneko_model, on_switch)
+                    else:
+                        self.stats["budget_denied"] += 1
+
+            try:
+                first = await first_task
+            except StopAsyncIteration:
+                return
+            self.record_ttft(time.perf_counter() - start)
+            yield first
+            async for chunk in winner:
+                yield chunk
+        finally:
+            # 调用方提前关闭或被取消（包括等待首帧和对冲期间）时立即关闭上游流；
+            # 落败的一方已由 _race 关闭
+            await self._discard(winner, first_task)
+
+    async def _discard(self, stream: AsyncGenerator[str, None], first_task: "asyncio.Future") -> None:
+        """取消尚未完成的首帧读取并关闭上游流"""
+        first_task.cancel()
+        try:
+            await first_task
+        except BaseException:
+            pass
+        await stream.aclose()
+
+    async def _race(
+        self,
+        api: AnuNekoAPI,
+        primary: AsyncGenerator[str, None],
+        primary_first: "asyncio.Future",
+        text: Union[str, List[str]],
+        anuneko_model: str,
+        on_switch: Optional[Callable[[str], None]]
+    ) -> Tuple[AsyncGenerator[str, None], "asyncio.Future"]:
+        """在备用会话上发起对冲请求，返回先产出首帧的一方"""
+        # 备用会话池属于共享账号，租户账号只能新建会话
+        backup_chat_id = session_service.acquire_spare_chat(anuneko_model) if session_service.is_shared_api(api) else None
+        if backup_chat_id is None:
+            backup_chat_id = await api.create_session(anuneko_model)
+        if backup_chat_id is None:
+            return primary, primary_first
+        if primary_first.done():
+            # 主请求在新建备用会话期间已产出首帧，没用上的会话放回备用池
+            if session_service.is_shared_api(api):
+                session_service.release_spare_chat(anuneko_model, backup_chat_id)
+            return primary, primary_first
+
+        self.stats["hedged"] += 1
+        backup = api.stream_reply_generator(backup_chat_id, text, raise_errors=True)
+        backup_first = asyncio.ensure_future(backup.__anext__())
+
+        pending = {primary_first, backup_first}
+        winner_task = None
+        try:
+            while pending and winner_task is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in (primary_first, backup_first):
+                    # 出错或没有产出任何内容的一方不能胜出
+                    if task in done and task.exception() is None:
+                        winner_task = task
+                        break
+        except BaseException:
+            # 调用方在竞速期间取消：关闭备用请求，主请求由 stream 关闭
+            await self._discard(backup, backup_first)
+            raise
+        if winner_task is None:
+            winner_task = primary_first
+
+        if winner_task is backup_first:
+            loser, loser_task, winner = primary, primary_first, backup
+            self.stats["backup_wins"] += 1
+            if on_switch:
+                on_switch(backup_chat_id)
+        else:
+            loser, loser_task, winner = backup, backup_first, primary
+
+        # 取消落败一方并关闭其上游连接，其会话直接丢弃
+        await self._discard(loser, loser_task)
+
+        logger.info(
+            "对冲请求完成",
+            extra={"winner": "backup" if winner is backup else "primary", "backup_chat_id": backup_chat_id}
+        )
+        return winner, winner_task
+
+
+# 全局对冲请求服务实例
+hedging_service = HedgingService()
+metrics_service.register("hedging", lambda: dict(hedging_service.stats))
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+异步任务服务
+客户端提交聊天请求后立即拿到任务 ID，由共享的工作线程池在后台调用聊天服务生成回复，
+结果写入有界、有过期时间的结果存储，客户端轮询或长轮询获取，不必一直保持连接
+"""
+
+import os
+import time
+import uuid
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from app.services.chat_service import chat_service
+from app.services.metrics_service import metrics_service
+from app.services.log_service import get_logger
+
+logger = get_logger("jobs")
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobLimitError(Exception):
+    """排队的任务过多"""
+
+
+class Job:
+    """单个异步聊天任务"""
+
+    def __init__(self, request_data: Dict[str, Any], owner: Optional[str] = None):
+        self.id = f"job-{uuid.uuid4().hex[:24]}"
+        self.request_data = request_data
+        self.owner = owner
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[Dict[str, Any]] = None
+        self.cancelled = False
+        self._done = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float) -> bool:
+        return self._done.wait(timeout)
+
+    def finish(self, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[Dict[str, Any]] = None) -> None:
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished_at = time.time()
+        self._done.set()
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "id": self.id,
+            "object": "chat.completion.job",
+            "status": self.status,
+            "created": int(self.created_at),
+            "started": int(self.started_at) if self.started_at else None,
+            "finished": int(self.finished_at) if self.finished_at else None
+        }
+        if self.result is not None:
+            data["result"] = self.result
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+class JobService:
+    """异步任务服务类"""
+
+    def __init__(self):
+        # 工作线程数，即同时生成回复的任务数
+        self.WORKERS = int(os.environ.get("JOB_WORKERS", 8))
+        # 等待执行的任务上限，超出时拒绝提交
+        self.MAX_QUEUED = int(os.environ.get("JOB_MAX_QUEUED", 256))
+        # 保存的任务总数上限与结束后结果保留的秒数
+        self.MAX_JOBS = int(os.environ.get("JOB_MAX_JOBS", 1000))
+        self.RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", 3600))
+        # 长轮询单次最长等待秒数
+        self.MAX_WAIT = float(os.environ.get("JOB_MAX_WAIT", 60))
+        # 因并发上限被拒绝时的重试次数
+        self.OVERLOAD_RETRIES = 5
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.stats = {"submitted": 0, "succeeded": 0, "failed": 0, "rejected": 0, "expired": 0}
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.WORKERS, thread_name_prefix="anuneko-job")
+        return self._executor
+
+    def submit(self, request_data: Dict[str, Any], api_key: Optional[str] = None) -> Job:
+        """提交聊天任务，立即返回
+
+        Raises:
+            JobLimitError: 排队的任务已达上限
+        """
+        job = Job({**request_data, "stream": False}, owner=api_key)
+        with self._lock:
+            self._purge()
+            queued = sum(1 for j in self._jobs.values() if j.status == QUEUED)
+            if queued >= self.MAX_QUEUED:
+                self.stats["rejected"] += 1
+                raise JobLimitError(f"排队的任务已达上限 {self.MAX_QUEUED}")
+            self._jobs[job.id] = job
+            self._evict()
+            self.stats["submitted"] += 1
+        # 工作线程沿用提交请求的日志上下文（request_id 等）
+        self.executor.submit(contextvars.copy_context().run, self._run, job)
+        logger.info("提交异步任务", extra={"job_id": job.id})
+        return job
+
+    def get(self, job_id: str, api_key: Optional[str] = None) -> Optional[Job]:
+        """按 ID 获取任务，只能获取同一 API Key 提交的任务"""
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id)
+        if job is None or job.owner != api_key:
+            return None
+        return job
+
+    def delete(self, job_id: str, api_key: Optional[str] = None) -> bool:
+        """删除任务；尚未开始的任务不再执行，执行中的任务结果被丢弃"""
+        job = self.get(job_id, api_key)
+        if job is None:
+            return False
+        job.cancelled = True
+        with self._lock:
+            self._jobs.pop(job_id, None)
+        return True
+
+    def _run(self, job: Job) -> None:
+        if job.cancelled:
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            result = None
+            for attempt in range(self.OVERLOAD_RETRIES + 1):
+                result = chat_service.process_chat_request(job.request_data, job.owner, priority="bulk")
+                # 超过自适应并发上限时按 Retry-After 等待后重试，不让已提交的任务白白失败
+                if not (isinstance(result, tuple) and len(result) == 3 and result[1] == 503) or attempt == self.OVERLOAD_RETRIES:
+                    break
+                time.sleep(float(result[2].get("Retry-After", 1)))
+
+            if isinstance(result, tuple):
+                body, status_code = result[0], result[1]
+                job.finish(FAILED, error={**body.get("error", {}), "status_code": status_code})
+                self.stats["failed"] += 1
+            else:
+                job.finish(SUCCEEDED, result=result)
+                self.stats["succeeded"] += 1
+        except Exception as e:
+            logger.exception(f"异步任务失败: {str(e)}", extra={"job_id": job.id})
+            job.finish(FAILED, error={"message": f"服务器内部错误: {str(e)}", "type": "server_error", "status_code": 500})
+            self.stats["failed"] += 1
+        logger.info(
+            "异步任务结束",
+            extra={
+                "job_id": job.id,
+                "status": job.status,
+                "queued_ms": round((job.started_at - job.created_at) * 1000, 2),
+                "duration_ms": round((job.finished_at - job.started_at) * 1000, 2)
+            }
+        )
+
+    def _purge(self) -> None:
+        """清理结果已过期的任务（调用方持有锁）"""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.RESULT_TTL
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        self.stats["expired"] += len(expired)
+
+    def _evict(self) -> None:
+        """超过任务总数上限时先淘汰最早结束的任务（调用方持有锁）"""
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done]:
+            if len(self._jobs) <= self.MAX_JOBS:
+                return
+            del self._jobs[job_id]
+            self.stats["expired"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        """异步任务指标"""
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return {"stored": len(self._jobs), "workers": self.WORKERS, **counts, "total": dict(self.stats)}
+
+
+# 全局异步任务服务实例
+job_service = JobService()
+metrics_service.register("jobs", job_service.metrics)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+JSON 编解码服务
+优先使用 orjson，其次 ujson，都未安装时回退到标准库 json
+可通过环境变量 JSON_BACKEND（auto / orjson / ujson / json）指定
+"""
+
+import os
+import json
+from typing import Any, Callable, Tuple, Union
+
+from flask.json.provider import DefaultJSONProvider
+
+# 非原生类型的编码沿用 Flask 的规则（datetime 编码为 HTTP 日期，Decimal / UUID 为字符串，dataclass 为字典）
+_default = DefaultJSONProvider.default
+
+
+def _load_backend(name: str) -> Tuple[str, Callable[[Any], bytes], Callable[[Union[str, bytes]], Any]]:
+    """按名称加载后端，返回 (名称, 编码为 UTF-8 字节的函数, 解码函数)"""
+    if name == "orjson":
+        import orjson
+
+        def orjson_dumps(obj: Any) -> bytes:
+            # orjson 默认把 datetime 编码为 ISO 8601，交给 default 处理以保持与 Flask 一致
+            return orjson.dumps(
+                obj, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            )
+
+        return "orjson", orjson_dumps, orjson.loads
+
+    if name == "ujson":
+        import ujson
+
+        def ujson_dumps(obj: Any) -> bytes:
+            return ujson.dumps(
+                obj, ensure_ascii=False, escape_forward_slashes=False, default=_default
+            ).encode("utf-8")
+
+        return "ujson", ujson_dumps, ujson.loads
+
+    def json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+    return "json", json_dumps, json.loads
+
+
+def _select_backend() -> Tuple[str, Callable[[Any], bytes], Callable[[Union[str, bytes]], Any]]:
+    requested = os.environ.get("JSON_BACKEND", "auto").lower()
+    candidates = ["orjson", "ujson", "json"] if requested == "auto" else [requested, "json"]
+    for name in candidates:
+        try:
+            return _load_backend(name)
+        except ImportError:
+            continue
+    return _load_backend("json")
+
+
+BACKEND, dumps_bytes, loads = _select_backend()
+
+
+# 紧凑输出的格式化参数，各后端的输出本身就是紧凑格式
+COMPACT_ARGS = {"separators": (",", ":")}
+
+
+def dumps(obj: Any) -> str:
+    """编码为紧凑的 JSON 字符串，非 ASCII 字符原样输出（等价于 ensure_ascii=False）"""
+    return dumps_bytes(obj).decode("utf-8")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """使用所选后端的 Flask JSON 提供器，响应仍由 DefaultJSONProvider.response 构造"""
+
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        # 紧凑输出（jsonify 默认传入的 separators）走所选后端，其他格式化参数（如 indent）交给标准库处理
+        if not kwargs or kwargs == COMPACT_ARGS:
+            return dumps(obj)
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+自适应并发限制服务
+请求进入时检查当前并发是否超过自适应上限，超过时立即返回 503 而不是排队；
+上限按 AIMD 调整：上游首帧耗时明显高于基线或出错时按比例下调，否则缓慢上调
+"""
+
+import os
+import math
+import time
+import threading
+from typing import Any, Dict, Optional
+
+from app.services.metrics_service import metrics_service
+from app.services.log_service import get_logger
+
+logger = get_logger("limiter")
+
+
+class AdaptiveLimiter:
+    """AIMD 自适应并发限制器"""
+
+    def __init__(self):
+        self.ENABLED = os.environ.get("ADAPTIVE_LIMIT_ENABLED", "True").lower() == "true"
+        self.MIN_LIMIT = float(os.environ.get("ADAPTIVE_LIMIT_MIN", 4))
+        self.MAX_LIMIT = float(os.environ.get("ADAPTIVE_LIMIT_MAX", 128))
+        # 首帧耗时超过基线的该倍数即视为拥塞
+        self.LATENCY_TOLERANCE = float(os.environ.get("ADAPTIVE_LIMIT_LATENCY_TOLERANCE", 2.0))
+        # 拥塞时上限乘以该系数，两次下调至少间隔 DECREASE_COOLDOWN 秒
+        self.BACKOFF = float(os.environ.get("ADAPTIVE_LIMIT_BACKOFF", 0.8))
+        self.DECREASE_COOLDOWN = 1.0
+        self.limit = min(self.MAX_LIMIT, max(self.MIN_LIMIT, float(os.environ.get("ADAPTIVE_LIMIT_INITIAL", 32))))
+        self.in_flight = 0
+        # 首帧耗时基线（指数移动平均）
+        self.baseline_ttft: Optional[float] = None
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"admitted": 0, "shed": 0, "errors": 0, "congested": 0, "decreases": 0}
+
+    def try_acquire(self) -> bool:
+        """尝试占用一个并发名额，超过上限时返回 False"""
+        with self._lock:
+            if self.ENABLED and self.in_flight >= int(self.limit):
+                self.stats["shed"] += 1
+                return False
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+            return True
+
+    def release(self, ttft: Optional[float] = None, ok: Optional[bool] = None) -> None:
+        """归还名额并根据结果调整上限
+
+        Args:
+            ttft: 首帧耗时（秒），没有产出内容时为 None
+            ok: 上游是否成功，None 表示不计入样本（如客户端提前断开）
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if ok is None:
+                return
+
+            congested = not ok
+            if not ok:
+                self.stats["errors"] += 1
+            elif ttft is not None:
+                if self.baseline_ttft is None:
+                    self.baseline_ttft = ttft
+                congested = ttft > self.baseline_ttft * self.LATENCY_TOLERANCE
+                # 拥塞时基线只缓慢上移，持续变慢后上限才会逐步恢复
+                self.baseline_ttft += (0.005 if congested else 0.05) * (ttft - self.baseline_ttft)
+
+            now = time.monotonic()
+            if congested:
+                self.stats["congested"] += 1
+                if now - self._last_decrease >= self.DECREASE_COOLDOWN:
+                    self._last_decrease = now
+                    self.limit = max(self.MIN_LIMIT, self.limit * self.BACKOFF)
+                    self.stats["decreases"] += 1
+                    logger.info(
+                        "上游拥塞，下调并发上限",
+                        extra={"limit": round(self.limit, 2), "ttft_ms": round(ttft * 1000, 2) if ttft else None, "ok": ok}
+                    )
+            elif self.in_flight + 1 >= self.limit / 2:
+                # 只有名额确实被用上时才上调，空闲时上限不会无限增长
+                self.limit = min(self.MAX_LIMIT, self.limit + 1 / self.limit)
+
+    def retry_after(self) -> int:
+        """建议客户端等待的秒数"""
+        return max(1, math.ceil(self.baseline_ttft or 1))
+
+    def overloaded_response(self):
+        """超过并发上限时的 OpenAI 风格响应 (响应体, 状态码, 响应头)"""
+        return {
+            "error": {
+                "message": "服务繁忙，请稍后重试",
+                "type": "server_error",
+                "code": "overloaded"
+            }
+        }, 503, {"Retry-After": str(self.retry_after())}
+
+    def metrics(self) -> Dict[str, Any]:
+        """并发限制指标"""
+        with self._lock:
+            return {
+                "enabled": self.ENABLED,
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "baseline_ttft_ms": round(self.baseline_ttft * 1000, 2) if self.baseline_ttft is not None else None,
+                **self.stats
+            }
+
+
+# 全局自适应并发限制实例
+limiter_service = AdaptiveLimiter()
+metrics_service.register("limiter", limiter_service.metrics)
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+日志服务
+基于有界队列的非阻塞结构化日志管线
+"""
+
+import os
+import json
+import time
+import uuid
+import queue
+import random
+import atexit
+import logging
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, Optional
+
+from flask import Flask, g, request
+
+# 所有服务日志器的根名称
+LOGGER_NAME = "anuneko"
+
+# 当前请求的日志上下文（request_id / session_id / model 等）
+_log_context: contextvars.ContextVar = contextvars.ContextVar("anuneko_log_context", default=None)
+
+# LogRecord 自带的属性，格式化时不当作结构化字段输出
+_RESERVED_ATTRS = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime"}
+
+
+def get_logger(name: str) -> logging.Logger:
+    """获取服务日志器，名称会挂在 anuneko 根日志器下"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def bind_context(**fields: Any) -> None:
+    """向当前请求的日志上下文追加字段"""
+    context = _log_context.get()
+    if context is None:
+        context = {}
+        _log_context.set(context)
+    context.update({k: v for k, v in fields.items() if v is not None})
+
+
+def get_context() -> Dict[str, Any]:
+    """获取当前请求的日志上下文"""
+    return _log_context.get() or {}
+
+
+class ContextFilter(logging.Filter):
+    """把请求上下文注入日志记录"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _log_context.get()
+        if context:
+            for key, value in context.items():
+                if key == "request_start":
+                    continue
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+            start = context.get("request_start")
+            if start is not None and not hasattr(record, "elapsed_ms"):
+                record.elapsed_ms = round((time.perf_counter() - start) * 1000, 2)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """按日志级别采样，用于削减高频事件"""
+
+    def __init__(self, rates: Dict[int, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0:
+            return True
+        return random.random() < rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """队列写满时直接丢弃日志，绝不阻塞请求线程"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 只在调用线程渲染消息文本，JSON 序列化交给监听线程
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化 JSON 日志格式"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key in _RESERVED_ATTRS or key.startswith("_"):
+                continue
+            payload[key] = value
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        payload["where"] = f"{record.pathname}:{record.lineno}"
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def parse_sample_rates(spec: str) -> Dict[int, float]:
+    """解析采样率配置，例如 "debug=0.01,info=0.5" """
+    rates: Dict[int, float] = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        level_name, rate = item.split("=", 1)
+        level = logging.getLevelName(level_name.strip().upper())
+        if isinstance(level, int):
+            rates[level] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+class LogService:
+    """日志管线管理类"""
+
+    def __init__(self):
+        self.queue_handler: Optional[DroppingQueueHandler] = None
+        self.listener: Optional[QueueListener] = None
+
+    def init_app(self, app: Flask) -> None:
+        """为应用配置日志管线并注册请求上下文钩子"""
+        if self.listener is not None:
+            return
+
+        log_path = os.environ.get("LOG_PATH", "logs")
+        log_name = os.environ.get("LOG_NAME", "anuneko-openai")
+        level = logging.getLevelName(os.environ.get("LOG_LEVEL", "info").upper())
+        if not isinstance(level, int):
+            level = logging.INFO
+        queue_size = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+        sample_rates = parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", ""))
+
+        if not os.path.exists(log_path):
+            os.makedirs(log_path, exist_ok=True)
+
+        formatter = JsonFormatter()
+
+        # 文件与控制台输出只在监听线程中执行，磁盘阻塞和轮转不影响请求线程
+        file_handler = RotatingFileHandler(
+            f"{log_path}/{log_name}.log",
+            maxBytes=10240000,  # 10MB
+            backupCount=10,
+            encoding="utf-8"
+        )
+        file_handler.setFormatter(formatter)
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+
+        self.queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        self.queue_handler.setLevel(level)
+        self.queue_handler.addFilter(SamplingFilter(sample_rates))
+        self.queue_handler.addFilter(ContextFilter())
+
+        self.listener = QueueListener(
+            self.queue_handler.queue, file_handler, stream_handler, respect_handler_level=False
+        )
+        self.listener.start()
+        atexit.register(self.shutdown)
+
+        for logger in (logging.getLogger(LOGGER_NAME), app.logger):
+            logger.handlers.clear()
+            logger.addHandler(self.queue_handler)
+            logger.setLevel(level)
+            logger.propagate = False
+
+        self._register_hooks(app)
+
+    def _register_hooks(self, app: Flask) -> None:
+        """绑定每个请求的 request_id 与计时"""
+        logger = get_logger("http")
+
+        @app.before_request
+        def bind_request_context():
+            request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+            g.log_context_token = _log_context.set({
+                "request_id": request_id,
+                "request_start": time.perf_counter()
+            })
+
+        @app.after_request
+        def log_request(response):
+            context = get_context()
+            request_id = context.get("request_id")
+            if request_id:
+                response.headers["X-Request-ID"] = request_id
+            start = context.get("request_start")
+            fields = {"method": request.method, "path": request.path, "status": response.status_code}
+
+            def log_completion():
+                fields["duration_ms"] = round((time.perf_counter() - start) * 1000, 2) if start else None
+                logger.info("请求完成", extra=fields)
+
+            if not response.is_streamed:
+                log_completion()
+                return response
+
+            # 流式响应在此时尚未发送响应体，等服务器关闭响应后再记录，耗时才覆盖整个流
+            def log_stream_completion():
+                token = _log_context.set(context)
+                try:
+                    log_completion()
+                finally:
+                    _log_context.reset(token)
+
+            response.call_on_close(log_stream_completion)
+            return response
+
+        @app.teardown_request
+        def reset_request_context(exc):
+            token = g.pop("log_context_token", None)
+            if token is not None:
+                try:
+                    _log_context.reset(token)
+                except ValueError:
+                    # 流式响应可能在其他上下文中结束
+                    _log_context.set(None)
+
+    def stats(self) -> Dict[str, int]:
+        """日志队列状态"""
+        if self.queue_handler is None:
+            return {"queued": 0, "dropped": 0}
+        return {
+            "queued": self.queue_handler.queue.qsize(),
+            "dropped": self.queue_handler.dropped
+        }
+
+    def shutdown(self) -> None:
+        """停止监听线程并刷出剩余日志"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+
+# 全局日志服务实例
+log_service = LogService()
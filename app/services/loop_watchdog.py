@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+事件循环监控
+在常驻事件循环上定时打点测量调度延迟；监视线程发现循环长时间没有打点时，
+抓取循环线程当前的调用栈写入日志，定位阻塞循环的同步调用；
+同时统计 Flask 线程经异步桥接阻塞等待协程的耗时，均以直方图输出
+"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from typing import Any, Dict, Optional
+
+from app.services.async_bridge import async_bridge
+from app.services.metrics_service import Histogram, metrics_service
+from app.services.log_service import get_logger
+
+logger = get_logger("loop")
+
+
+class LoopWatchdog:
+    """事件循环延迟与阻塞调用监控类"""
+
+    def __init__(self):
+        self.ENABLED = os.environ.get("LOOP_WATCHDOG_ENABLED", "True").lower() == "true"
+        # 打点间隔（秒）
+        self.INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", 0.1))
+        # 循环超过多少秒没有打点视为被阻塞，记录调用栈
+        self.STALL_THRESHOLD = float(os.environ.get("LOOP_STALL_THRESHOLD", 0.25))
+        # 阻塞调用统计的标签数上限，超出的归入 other
+        self.MAX_LABELS = 64
+        self.lag = Histogram()
+        self.blocking_calls: Dict[str, Histogram] = {}
+        self.blocking_total = Histogram()
+        self.stalls = 0
+        self._last_tick = time.monotonic()
+        self._stall_logged_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self) -> None:
+        """启动打点协程与监视线程，并接管异步桥接的阻塞调用统计"""
+        if not self.ENABLED or self._started:
+            return
+        self._started = True
+        async_bridge.on_blocking_call = self.observe_call
+        self._last_tick = time.monotonic()
+        async_bridge.submit(self._tick())
+        threading.Thread(target=self._watch, name="anuneko-loop-watchdog", daemon=True).start()
+
+    def observe_call(self, label: str, seconds: float) -> None:
+        """记录一次 Flask 线程阻塞等待协程的耗时"""
+        histogram = self.blocking_calls.get(label)
+        if histogram is None:
+            with self._lock:
+                if label not in self.blocking_calls and len(self.blocking_calls) >= self.MAX_LABELS:
+                    label = "other"
+                histogram = self.blocking_calls.setdefault(label, Histogram())
+        histogram.observe(seconds)
+        self.blocking_total.observe(seconds)
+
+    async def _tick(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.INTERVAL
+            await asyncio.sleep(self.INTERVAL)
+            lag = max(0.0, loop.time() - expected)
+            self.lag.observe(lag)
+            self._last_tick = time.monotonic()
+            if self._stall_logged_at is not None:
+                logger.warning("事件循环阻塞结束", extra={"lag_ms": round(lag * 1000, 2)})
+                self._stall_logged_at = None
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.STALL_THRESHOLD / 2)
+            now = time.monotonic()
+            blocked = now - self._last_tick - self.INTERVAL
+            if blocked < self.STALL_THRESHOLD or self._stall_logged_at is not None:
+                continue
+            # 每次阻塞只记录一次调用栈
+            self._stall_logged_at = now
+            self.stalls += 1
+            thread = async_bridge.thread
+            frame = sys._current_frames().get(thread.ident) if thread is not None else None
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            logger.warning(
+                "事件循环被阻塞",
+                extra={"blocked_ms": round(blocked * 1000, 2), "stack": stack}
+            )
+
+    def metrics(self) -> Dict[str, Any]:
+        """事件循环延迟与阻塞调用指标"""
+        with self._lock:
+            labels = list(self.blocking_calls.items())
+        return {
+            "enabled": self.ENABLED,
+            "lag": self.lag.snapshot(),
+            "stalls": self.stalls,
+            "blocking_calls": self.blocking_total.snapshot(),
+            "blocking_calls_by_label": {label: histogram.snapshot() for label, histogram in sorted(labels)}
+        }
+
+
+# 全局事件循环监控实例
+loop_watchdog = LoopWatchdog()
+metrics_service.register("event_loop", loop_watchdog.metrics)
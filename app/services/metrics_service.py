@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+运行指标服务
+各服务登记自己的指标提供函数，/metrics 端点统一汇总输出
+"""
+
+import time
+import bisect
+import threading
+from typing import Any, Callable, Dict, Sequence
+
+from app.services.log_service import get_logger
+
+logger = get_logger("metrics")
+
+
+def mask_key(api_key: str) -> str:
+    """指标中使用的 API Key 标签，只保留首尾少量字符"""
+    if not api_key:
+        return "anonymous"
+    if len(api_key) <= 12:
+        return api_key[:2] + "…"
+    return f"{api_key[:4]}…{api_key[-4:]}"
+
+
+# 耗时直方图默认的桶上界（毫秒）
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class Histogram:
+    """固定桶的耗时直方图，线程安全，记录秒、输出毫秒"""
+
+    def __init__(self, buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        # 最后一个桶收集超出最大上界的样本
+        self._counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        ms = seconds * 1000
+        index = bisect.bisect_left(self.buckets_ms, ms)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum_ms += ms
+            if ms > self.max_ms:
+                self.max_ms = ms
+
+    def _quantile(self, counts: Sequence[int], total: int, q: float) -> float:
+        """按桶上界估计分位数"""
+        target = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= target:
+                return self.buckets_ms[index] if index < len(self.buckets_ms) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = list(self._counts)
+            total, sum_ms, max_ms = self.count, self.sum_ms, self.max_ms
+        if not total:
+            return {"count": 0}
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(list(self.buckets_ms) + ["+Inf"], counts):
+            cumulative += count
+            buckets[f"le_{bound}"] = cumulative
+        return {
+            "count": total,
+            "avg_ms": round(sum_ms / total, 3),
+            "max_ms": round(max_ms, 3),
+            "p50_ms": self._quantile(counts, total, 0.5),
+            "p99_ms": self._quantile(counts, total, 0.99),
+            "buckets": buckets
+        }
+
+
+class MetricsService:
+    """运行指标服务类"""
+
+    def __init__(self):
+        self._providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, provider: Callable[[], Dict[str, Any]]) -> None:
+        """登记一组指标，provider 每次调用返回当前值"""
+        with self._lock:
+            self._providers[name] = provider
+
+    def snapshot(self) -> Dict[str, Any]:
+        """汇总所有已登记的指标，单个提供函数出错不影响其它指标"""
+        with self._lock:
+            providers = list(self._providers.items())
+        result: Dict[str, Any] = {"timestamp": time.time()}
+        for name, provider in providers:
+            try:
+                result[name] = provider()
+            except Exception as e:
+                logger.warning(f"采集指标 {name} 失败: {str(e)}")
+                result[name] = None
+        return result
+
+
+# 全局运行指标服务实例
+metrics_service = MetricsService()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+负载感知的模型别名
+虚拟模型名（如 mihoyo-auto）在新建会话时按各上游模型进行中的请求数和最近的首帧耗时
+解析为负载最轻的具体模型，会话之后一直使用该模型；连续失败的模型暂时摘除，
+会话的模型被摘除时改用其他候选模型
+"""
+
+import os
+import time
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.services.metrics_service import metrics_service
+from app.services.log_service import get_logger
+
+logger = get_logger("model_router")
+
+# 首帧耗时 EWMA 的平滑系数
+TTFT_ALPHA = 0.2
+
+
+def parse_aliases(value: str) -> Dict[str, List[str]]:
+    """解析 "mihoyo-auto=*,mihoyo-cats=mihoyo-orange_cat|mihoyo-exotic_shorthair" 格式的别名配置
+
+    候选模型为 OpenAI 模型名（或 AnuNeko 模型名），* 表示模型映射表中的全部模型
+    """
+    aliases = {}
+    for item in value.split(","):
+        alias, sep, targets = item.strip().partition("=")
+        alias = alias.strip()
+        if not sep or not alias:
+            continue
+        candidates = [target.strip() for target in targets.split("|") if target.strip()]
+        if not candidates:
+            logger.warning(f"忽略没有候选模型的别名: {item}")
+            continue
+        aliases[alias] = candidates
+    return aliases
+
+
+class ModelRouter:
+    """模型别名路由类"""
+
+    def __init__(self):
+        self.ALIASES = parse_aliases(os.environ.get("MODEL_ALIASES", ""))
+        # 连续失败多少次后摘除模型，以及摘除的秒数
+        self.FAILURE_THRESHOLD = int(os.environ.get("MODEL_ROUTER_FAILURE_THRESHOLD", 3))
+        self.FAILURE_COOLDOWN = float(os.environ.get("MODEL_ROUTER_FAILURE_COOLDOWN", 30))
+        # AnuNeko 模型 -> 负载状态
+        self._models: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def is_alias(self, model: Optional[str]) -> bool:
+        return model in self.ALIASES
+
+    def candidates(self, alias: str, mapping: Dict[str, str]) -> List[str]:
+        """别名的候选 AnuNeko 模型（去重，保持配置顺序）"""
+        models = []
+        for target in self.ALIASES.get(alias, []):
+            if target == "*":
+                models.extend(mapping.values())
+            elif target in mapping:
+                models.append(mapping[target])
+            elif target in mapping.values():
+                models.append(target)
+        return list(dict.fromkeys(models))
+
+    def _state(self, anuneko_model: str) -> Dict[str, Any]:
+        """模型的负载状态（调用方持有锁）"""
+        state = self._models.get(anuneko_model)
+        if state is None:
+            state = {"in_flight": 0, "ttft": None, "failures": 0, "down_until": 0.0, "routed": 0}
+            self._models[anuneko_model] = state
+        return state
+
+    def available(self, anuneko_model: str) -> bool:
+        """模型当前是否可用（未因连续失败被摘除）"""
+        with self._lock:
+            state = self._models.get(anuneko_model)
+            return state is None or state["down_until"] <= time.time()
+
+    def choose(self, alias: str, mapping: Dict[str, str], exclude: Iterable[str] = ()) -> Optional[str]:
+        """为别名选择负载最轻的候选模型，没有候选模型时返回 None
+
+        负载按 首帧耗时 × (进行中的请求数 + 1) 估算，还没有首帧耗时的模型按已知模型的平均值计，
+        负载相同时选分配次数少的；候选模型都被摘除时仍从中选择
+        """
+        candidates = [model for model in self.candidates(alias, mapping) if model not in exclude]
+        if not candidates:
+            return None
+
+        now = time.time()
+        with self._lock:
+            states = {model: self._state(model) for model in candidates}
+            healthy = [model for model in candidates if states[model]["down_until"] <= now] or candidates
+            known = [state["ttft"] for state in states.values() if state["ttft"] is not None]
+            default_ttft = sum(known) / len(known) if known else 1.0
+            chosen = min(
+                healthy,
+                key=lambda model: (
+                    (states[model]["ttft"] or default_ttft) * (states[model]["in_flight"] + 1),
+                    states[model]["routed"]
+                )
+            )
+            states[chosen]["routed"] += 1
+        logger.info(f"模型别名 {alias} 解析为 {chosen}", extra={"alias": alias, "anuneko_model": chosen})
+        return chosen
+
+    def started(self, anuneko_model: str) -> None:
+        """向模型发出一次上游请求"""
+        with self._lock:
+            self._state(anuneko_model)["in_flight"] += 1
+
+    def finished(self, anuneko_model: str, ttft: Optional[float] = None, ok: Optional[bool] = None) -> None:
+        """上游请求结束
+
+        Args:
+            ttft: 首帧耗时（秒），没有产出内容时为 None
+            ok: 成功为 True，上游错误为 False，调用方提前结束为 None
+        """
+        with self._lock:
+            state = self._state(anuneko_model)
+            state["in_flight"] -= 1
+            if ttft is not None:
+                state["ttft"] = ttft if state["ttft"] is None else state["ttft"] + TTFT_ALPHA * (ttft - state["ttft"])
+            if ok:
+                state["failures"] = 0
+            elif ok is False:
+                state["failures"] += 1
+                if state["failures"] >= self.FAILURE_THRESHOLD and state["down_until"] <= time.time():
+                    state["down_until"] = time.time() + self.FAILURE_COOLDOWN
+                    logger.warning(
+                        f"模型 {anuneko_model} 连续失败，暂时摘除",
+                        extra={"anuneko_model": anuneko_model, "failures": state["failures"], "cooldown_s": self.FAILURE_COOLDOWN}
+                    )
+
+    def metrics(self) -> Dict[str, Any]:
+        """各模型的负载与别名路由指标"""
+        now = time.time()
+        with self._lock:
+            models = {
+                model: {
+                    "in_flight": state["in_flight"],
+                    "ttft_ms": round(state["ttft"] * 1000, 2) if state["ttft"] is not None else None,
+                    "failures": state["failures"],
+                    "available": state["down_until"] <= now,
+                    "routed": state["routed"]
+                }
+                for model, state in self._models.items()
+            }
+        return {"aliases": {alias: targets for alias, targets in self.ALIASES.items()}, "models": models}
+
+
+# 全局模型别名路由实例
+model_router = ModelRouter()
+metrics_service.register("model_router", model_router.metrics)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+历史预热服务
+新建上游会话时，把 system 提示词和之前的对话轮次打包进首个上游请求的
+contents 数组，一次请求即可恢复上下文，而不必逐轮重放
+"""
+
+import os
+from typing import Any, Dict, List, Tuple, Union
+
+from app.services.log_service import get_logger
+
+logger = get_logger("priming")
+
+ROLE_LABELS = {"system": "系统设定", "user": "用户", "assistant": "助手"}
+
+
+def message_text(content: Any) -> str:
+    """提取消息文本，兼容 OpenAI 多段内容格式 [{"type": "text", "text": ...}]"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            part.get("text", "") for part in content
+            if isinstance(part, dict) and part.get("type") == "text"
+        )
+    return ""
+
+
+class PrimingService:
+    """历史预热服务类"""
+
+    def __init__(self):
+        self.ENABLED = os.environ.get("HISTORY_PRIMING_ENABLED", "False").lower() == "true"
+        # 打包的历史（含 system 提示词，不含本轮用户消息）最多字符数
+        self.MAX_CHARS = int(os.environ.get("HISTORY_PRIMING_MAX_CHARS", 8000))
+        # 超出预算时的截断策略：oldest 丢弃最早的轮次；middle 保留首轮，丢弃中间的轮次
+        self.TRUNCATE = os.environ.get("HISTORY_PRIMING_TRUNCATE", "oldest").lower()
+
+    def build_contents(self, messages: List[Dict[str, Any]], user_message: str) -> Union[str, List[str]]:
+        """为新上游会话的首个请求构造 contents
+
+        Args:
+            messages: 请求中的完整消息列表
+            user_message: 本轮用户消息
+
+        Returns:
+            未启用或没有可打包的历史时原样返回 user_message，否则返回 contents 列表
+        """
+        if not self.ENABLED:
+            return user_message
+
+        # 本轮用户消息之前的部分才是历史
+        last_user = max((i for i, msg in enumerate(messages) if msg.get("role") == "user"), default=len(messages))
+        history = [
+            (msg.get("role"), message_text(msg.get("content")))
+            for msg in messages[:last_user]
+            if msg.get("role") in ROLE_LABELS
+        ]
+        history = [(role, text) for role, text in history if text]
+        if not history:
+            return user_message
+
+        system = [self.format_item(role, text) for role, text in history if role == "system"]
+        turns = [self.format_item(role, text) for role, text in history if role != "system"]
+        kept, dropped = self._fit(system, turns)
+
+        logger.info(
+            "打包历史到新上游会话",
+            extra={"primed_messages": len(kept), "dropped_messages": dropped, "primed_chars": sum(map(len, kept))}
+        )
+        return kept + [user_message]
+
+    def format_item(self, role: str, text: str) -> str:
+        """带角色标签的一条 contents"""
+        return f"[{ROLE_LABELS[role]}]\n{text}"
+
+    def _fit(self, system: List[str], turns: List[str]) -> Tuple[List[str], int]:
+        """按预算截断，system 提示词优先保留；返回 (保留的条目, 丢弃的消息数)"""
+        budget = self.MAX_CHARS
+        kept_system: List[str] = []
+        for item in system:
+            if budget <= 0:
+                break
+            kept_system.append(item[:budget])
+            budget -= len(kept_system[-1])
+
+        head: List[str] = []
+        if self.TRUNCATE == "middle" and turns:
+            # 保留开场的一问一答，其余从最新的轮次往前填充
+            for item in turns[:2]:
+                if len(item) > budget:
+                    break
+                head.append(item)
+                budget -= len(item)
+
+        tail: List[str] = []
+        for item in reversed(turns[len(head):]):
+            if len(item) > budget:
+                break
+            tail.append(item)
+            budget -= len(item)
+        tail.reverse()
+
+        dropped = len(system) - len(kept_system) + len(turns) - len(head) - len(tail)
+        if dropped and head:
+            head.append(f"[……省略 {dropped} 条消息……]")
+        return kept_system + head + tail, dropped
+
+
+# 全局历史预热服务实例
+priming_service = PrimingService()
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+性能剖析服务
+按需采样 CPU 调用栈、对比 tracemalloc 快照以及单请求剖析（覆盖 Flask 处理线程和常驻事件循环线程）
+默认关闭，未启用时不注册任何钩子
+"""
+
+import io
+import os
+import sys
+import time
+import uuid
+import pstats
+import asyncio
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional
+
+from flask import Flask, g, request
+
+from app.services.async_bridge import async_bridge
+from app.services.log_service import get_logger
+
+logger = get_logger("profiler")
+
+
+def _frame_label(frame) -> str:
+    """调用栈帧的展示名称"""
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", os.path.basename(code.co_filename))
+    return f"{module}:{code.co_name}:{frame.f_lineno}"
+
+
+def _walk_stack(frame) -> List[str]:
+    """从最外层到最内层展开调用栈"""
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _find_event_loop(frame) -> Optional[asyncio.AbstractEventLoop]:
+    """如果线程正在运行事件循环，返回该循环"""
+    while frame is not None:
+        if frame.f_code.co_name == "_run_once":
+            loop = frame.f_locals.get("self")
+            if isinstance(loop, asyncio.AbstractEventLoop):
+                return loop
+        frame = frame.f_back
+    return None
+
+
+class SamplingProfiler:
+    """基于 sys._current_frames 的采样剖析器，可识别 asyncio 任务"""
+
+    def __init__(self, interval: float = 0.005, include_idle_tasks: bool = True):
+        self.interval = interval
+        self.include_idle_tasks = include_idle_tasks
+        self.stacks: Counter = Counter()
+        self.samples = 0
+
+    def _sample(self, own_thread: int, thread_names: Dict[int, str]) -> None:
+        loops = set()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            root = [f"thread:{thread_names.get(thread_id, thread_id)}"]
+            loop = _find_event_loop(frame)
+            if loop is not None:
+                loops.add(loop)
+                task = asyncio.current_task(loop)
+                if task is not None:
+                    root.append(f"task:{task.get_name()}")
+            self.stacks[";".join(root + _walk_stack(frame))] += 1
+
+        if not self.include_idle_tasks:
+            return
+
+        # 挂起中的任务不在线程栈上，单独记录它们等待的位置
+        for loop in loops:
+            try:
+                tasks = asyncio.all_tasks(loop)
+            except RuntimeError:
+                continue
+            running = asyncio.current_task(loop)
+            for task in tasks:
+                if task is running or task.done():
+                    continue
+                frames = [_frame_label(f) for f in task.get_stack()]
+                if frames:
+                    self.stacks[";".join([f"task:{task.get_name()}", "<awaiting>"] + frames)] += 1
+
+    def run(self, seconds: float) -> None:
+        """在当前线程中采样指定秒数"""
+        own_thread = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+            self._sample(own_thread, thread_names)
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def collapsed(self) -> str:
+        """输出 flamegraph.pl / speedscope 可直接读取的折叠栈格式"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def top_functions(self, limit: int = 30) -> List[Dict[str, Any]]:
+        """按自身采样数统计最热的函数"""
+        leaf_counts: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaf_counts[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaf_counts.values()) or 1
+        return [
+            {"frame": frame, "samples": count, "ratio": round(count / total, 4)}
+            for frame, count in leaf_counts.most_common(limit)
+        ]
+
+
+class ProfilerService:
+    """性能剖析服务类"""
+
+    def __init__(self):
+        self.enabled = os.environ.get("PROFILING_ENABLED", "False").lower() == "true"
+        self.admin_token = os.environ.get("ADMIN_TOKEN")
+        self.max_seconds = float(os.environ.get("PROFILING_MAX_SECONDS", 60))
+        self.max_snapshots = int(os.environ.get("PROFILING_MAX_SNAPSHOTS", 5))
+        self.max_request_profiles = int(os.environ.get("PROFILING_MAX_REQUEST_PROFILES", 20))
+        # 同一时间只允许一个 CPU 采样
+        self._cpu_lock = threading.Lock()
+        self._snapshots: "OrderedDict[str, tracemalloc.Snapshot]" = OrderedDict()
+        self._request_profiles: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        # cProfile 按线程生效，事件循环线程同一时间只能由一个请求剖析
+        self._loop_profile_lock = threading.Lock()
+
+    def is_admin(self, token: Optional[str]) -> bool:
+        """校验管理员令牌，未配置令牌时一律拒绝"""
+        return bool(self.admin_token) and token == self.admin_token
+
+    def init_app(self, app: Flask) -> None:
+        """启用时注册单请求剖析钩子"""
+        if not self.enabled:
+            return
+
+        @app.before_request
+        def start_request_profile():
+            if not self.is_admin(request.headers.get("X-Debug-Profile")):
+                return
+            profile = cProfile.Profile()
+            g.request_profile = profile
+            g.loop_profile = self._start_loop_profile()
+            profile.enable()
+
+        @app.after_request
+        def finish_request_profile(response):
+            profile = g.pop("request_profile", None)
+            if profile is None:
+                return response
+            loop_profile = g.pop("loop_profile", None)
+            profile_id = uuid.uuid4().hex[:12]
+            response.headers["X-Profile-Id"] = profile_id
+
+            if not response.is_streamed:
+                profile.disable()
+                self._store_request_profile(profile_id, profile, loop_profile)
+                return response
+
+            # 流式响应在视图返回后才真正执行，剖析持续到响应体迭代结束；
+            # 客户端提前断开或响应体没有被迭代时，由响应关闭回调保存结果并释放事件循环剖析
+            body = response.response
+            finished = threading.Event()
+
+            def finish():
+                if finished.is_set():
+                    return
+                finished.set()
+                profile.disable()
+                self._store_request_profile(profile_id, profile, loop_profile)
+
+            def profiled_body():
+                profile.enable()
+                try:
+                    for chunk in body:
+                        yield chunk
+                finally:
+                    profile.disable()
+                    if hasattr(body, "close"):
+                        body.close()
+                    finish()
+
+            profile.disable()
+            response.response = profiled_body()
+            response.call_on_close(finish)
+            return response
+
+        @app.teardown_request
+        def release_loop_profile(exc):
+            # 请求没有走到 after_request（如处理过程中出现未捕获的异常）时释放事件循环剖析
+            loop_profile = g.pop("loop_profile", None)
+            if loop_profile is not None:
+                self._stop_loop_profile(loop_profile)
+
+    def _start_loop_profile(self) -> Optional[cProfile.Profile]:
+        """在事件循环线程中开始剖析，已有请求在剖析事件循环时返回 None"""
+        if not self._loop_profile_lock.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+
+        async def enable():
+            profile.enable()
+
+        try:
+            async_bridge.run(enable(), label="profiler:enable")
+        except Exception:
+            self._loop_profile_lock.release()
+            logger.exception("无法剖析事件循环线程")
+            return None
+        return profile
+
+    def _stop_loop_profile(self, profile: cProfile.Profile) -> None:
+        """在事件循环线程中停止剖析"""
+        async def disable():
+            profile.disable()
+
+        try:
+            async_bridge.run(disable(), label="profiler:disable")
+        finally:
+            self._loop_profile_lock.release()
+
+    def _store_request_profile(
+        self,
+        profile_id: str,
+        profile: cProfile.Profile,
+        loop_profile: Optional[cProfile.Profile] = None
+    ) -> None:
+        output = io.StringIO()
+        output.write("==== Flask 处理线程 ====\n")
+        pstats.Stats(profile, stream=output).sort_stats("cumulative").print_stats(40)
+        # 事件循环线程上的协程由所有请求共用，剖析结果包含同一时间段内其他请求的协程
+        output.write("==== 事件循环线程（包含同一时间段内其他请求的协程） ====\n")
+        if loop_profile is None:
+            output.write("未剖析：另一个请求正在剖析事件循环线程\n")
+        else:
+            self._stop_loop_profile(loop_profile)
+            pstats.Stats(loop_profile, stream=output).sort_stats("cumulative").print_stats(40)
+        with self._lock:
+            self._request_profiles[profile_id] = output.getvalue()
+            while len(self._request_profiles) > self.max_request_profiles:
+                self._request_profiles.popitem(last=False)
+        logger.info("单请求剖析完成", extra={"profile_id": profile_id})
+
+    def get_request_profile(self, profile_id: str) -> Optional[str]:
+        """获取单请求剖析结果"""
+        with self._lock:
+            return self._request_profiles.get(profile_id)
+
+    def profile_cpu(self, seconds: float, interval: float, include_idle_tasks: bool) -> Optional[SamplingProfiler]:
+        """采样 CPU 调用栈，已有采样进行中时返回 None"""
+        if not self._cpu_lock.acquire(blocking=False):
+            return None
+        try:
+            seconds = max(0.1, min(seconds, self.max_seconds))
+            profiler = SamplingProfiler(interval=max(0.001, interval), include_idle_tasks=include_idle_tasks)
+            logger.info("开始 CPU 采样", extra={"seconds": seconds, "interval": profiler.interval})
+            profiler.run(seconds)
+            return profiler
+        finally:
+            self._cpu_lock.release()
+
+    def start_tracemalloc(self, frames: int = 25) -> Dict[str, Any]:
+        """开始跟踪内存分配"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        return self.tracemalloc_status()
+
+    def stop_tracemalloc(self) -> Dict[str, Any]:
+        """停止跟踪并清空快照"""
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        with self._lock:
+            self._snapshots.clear()
+        return self.tracemalloc_status()
+
+    def tracemalloc_status(self) -> Dict[str, Any]:
+        """tracemalloc 当前状态"""
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        with self._lock:
+            snapshot_ids = list(self._snapshots)
+        return {
+            "tracing": tracing,
+            "traced_current_bytes": current,
+            "traced_peak_bytes": peak,
+            "snapshots": snapshot_ids
+        }
+
+    @staticmethod
+    def _take_filtered_snapshot() -> tracemalloc.Snapshot:
+        """拍摄内存快照，排除 tracemalloc 自身与导入机制的分配"""
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+    def take_snapshot(self) -> Optional[str]:
+        """保存一份内存快照，返回快照 ID"""
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = self._take_filtered_snapshot()
+        snapshot_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._snapshots[snapshot_id] = snapshot
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+        return snapshot_id
+
+    def diff_snapshots(
+        self,
+        base_id: str,
+        target_id: Optional[str] = None,
+        group_by: str = "lineno",
+        limit: int = 30
+    ) -> Optional[List[Dict[str, Any]]]:
+        """对比两份快照，target 为空时与当前内存对比"""
+        with self._lock:
+            base = self._snapshots.get(base_id)
+            target = self._snapshots.get(target_id) if target_id else None
+        if base is None or (target_id and target is None):
+            return None
+        if target is None:
+            # 与保存的快照使用相同的过滤条件，否则差异中会混入剖析自身的分配
+            target = self._take_filtered_snapshot()
+
+        stats = target.compare_to(base, group_by)
+        return [
+            {
+                "trace": [str(frame) for frame in stat.traceback.format()[-6:]],
+                "size_diff_bytes": stat.size_diff,
+                "size_bytes": stat.size,
+                "count_diff": stat.count_diff,
+                "count": stat.count
+            }
+            for stat in stats[:limit]
+        ]
+
+
+# 全局性能剖析服务实例
+profiler_service = ProfilerService()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+回复长度与停止序列限制
+按 OpenAI 请求中的 max_tokens / stop 截断上游回复：停止序列可能跨越多个片段，
+可能构成停止序列开头的尾部会暂缓输出；AnuNeko 不返回 token 数，按字符估算
+"""
+
+from typing import Any, Dict, List, Optional
+
+# OpenAI 允许的停止序列数量上限
+MAX_STOP_SEQUENCES = 4
+
+
+def _char_tokens(ch: str) -> float:
+    """单个字符的估算 token 数：中日韩字符约 1 个，其他字符约 4 个一个"""
+    code = ord(ch)
+    if 0x2E80 <= code <= 0x9FFF or 0xAC00 <= code <= 0xD7AF or 0xF900 <= code <= 0xFAFF or 0xFF00 <= code <= 0xFFEF:
+        return 1.0
+    return 0.25
+
+
+def estimate_tokens(text: str) -> float:
+    """估算文本的 token 数"""
+    return sum(_char_tokens(ch) for ch in text)
+
+
+class ReplyLimits:
+    """单次回复的长度与停止序列限制
+
+    Args:
+        max_tokens: 回复的估算 token 上限，None 表示不限制
+        stop: 停止序列，回复遇到其中任一个即结束（不包含停止序列本身）
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, stop: Optional[List[str]] = None):
+        self.max_tokens = max_tokens
+        self.stop = stop or []
+        self.tokens = 0.0
+        # 结束原因：stop / length，尚未触发限制时为 None
+        self.finish_reason: Optional[str] = None
+        # 可能是停止序列开头、暂缓输出的尾部
+        self._held = ""
+        self._hold = max((len(s) for s in self.stop), default=1) - 1
+
+    @classmethod
+    def from_request(cls, request_data: Dict[str, Any]) -> "ReplyLimits":
+        """从请求体解析限制
+
+        Raises:
+            ValueError: max_tokens 或 stop 不合法
+        """
+        max_tokens = request_data.get("max_completion_tokens", request_data.get("max_tokens"))
+        if max_tokens is not None and (isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens < 1):
+            raise ValueError("max_tokens 必须是正整数")
+
+        stop = request_data.get("stop")
+        if stop is None:
+            stop = []
+        elif isinstance(stop, str):
+            stop = [stop]
+        if not isinstance(stop, list) or not all(isinstance(s, str) for s in stop):
+            raise ValueError("stop 必须是字符串或字符串数组")
+        if len(stop) > MAX_STOP_SEQUENCES:
+            raise ValueError(f"stop 最多包含 {MAX_STOP_SEQUENCES} 个序列")
+        return cls(max_tokens, [s for s in stop if s])
+
+    @property
+    def active(self) -> bool:
+        return self.max_tokens is not None or bool(self.stop)
+
+    def feed(self, chunk: str) -> str:
+        """输入一个上游片段，返回可以输出的文本；触发限制后 finish_reason 不再为 None"""
+        if self.finish_reason is not None:
+            return ""
+
+        text = self._held + chunk
+        self._held = ""
+        if self.stop:
+            matches = [i for i in (text.find(s) for s in self.stop) if i >= 0]
+            if matches:
+                return self._take(text[:min(matches)], "stop")
+            # 保留可能与下一片段拼成停止序列的尾部
+            for size in range(min(self._hold, len(text)), 0, -1):
+                tail = text[-size:]
+                if any(s.startswith(tail) for s in self.stop):
+                    self._held = tail
+                    text = text[:-size]
+                    break
+        return self._take(text)
+
+    def flush(self) -> str:
+        """上游正常结束时输出暂缓的尾部"""
+        held, self._held = self._held, ""
+        return self._take(held) if self.finish_reason is None else ""
+
+    def _take(self, text: str, reason: Optional[str] = None) -> str:
+        """按 token 预算截取文本，reason 为文本之后要结束的原因"""
+        if self.max_tokens is not None:
+            cost = estimate_tokens(text)
+            if self.tokens + cost > self.max_tokens:
+                for index, ch in enumerate(text):
+                    self.tokens += _char_tokens(ch)
+                    if self.tokens > self.max_tokens:
+                        self.finish_reason = "length"
+                        return text[:index]
+            self.tokens += cost
+            if self.tokens >= self.max_tokens and reason is None:
+                reason = "length"
+        if reason is not None:
+            self.finish_reason = reason
+        return text
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+上游容量调度服务
+限制同时进行的上游流式请求总数，超出时按 API Key 加权公平排队：
+交互（流式）请求优先于批量请求，同一通道内按权重分配名额
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.services.anuneko_service import UpstreamError
+from app.services.metrics_service import metrics_service, mask_key
+from app.services.log_service import get_logger
+
+logger = get_logger("scheduler")
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """解析 "key1=4,key2=0.5" 格式的权重配置"""
+    weights = {}
+    for item in value.split(","):
+        key, sep, weight = item.strip().rpartition("=")
+        if not sep or not key:
+            continue
+        try:
+            weights[key] = max(float(weight), 0.01)
+        except ValueError:
+            logger.warning(f"忽略无效的调度权重: {item}")
+    return weights
+
+
+class _Waiter:
+    """排队中的请求"""
+
+    __slots__ = ("key", "lane", "future", "enqueued_at")
+
+    def __init__(self, key: str, lane: str, future: "asyncio.Future"):
+        self.key = key
+        self.lane = lane
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class SchedulerService:
+    """上游容量调度服务类
+
+    所有方法都在常驻事件循环线程中调用，只有指标读取来自其它线程
+    """
+
+    def __init__(self):
+        # 同时进行的上游流式请求上限，0 表示不限制
+        self.MAX_UPSTREAM_STREAMS = int(os.environ.get("SCHEDULER_MAX_UPSTREAM_STREAMS", 64))
+        # 排队最长等待时间（秒），超时返回 503，0 表示一直等待
+        self.MAX_WAIT = float(os.environ.get("SCHEDULER_MAX_WAIT", 60))
+        self.DEFAULT_WEIGHT = float(os.environ.get("SCHEDULER_DEFAULT_WEIGHT", 1))
+        self.WEIGHTS = parse_weights(os.environ.get("SCHEDULER_WEIGHTS", ""))
+        # 指标中保留的 API Key 数上限，超出时淘汰最久未活动且没有排队请求的 Key
+        self.MAX_TRACKED_KEYS = int(os.environ.get("SCHEDULER_MAX_TRACKED_KEYS", 1024))
+        self.active = 0
+        # 每个通道一个按虚拟完成时间排序的堆: (完成时间, 序号, 等待者)
+        self._queues: Dict[str, List[Tuple[float, int, _Waiter]]] = {INTERACTIVE: [], BULK: []}
+        self._virtual_time: Dict[str, float] = {INTERACTIVE: 0.0, BULK: 0.0}
+        self._last_finish: Dict[Tuple[str, str], float] = {}
+        # _last_finish 超过该大小时清理已落后于虚拟时间的条目，清理后按剩余大小翻倍
+        self._prune_at = 1024
+        self._seq = itertools.count()
+        self._key_stats: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+        self._stats_lock = threading.Lock()
+
+    def weight(self, api_key: str) -> float:
+        """API Key 的调度权重"""
+        return self.WEIGHTS.get(api_key, self.DEFAULT_WEIGHT)
+
+    @asynccontextmanager
+    async def slot(self, api_key: Optional[str], interactive: bool) -> AsyncIterator[None]:
+        """占用一个上游名额，退出时归还"""
+        if self.MAX_UPSTREAM_STREAMS <= 0:
+            yield
+            return
+        await self.acquire(api_key or "", interactive)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, api_key: str, interactive: bool) -> None:
+        """排队等待上游名额
+
+        Raises:
+            UpstreamError: 排队超过 MAX_WAIT
+        """
+        lane = INTERACTIVE if interactive else BULK
+        # 加权公平排队：同一 Key 的请求依次累加 1/权重，空闲 Key 从当前虚拟时间开始
+        finish = max(self._virtual_time[lane], self._last_finish.get((lane, api_key), 0.0)) + 1 / self.weight(api_key)
+        self._last_finish[(lane, api_key)] = finish
+        if len(self._last_finish) > self._prune_at:
+            self._prune_finish_times()
+
+        waiter = _Waiter(api_key, lane, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queues[lane], (finish, next(self._seq), waiter))
+        self._update_stats(api_key, queued=1)
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(waiter.future, self.MAX_WAIT or None)
+        except asyncio.TimeoutError:
+            self._update_stats(api_key, queued=-1, timeouts=1)
+            logger.warning("排队等待上游名额超时", extra={"lane": lane, "wait_s": self.MAX_WAIT})
+            raise UpstreamError("服务繁忙，排队等待超时，请稍后再试", code="queue_timeout", status_code=503)
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 名额已分配但调用方被取消，直接归还
+                self.release()
+            else:
+                self._update_stats(api_key, queued=-1)
+            raise
+
+    def release(self) -> None:
+        """归还名额并唤醒下一个排队者"""
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self.active < self.MAX_UPSTREAM_STREAMS:
+            waiter = self._pop()
+            if waiter is None:
+                return
+            self.active += 1
+            waiter.future.set_result(None)
+            self._update_stats(
+                waiter.key, queued=-1, granted=1,
+                wait_ms=(time.perf_counter() - waiter.enqueued_at) * 1000
+            )
+
+    def _pop(self) -> Optional[_Waiter]:
+        """交互通道优先；跳过已超时或取消的等待者"""
+        for lane in (INTERACTIVE, BULK):
+            queue = self._queues[lane]
+            while queue:
+                finish, _, waiter = heapq.heappop(queue)
+                if waiter.future.done():
+                    continue
+                self._virtual_time[lane] = finish
+                return waiter
+        return None
+
+    def _prune_finish_times(self) -> None:
+        """删除虚拟完成时间已不超过所在通道虚拟时间的条目
+
+        这些 Key 再次排队时本来就从当前虚拟时间开始，删除不影响调度顺序
+        """
+        self._last_finish = {
+            (lane, api_key): finish
+            for (lane, api_key), finish in self._last_finish.items()
+            if finish > self._virtual_time[lane]
+        }
+        self._prune_at = max(1024, len(self._last_finish) * 2)
+
+    def _update_stats(self, api_key: str, queued: int = 0, granted: int = 0, timeouts: int = 0, wait_ms: float = None) -> None:
+        with self._stats_lock:
+            stats = self._key_stats.get(api_key)
+            if stats is None:
+                stats = self._key_stats[api_key] = {
+                    "queued": 0, "granted": 0, "timeouts": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0
+                }
+                self._evict_key_stats()
+            self._key_stats.move_to_end(api_key)
+            stats["queued"] += queued
+            stats["granted"] += granted
+            stats["timeouts"] += timeouts
+            if wait_ms is not None:
+                stats["wait_ms_total"] += wait_ms
+                stats["wait_ms_max"] = max(stats["wait_ms_max"], wait_ms)
+
+    def _evict_key_stats(self) -> None:
+        """超过 MAX_TRACKED_KEYS 时从最久未活动的开始淘汰没有排队请求的 Key（调用方持有锁）"""
+        excess = len(self._key_stats) - self.MAX_TRACKED_KEYS
+        if excess <= 0:
+            return
+        idle = [api_key for api_key, stats in self._key_stats.items() if stats["queued"] <= 0]
+        for api_key in idle[:excess]:
+            del self._key_stats[api_key]
+
+    def stats(self) -> Dict[str, Any]:
+        """调度指标：全局名额占用、各通道与各 Key 的排队深度和等待时间"""
+        with self._stats_lock:
+            keys = {
+                mask_key(api_key): {
+                    "weight": self.weight(api_key),
+                    "queued": stats["queued"],
+                    "granted": stats["granted"],
+                    "timeouts": stats["timeouts"],
+                    "wait_ms_avg": round(stats["wait_ms_total"] / stats["granted"], 2) if stats["granted"] else 0.0,
+                    "wait_ms_max": round(stats["wait_ms_max"], 2)
+                }
+                for api_key, stats in self._key_stats.items()
+            }
+        return {
+            "limit": self.MAX_UPSTREAM_STREAMS,
+            "active": self.active,
+            "queued": {
+                lane: sum(1 for _, _, waiter in list(queue) if not waiter.future.done())
+                for lane, queue in self._queues.items()
+            },
+            "keys": keys
+        }
+
+
+# 全局上游容量调度服务实例
+scheduler_service = SchedulerService()
+metrics_service.register("scheduler", scheduler_service.stats)
@@ -5,13 +5,32 @@
 """
 
 import os
-import uuid
+import json
 import asyncio
 import time
+import threading
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple, Union
 
 from app.services.anuneko_service import AnuNekoAPI
+from app.services.async_bridge import async_bridge
+from app.services.metrics_service import metrics_service
+from app.services.tenant_service import tenant_service
+from app.services.cluster_service import cluster_service
+from app.services.template_service import template_service, system_prompt_of
+from app.services.timing_service import phase
+from app.services.model_router import model_router
+from app.services.log_service import get_logger, bind_context
+
+logger = get_logger("session")
+
+
+class SessionNotFoundError(Exception):
+    """请求指定的会话不存在、已过期或不属于该 API Key"""
+
+    def __init__(self, message: str, code: str = "session_not_found"):
+        super().__init__(message)
+        self.code = code
 
 
 class SessionService:
@@ -22,72 +41,218 @@ class SessionService:
         self.sessions: Dict[str, Dict[str, Any]] = {}
         # 动态模型映射表
         self.MODEL_MAPPING: Dict[str, str] = {}
+        # 模型映射表最近一次从上游成功刷新的时间
+        self.model_mapping_updated_at: Optional[float] = None
         # AnuNeko API 实例
         self._anuneko_api: Optional[AnuNekoAPI] = None
-        # API Key -> session_id 映射（用于持久会话）
-        self.api_key_sessions: Dict[str, str] = {}
+        # 会话绑定键 -> session_id 映射（用于持久会话），绑定键见 binding_key
+        self.api_key_sessions: Dict[Union[str, Tuple[str, str]], str] = {}
+        # 按 (API Key, 模型) 分别绑定会话，每个模型有自己的上游会话，切换模型无需额外请求；
+        # 设为 False 时同一 API Key 共用一个会话，切换模型时调用 switch_model
+        self.SESSION_PER_MODEL = os.environ.get("SESSION_PER_MODEL", "True").lower() == "true"
+        # 会话复用与模型切换统计
+        self.binding_stats = {"requests": 0, "reused": 0, "created": 0, "model_switches": 0, "explicit": 0}
         # 会话最后使用时间
         self.session_last_used: Dict[str, float] = {}
         # 会话配置
         self.SESSION_TTL = int(os.environ.get("SESSION_TTL", 7200))  # 默认2小时
         self.NEW_CONVERSATION_THRESHOLD = int(os.environ.get("NEW_CONVERSATION_THRESHOLD", 1))  # 消息数量阈值
+        # 模型映射表本地快照路径，留空表示不使用快照
+        self.MODEL_SNAPSHOT_PATH = os.environ.get("MODEL_CATALOG_SNAPSHOT", "data/model_catalog.json")
+        # 每个模型预先创建的备用上游会话数
+        self.SPARE_SESSIONS_PER_MODEL = int(os.environ.get("SPARE_SESSIONS_PER_MODEL", 0))
+        # AnuNeko 模型名 -> 备用上游会话 (ID, 创建时间) 列表，超过 SESSION_TTL 的备用会话不再使用
+        self.spare_chats: Dict[str, List[Tuple[str, float]]] = {}
+        self._spare_pending: Dict[str, int] = {}
+        self._spare_lock = threading.Lock()
     
-    def get_anuneko_api(self) -> AnuNekoAPI:
-        """获取 AnuNeko API 实例"""
+    def get_anuneko_api(self, api_key: Optional[str] = None) -> AnuNekoAPI:
+        """获取 AnuNeko API 实例
+        
+        启用租户账号（UPSTREAM_TOKEN_MODE）时按 API Key 返回对应账号的实例，否则返回共享实例
+        """
+        if api_key:
+            api = tenant_service.api_for(api_key)
+            if api is not None:
+                return api
         if self._anuneko_api is None:
             self._anuneko_api = AnuNekoAPI()
         return self._anuneko_api
     
+    def is_shared_api(self, api: AnuNekoAPI) -> bool:
+        """是否为共享账号的实例（备用会话池只属于共享账号）"""
+        return api is self._anuneko_api
+    
+    def binding_key(self, api_key: str, anuneko_model: str) -> Union[str, Tuple[str, str]]:
+        """会话绑定键：按模型分槽时为 (API Key, 模型)，否则为 API Key"""
+        return (api_key, anuneko_model) if self.SESSION_PER_MODEL else api_key
+    
+    def binding_metrics(self) -> Dict[str, Any]:
+        """会话绑定指标，switch_rate 为需要切换上游模型的请求占比"""
+        stats = dict(self.binding_stats)
+        stats["switch_rate"] = round(stats["model_switches"] / stats["requests"], 4) if stats["requests"] else 0.0
+        stats["per_model"] = self.SESSION_PER_MODEL
+        stats["bindings"] = len(self.api_key_sessions)
+        return stats
+    
     def update_model_mapping(self):
-        """动态更新模型映射表"""
+        """动态更新模型映射表（阻塞等待上游返回）"""
+        async_bridge.run(self.refresh_model_mapping())
+    
+    async def refresh_model_mapping(self) -> bool:
+        """从上游刷新模型映射表，成功时同步写入本地快照
+        
+        Returns:
+            是否从上游成功获取到模型列表
+        """
         try:
             api = self.get_anuneko_api()
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            try:
-                anuneko_models = loop.run_until_complete(api.model_view())
-            finally:
-                loop.close()
+            anuneko_models = await api.model_view()
             
             if anuneko_models and "models" in anuneko_models:
-                # 清空现有映射
-                self.MODEL_MAPPING.clear()
-                
-                # 为每个AnuNeko模型创建映射
+                # 构建完整的新映射后整体替换，并发请求不会读到空映射
+                mapping = {}
                 for anuneko_model in anuneko_models["models"]:
                     # 生成模型ID
                     openai_model = f"mihoyo-{anuneko_model.lower().replace(' ', '_')}"
-                    self.MODEL_MAPPING[openai_model] = anuneko_model
+                    mapping[openai_model] = anuneko_model
+                self.MODEL_MAPPING = mapping
+                self.model_mapping_updated_at = time.time()
                 
-                print(f"已更新模型映射表，共{len(self.MODEL_MAPPING)}个模型")
-            else:
-                # 如果无法获取，设置默认映射
-                self.MODEL_MAPPING.clear()
-                self.MODEL_MAPPING["mihoyo-orange_cat"] = "Orange Cat"
-                print("无法获取AnuNeko模型，使用默认映射")
+                logger.info(f"已更新模型映射表，共{len(self.MODEL_MAPPING)}个模型", extra={"model_count": len(self.MODEL_MAPPING)})
+                await asyncio.to_thread(self.save_model_snapshot)
+                return True
+            
+            logger.warning("无法获取AnuNeko模型，使用现有映射或默认映射")
                 
         except Exception as e:
-            print(f"更新模型映射失败: {str(e)}")
-            # 设置默认映射作为后备
-            self.MODEL_MAPPING.clear()
-            self.MODEL_MAPPING["mihoyo-orange_cat"] = "Orange Cat"
+            logger.exception(f"更新模型映射失败: {str(e)}")
+        
+        # 已有映射（例如来自本地快照）时保留，否则设置默认映射作为后备
+        if not self.MODEL_MAPPING:
+            self.MODEL_MAPPING = {"mihoyo-orange_cat": "Orange Cat"}
+        return False
+    
+    def load_model_snapshot(self) -> bool:
+        """从本地快照加载上次已知的模型映射表"""
+        if not self.MODEL_SNAPSHOT_PATH or not os.path.exists(self.MODEL_SNAPSHOT_PATH):
+            return False
+        try:
+            with open(self.MODEL_SNAPSHOT_PATH, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            mapping = snapshot.get("mapping") or {}
+            if not mapping:
+                return False
+            self.MODEL_MAPPING = dict(mapping)
+            self.model_mapping_updated_at = snapshot.get("updated_at")
+            logger.info(
+                f"已从快照加载模型映射表，共{len(mapping)}个模型",
+                extra={"model_count": len(mapping), "snapshot": self.MODEL_SNAPSHOT_PATH}
+            )
+            return True
+        except Exception as e:
+            logger.warning(f"读取模型快照失败: {str(e)}")
+            return False
+    
+    def save_model_snapshot(self) -> None:
+        """把当前模型映射表写入本地快照（先写临时文件再替换）"""
+        if not self.MODEL_SNAPSHOT_PATH or not self.MODEL_MAPPING:
+            return
+        try:
+            directory = os.path.dirname(self.MODEL_SNAPSHOT_PATH)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.MODEL_SNAPSHOT_PATH}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "mapping": self.MODEL_MAPPING,
+                    "updated_at": self.model_mapping_updated_at
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, self.MODEL_SNAPSHOT_PATH)
+        except Exception as e:
+            logger.warning(f"写入模型快照失败: {str(e)}")
+    
+    def _drop_expired_spares(self, anuneko_model: str) -> List[Tuple[str, float]]:
+        """丢弃超过 SESSION_TTL 的备用会话（调用方持有锁），返回剩余的备用池"""
+        pool = self.spare_chats.setdefault(anuneko_model, [])
+        expire_before = time.time() - self.SESSION_TTL
+        expired = sum(1 for _, created_at in pool if created_at < expire_before)
+        if expired:
+            pool[:] = [entry for entry in pool if entry[1] >= expire_before]
+            logger.info(f"丢弃过期的备用会话 {expired} 个", extra={"anuneko_model": anuneko_model})
+        return pool
+    
+    def spare_chat_counts(self) -> Dict[str, int]:
+        """各模型当前可用的备用会话数"""
+        with self._spare_lock:
+            return {model: len(self._drop_expired_spares(model)) for model in list(self.spare_chats)}
+    
+    def acquire_spare_chat(self, anuneko_model: str) -> Optional[str]:
+        """取出一个预先创建好的上游会话，并在后台补充备用池
+
+        过期的备用会话在取用时丢弃，随后一并补充
+        """
+        with self._spare_lock:
+            pool = self._drop_expired_spares(anuneko_model)
+            chat_id = pool.pop()[0] if pool else None
+        if self.SPARE_SESSIONS_PER_MODEL > 0:
+            async_bridge.submit_background(self.fill_spare_chats(anuneko_model))
+        return chat_id
+    
+    def release_spare_chat(self, anuneko_model: str, chat_id: str) -> None:
+        """把刚创建但没有用上的上游会话放回备用池，备用池已满时丢弃"""
+        with self._spare_lock:
+            pool = self._drop_expired_spares(anuneko_model)
+            if len(pool) < max(1, self.SPARE_SESSIONS_PER_MODEL):
+                pool.append((chat_id, time.time()))
+    
+    async def fill_spare_chats(self, anuneko_model: str, target: Optional[int] = None) -> int:
+        """把指定模型的备用会话池补充到目标数量
+        
+        Returns:
+            本次新建的会话数
+        """
+        target = self.SPARE_SESSIONS_PER_MODEL if target is None else target
+        with self._spare_lock:
+            missing = target - len(self._drop_expired_spares(anuneko_model)) - self._spare_pending.get(anuneko_model, 0)
+            if missing <= 0:
+                return 0
+            self._spare_pending[anuneko_model] = self._spare_pending.get(anuneko_model, 0) + missing
+        
+        api = self.get_anuneko_api()
+        try:
+            chat_ids = await asyncio.gather(
+                *(api.create_session(anuneko_model) for _ in range(missing)),
+                return_exceptions=True
+            )
+        finally:
+            with self._spare_lock:
+                self._spare_pending[anuneko_model] -= missing
+        
+        now = time.time()
+        created = [(chat_id, now) for chat_id in chat_ids if isinstance(chat_id, str)]
+        with self._spare_lock:
+            self.spare_chats.setdefault(anuneko_model, []).extend(created)
+        return len(created)
     
     def should_create_new_session(
         self, 
         messages: List[Dict[str, str]], 
-        current_session_id: Optional[str] = None
+        current_session_id: Optional[str] = None,
+        regenerate: bool = False
     ) -> bool:
         """智能判断是否应该创建新会话
         
         根据以下规则判断：
         1. 如果没有当前会话，创建新会话
         2. 如果会话已过期（超过 TTL），创建新会话
-        3. 如果消息数量很少（可能是清空上下文后的新对话），创建新会话
+        3. 如果消息数量很少（可能是清空上下文后的新对话），创建新会话；
+           重新生成请求针对的是当前会话的上一条回复，不做这项判断
         
         Args:
             messages: 消息列表
             current_session_id: 当前会话ID
+            regenerate: 是否为重新生成请求
             
         Returns:
             True 表示应该创建新会话，False 表示应该复用现有会话
@@ -99,9 +264,15 @@ class SessionService:
         # 2. 检查会话是否过期
         last_used = self.session_last_used.get(current_session_id, 0)
         if time.time() - last_used > self.SESSION_TTL:
-            print(f"会话 {current_session_id} 已过期 (TTL={self.SESSION_TTL}s)，创建新会话")
+            logger.info(
+                f"会话 {current_session_id} 已过期 (TTL={self.SESSION_TTL}s)，创建新会话",
+                extra={"session_id": current_session_id, "idle_s": round(time.time() - last_used, 1)}
+            )
             return True
         
+        if regenerate:
+            return False
+        
         # 3. 检查消息数量（智能检测是否为新对话）
         # 过滤掉 system 角色的消息，只统计用户和助手的对话
         conversation_messages = [
@@ -111,7 +282,10 @@ class SessionService:
         
         # 如果对话消息数量小于阈值，认为是新对话
         if len(conversation_messages) <= self.NEW_CONVERSATION_THRESHOLD:
-            print(f"检测到新对话（消息数={len(conversation_messages)}），创建新会话")
+            logger.info(
+                f"检测到新对话（消息数={len(conversation_messages)}），创建新会话",
+                extra={"message_count": len(conversation_messages)}
+            )
             return True
         
         # 4. 其他情况，复用现有会话
@@ -120,94 +294,199 @@ class SessionService:
     def get_session_for_request(
         self, 
         request_data: Dict[str, Any], 
-        api_key: Optional[str] = None
+        api_key: Optional[str] = None,
+        session_id: Optional[str] = None,
+        bind: bool = True
     ) -> str:
         """根据请求获取或创建会话（智能管理版本）
         
         Args:
             request_data: 请求数据
             api_key: 客户端的 API Key（用于会话绑定）
+            session_id: 客户端指定的会话 ID（X-Session-ID 头），未指定时取请求体中的 session_id
+            bind: 是否复用并更新 API Key 绑定的会话，为 False 时总是新建会话且不改变绑定
             
         Returns:
             会话 ID
+            
+        Raises:
+            SessionNotFoundError: 指定的会话不存在、已过期或不属于该 API Key
         """
         model = request_data.get("model", "mihoyo-orange_cat")
         messages = request_data.get("messages", [])
+        explicit_session_id = session_id or request_data.get("session_id")
         
         # 确保模型映射是最新的
         if not self.MODEL_MAPPING:
-            self.update_model_mapping()
+            with phase("model_mapping"):
+                self.update_model_mapping()
         
-        # 从动态映射表中获取AnuNeko模型名
-        anuneko_model = self.MODEL_MAPPING.get(model)
+        # 从动态映射表中获取AnuNeko模型名；模型别名在新建会话时才按负载解析为具体模型
+        alias = model if model_router.is_alias(model) else None
+        anuneko_model = None if alias else self.MODEL_MAPPING.get(model)
+        bind_context(model=model)
         
-        if not anuneko_model:
+        if not anuneko_model and not alias:
             # 如果映射中没有，默认使用Orange Cat
-            print("未找到模型映射，使用默认模型：Orange Cat")
+            logger.warning("未找到模型映射，使用默认模型：Orange Cat", extra={"model": model})
             anuneko_model = "Orange Cat"
         
-        # 获取当前 API Key 对应的会话ID（如果有的话）
-        current_session_id = None
-        if api_key and api_key in self.api_key_sessions:
-            current_session_id = self.api_key_sessions[api_key]
+        self.binding_stats["requests"] += 1
+        # 客户端指定了会话时直接续用，不做新对话判断
+        if explicit_session_id:
+            return self._resume_session(explicit_session_id, api_key, anuneko_model, alias)
+        
+        # 获取当前 API Key（按模型分槽时为 API Key + 模型或别名）对应的会话ID（如果有的话）
+        binding = self.binding_key(api_key, alias or anuneko_model) if api_key and bind else None
+        current_session_id = self.api_key_sessions.get(binding) if binding else None
         
         # 智能判断是否需要创建新会话
-        should_create_new = self.should_create_new_session(messages, current_session_id)
+        should_create_new = self.should_create_new_session(
+            messages, current_session_id, regenerate=request_data.get("regenerate") is True
+        )
         
         if not should_create_new and current_session_id:
+            bind_context(session_id=current_session_id)
             # 复用现有会话
             session = self.sessions[current_session_id]
             
             # 更新最后使用时间
             self.session_last_used[current_session_id] = time.time()
             
-            # 检查模型是否匹配，如果不匹配则切换模型
-            if session.get("model") != anuneko_model:
-                api = self.get_anuneko_api()
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    success = loop.run_until_complete(
-                        api.switch_model(session["anuneko_chat_id"], anuneko_model)
-                    )
-                    if success:
-                        session["model"] = anuneko_model
-                        print(f"切换会话 {current_session_id} 的模型为 {anuneko_model}")
-                finally:
-                    loop.close()
+            self.binding_stats["reused"] += 1
+            
+            # 检查模型是否匹配，如果不匹配则切换模型（仅共用会话模式或别名的模型被摘除时会发生）
+            self._ensure_model(current_session_id, session, anuneko_model, alias)
             
-            print(f"复用现有会话: {current_session_id}")
+            logger.info(f"复用现有会话: {current_session_id}")
             return current_session_id
         
-        # 创建新会话
-        api = self.get_anuneko_api()
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            anuneko_chat_id = loop.run_until_complete(api.create_session(anuneko_model))
-            if anuneko_chat_id:
-                new_session_id = str(uuid.uuid4())
-                self.sessions[new_session_id] = {
-                    "id": new_session_id,
-                    "anuneko_chat_id": anuneko_chat_id,
-                    "model": anuneko_model,
-                    "openai_model": model,
-                    "created_at": datetime.now().isoformat(),
-                    "has_anuneko_chat": True
+        # 创建新会话，优先使用已预热 system 提示词的模板会话，其次是预先创建好的备用上游会话
+        if alias:
+            anuneko_model = model_router.choose(alias, self.MODEL_MAPPING) or "Orange Cat"
+        api = self.get_anuneko_api(api_key)
+        create_start = time.perf_counter()
+        anuneko_chat_id = None
+        if self.is_shared_api(api):
+            anuneko_chat_id = template_service.acquire(api, anuneko_model, system_prompt_of(messages))
+        system_primed = anuneko_chat_id is not None
+        if anuneko_chat_id is None and self.is_shared_api(api):
+            anuneko_chat_id = self.acquire_spare_chat(anuneko_model)
+        from_spare = anuneko_chat_id is not None
+        if not from_spare:
+            anuneko_chat_id = async_bridge.run(api.create_session(anuneko_model))
+        if anuneko_chat_id:
+            # 集群模式下会话 ID 哈希到本节点，按会话 ID 的请求能路由回来
+            new_session_id = cluster_service.new_session_id()
+            self.sessions[new_session_id] = {
+                "id": new_session_id,
+                "anuneko_chat_id": anuneko_chat_id,
+                "model": anuneko_model,
+                "openai_model": model,
+                "created_at": datetime.now().isoformat(),
+                "has_anuneko_chat": True,
+                # 创建会话的 API Key，决定使用哪个上游账号（会话命名空间）
+                "api_key": api_key,
+                # 已发送到上游的轮数，0 表示新对话
+                "turns": 0,
+                # 上游会话是否已预热过本次请求的 system 提示词
+                "system_primed": system_primed,
+                # 请求使用的模型别名，失败重试时可改用其他候选模型
+                "alias": alias
+            }
+            
+            # 更新 API Key 映射和最后使用时间
+            self.binding_stats["created"] += 1
+            if binding:
+                self.api_key_sessions[binding] = new_session_id
+            self.session_last_used[new_session_id] = time.time()
+            
+            bind_context(session_id=new_session_id)
+            logger.info(
+                f"创建新会话: {new_session_id} (模型: {anuneko_model})",
+                extra={
+                    "from_spare": from_spare,
+                    "system_primed": system_primed,
+                    "duration_ms": round((time.perf_counter() - create_start) * 1000, 2)
                 }
-                
-                # 更新 API Key 映射和最后使用时间
-                if api_key:
-                    self.api_key_sessions[api_key] = new_session_id
-                self.session_last_used[new_session_id] = time.time()
-                
-                print(f"创建新会话: {new_session_id} (模型: {anuneko_model})")
-                return new_session_id
-        finally:
-            loop.close()
+            )
+            return new_session_id
         
         raise Exception("无法创建会话")
     
+    def _resume_session(
+        self,
+        session_id: str,
+        api_key: Optional[str],
+        anuneko_model: Optional[str],
+        alias: Optional[str] = None
+    ) -> str:
+        """续用客户端指定的会话，只能续用同一 API Key 创建的会话
+
+        未带 API Key 创建的会话没有归属，任何调用方都无法证明自己是创建者，因此不允许续用
+        """
+        session = self.sessions.get(session_id)
+        owner = session.get("api_key") if session else None
+        if owner is None or owner != api_key:
+            raise SessionNotFoundError(f"会话 {session_id} 不存在")
+        
+        # 过期会话的上游对话可能已不可用，由客户端重新发送完整历史（不带 session_id）开始新会话
+        idle = time.time() - self.session_last_used.get(session_id, 0)
+        if idle > self.SESSION_TTL:
+            logger.info(
+                f"指定的会话 {session_id} 已过期 (TTL={self.SESSION_TTL}s)",
+                extra={"session_id": session_id, "idle_s": round(idle, 1)}
+            )
+            raise SessionNotFoundError(f"会话 {session_id} 已过期，请重新发送完整对话历史", code="session_expired")
+        
+        bind_context(session_id=session_id)
+        self.session_last_used[session_id] = time.time()
+        self.binding_stats["explicit"] += 1
+        self._ensure_model(session_id, session, anuneko_model, alias)
+        logger.info(f"续用指定会话: {session_id}")
+        return session_id
+    
+    def _ensure_model(
+        self,
+        session_id: str,
+        session: Dict[str, Any],
+        anuneko_model: Optional[str],
+        alias: Optional[str] = None
+    ) -> None:
+        """会话的上游模型与请求不一致时切换模型
+        
+        请求使用模型别名时沿用会话已选的模型，该模型不是别名的候选或已被摘除时改选其他候选模型
+        """
+        session["alias"] = alias
+        if alias:
+            anuneko_model = session.get("model")
+            if anuneko_model not in model_router.candidates(alias, self.MODEL_MAPPING) or not model_router.available(anuneko_model):
+                anuneko_model = model_router.choose(alias, self.MODEL_MAPPING, exclude={anuneko_model}) or anuneko_model
+        if session.get("model") == anuneko_model:
+            return
+        self.binding_stats["model_switches"] += 1
+        api = self.get_anuneko_api(session.get("api_key"))
+        switch_start = time.perf_counter()
+        success = async_bridge.run(
+            api.switch_model(session["anuneko_chat_id"], anuneko_model)
+        )
+        if success:
+            session["model"] = anuneko_model
+            logger.info(
+                f"切换会话 {session_id} 的模型为 {anuneko_model}",
+                extra={"duration_ms": round((time.perf_counter() - switch_start) * 1000, 2)}
+            )
+    
+    def rebind_chat(self, session_id: str, anuneko_chat_id: str) -> None:
+        """把会话改绑到另一个上游会话（例如对冲请求的备用会话胜出）"""
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session["anuneko_chat_id"] = anuneko_chat_id
+            logger.info(
+                f"会话 {session_id} 改绑上游会话 {anuneko_chat_id}",
+                extra={"session_id": session_id}
+            )
+    
     def list_sessions(self) -> List[Dict[str, Any]]:
         """列出会话"""
         session_list = []
@@ -233,4 +512,5 @@ class SessionService:
 
 
 # 全局会话服务实例
-session_service = SessionService()
\ No newline at end of file
+session_service = SessionService()
+metrics_service.register("sessions", session_service.binding_metrics)
\ No newline at end of file
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+流式回复重放缓冲
+每个流式回复的事件都带编号写入有界缓冲，客户端断线后可携带
+Last-Event-ID 重连，从缓冲中续传而不必再次请求上游
+"""
+
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, List, Optional, Tuple
+
+from app.services.metrics_service import metrics_service
+
+
+class ReplayExpiredError(Exception):
+    """请求续传的位置已被移出缓冲"""
+
+
+class ReplayBuffer:
+    """单个流式回复的事件缓冲"""
+
+    def __init__(self, completion_id: str, max_events: int, owner: Optional[str] = None):
+        self.completion_id = completion_id
+        self.owner = owner
+        self.max_events = max_events
+        # (序号, 事件数据)
+        self.events: Deque[Tuple[int, str]] = deque()
+        self.next_seq = 0
+        self.done = False
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        # 持有上游读取任务的引用
+        self.task: Any = None
+        self._cond = threading.Condition()
+
+    def append(self, data: str) -> int:
+        """追加一个事件，返回其序号"""
+        with self._cond:
+            seq = self.next_seq
+            self.events.append((seq, data))
+            self.next_seq += 1
+            while len(self.events) > self.max_events:
+                self.events.popleft()
+            self._cond.notify_all()
+            return seq
+
+    def finish(self) -> None:
+        """标记上游读取结束"""
+        with self._cond:
+            self.done = True
+            self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def wait_events(self, from_seq: int, timeout: Optional[float] = None) -> Tuple[List[Tuple[int, str]], bool]:
+        """获取从 from_seq 开始的事件，没有新事件时最多等待 timeout 秒
+
+        Returns:
+            (事件列表, 是否已全部读完)
+        """
+        with self._cond:
+            if self.events and from_seq < self.events[0][0]:
+                raise ReplayExpiredError(f"事件 {from_seq} 已移出重放缓冲")
+            if from_seq >= self.next_seq and not self.done:
+                self._cond.wait(timeout)
+            events = [event for event in self.events if event[0] >= from_seq]
+            # 返回的是全部剩余事件，上游已结束即表示读完
+            return events, self.done
+
+    def can_resume(self, from_seq: int) -> bool:
+        """from_seq 是否仍在缓冲范围内"""
+        with self._cond:
+            oldest = self.events[0][0] if self.events else self.next_seq
+            return oldest <= from_seq <= self.next_seq
+
+    def event_id(self, seq: int) -> str:
+        """事件 ID，格式为 <completion_id>:<序号>"""
+        return f"{self.completion_id}:{seq}"
+
+
+class StreamBufferService:
+    """重放缓冲管理类"""
+
+    def __init__(self):
+        # 流结束后缓冲保留的秒数
+        self.RETENTION = float(os.environ.get("STREAM_REPLAY_TTL", 60))
+        # 每个流最多缓存的事件数
+        self.MAX_EVENTS = int(os.environ.get("STREAM_REPLAY_MAX_EVENTS", 4096))
+        # 同时保留的流数量上限
+        self.MAX_STREAMS = int(os.environ.get("STREAM_REPLAY_MAX_STREAMS", 1000))
+        self._buffers: "OrderedDict[str, ReplayBuffer]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, owner: Optional[str] = None) -> ReplayBuffer:
+        """为新的流式回复创建缓冲"""
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        buffer = ReplayBuffer(completion_id, self.MAX_EVENTS, owner)
+        with self._lock:
+            self._purge()
+            self._buffers[completion_id] = buffer
+            # 超出上限时只淘汰已结束的缓冲（从最早的开始），仍在写入的流不受影响
+            excess = len(self._buffers) - self.MAX_STREAMS
+            if excess > 0:
+                finished = [cid for cid, buf in self._buffers.items() if buf.done]
+                for cid in finished[:excess]:
+                    del self._buffers[cid]
+        return buffer
+
+    def resolve(self, last_event_id: str, owner: Optional[str] = None) -> Optional[Tuple[ReplayBuffer, int]]:
+        """根据 Last-Event-ID 找到缓冲与续传起点"""
+        completion_id, _, seq = last_event_id.strip().rpartition(":")
+        if not completion_id or not seq.isdigit():
+            return None
+        with self._lock:
+            self._purge()
+            buffer = self._buffers.get(completion_id)
+        if buffer is None or buffer.owner != owner:
+            return None
+        return buffer, int(seq) + 1
+
+    def _purge(self) -> None:
+        """清理超过保留时间的缓冲（调用方持有锁）"""
+        now = time.time()
+        expired = [
+            completion_id for completion_id, buffer in self._buffers.items()
+            if buffer.finished_at is not None and now - buffer.finished_at > self.RETENTION
+        ]
+        for completion_id in expired:
+            del self._buffers[completion_id]
+
+    def stats(self) -> dict:
+        """缓冲状态"""
+        with self._lock:
+            active = sum(1 for buffer in self._buffers.values() if not buffer.done)
+            return {"buffers": len(self._buffers), "active": active}
+
+
+# 全局重放缓冲服务实例
+stream_buffer_service = StreamBufferService()
+metrics_service.register("replay_buffers", stream_buffer_service.stats)
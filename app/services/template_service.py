@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+会话模板服务
+按 (模型, system 提示词) 的哈希缓存模板：常用的 system 提示词会在后台预先
+发给一批新上游会话，新对话直接取用已经"记住"设定的会话，首轮无需再带提示词；
+模板数量与每个模板的预热会话数都有上限，按最近使用淘汰；预热会话与普通会话一样在
+SESSION_TTL 后过期，过期的预热会话在取用时丢弃并在后台补充
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Union
+
+from app.services.anuneko_service import AnuNekoAPI, UpstreamError
+from app.services.async_bridge import async_bridge
+from app.services.priming_service import priming_service, message_text
+from app.services.metrics_service import metrics_service
+from app.services.log_service import get_logger
+
+logger = get_logger("template")
+
+PRIMING_SUFFIX = "（以上是本次对话的设定，之后的回复请始终遵循。收到后只需回复“好的”。）"
+
+
+def template_key(anuneko_model: str, system_prompt: str) -> str:
+    """模板键：模型与 system 提示词的哈希"""
+    return hashlib.sha256(f"{anuneko_model}\0{system_prompt}".encode("utf-8")).hexdigest()[:16]
+
+
+def system_prompt_of(messages: List[Dict[str, Any]]) -> str:
+    """请求中全部 system 消息的文本"""
+    return "\n\n".join(
+        text for text in (message_text(msg.get("content")) for msg in messages if msg.get("role") == "system")
+        if text
+    )
+
+
+class TemplateService:
+    """会话模板服务类"""
+
+    def __init__(self):
+        self.ENABLED = os.environ.get("TEMPLATE_ENABLED", "False").lower() == "true"
+        # 缓存的模板数上限与每个模板预热的上游会话数
+        self.MAX_TEMPLATES = int(os.environ.get("TEMPLATE_MAX_TEMPLATES", 32))
+        self.CHATS_PER_TEMPLATE = int(os.environ.get("TEMPLATE_CHATS_PER_TEMPLATE", 2))
+        # 同一模板被请求多少次后开始预热
+        self.MIN_REQUESTS = int(os.environ.get("TEMPLATE_MIN_REQUESTS", 2))
+        # 超过该长度的 system 提示词不做模板
+        self.MAX_PROMPT_CHARS = int(os.environ.get("TEMPLATE_MAX_PROMPT_CHARS", 8000))
+        # 预热会话的有效期，与会话 TTL 相同
+        self.CHAT_TTL = int(os.environ.get("SESSION_TTL", 7200))
+        # 模板键 -> 模板，按最近使用排序
+        self._templates: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "hits": 0, "misses": 0, "primed": 0, "prime_failures": 0, "evictions": 0, "expired": 0}
+
+    def acquire(self, api: AnuNekoAPI, anuneko_model: str, system_prompt: str) -> Optional[str]:
+        """为带 system 提示词的新对话取一个已预热的上游会话，没有时返回 None
+
+        模板足够常用时在后台把预热会话补充到 CHATS_PER_TEMPLATE 个
+        """
+        if not self.ENABLED or not system_prompt or len(system_prompt) > self.MAX_PROMPT_CHARS:
+            return None
+
+        key = template_key(anuneko_model, system_prompt)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None:
+                template = {"model": anuneko_model, "prompt": system_prompt, "requests": 0, "hits": 0, "chats": [], "pending": 0}
+                self._templates[key] = template
+                self._evict()
+            self._templates.move_to_end(key)
+            template["requests"] += 1
+            template["last_used"] = time.time()
+            self.stats["requests"] += 1
+
+            # 预热会话为 (上游会话 ID, 预热完成时间)，丢弃已过期的
+            expire_before = time.time() - self.CHAT_TTL
+            fresh = [entry for entry in template["chats"] if entry[1] >= expire_before]
+            self.stats["expired"] += len(template["chats"]) - len(fresh)
+            template["chats"] = fresh
+
+            chat_id = template["chats"].pop()[0] if template["chats"] else None
+            if chat_id is not None:
+                template["hits"] += 1
+                self.stats["hits"] += 1
+            else:
+                self.stats["misses"] += 1
+
+            missing = 0
+            if template["requests"] >= self.MIN_REQUESTS:
+                missing = self.CHATS_PER_TEMPLATE - len(template["chats"]) - template["pending"]
+                if missing > 0:
+                    template["pending"] += missing
+
+        if missing > 0:
+            async_bridge.submit_background(self._fill(api, key, template, missing))
+        if chat_id is not None:
+            logger.info("使用预热的模板会话", extra={"template": key, "model": anuneko_model})
+        return chat_id
+
+    def _evict(self) -> None:
+        """淘汰最久未使用的模板（调用方持有锁），其预热会话一并丢弃"""
+        while len(self._templates) > self.MAX_TEMPLATES:
+            key, _ = self._templates.popitem(last=False)
+            self.stats["evictions"] += 1
+            logger.info("淘汰会话模板", extra={"template": key})
+
+    async def _fill(self, api: AnuNekoAPI, key: str, template: Dict[str, Any], count: int) -> None:
+        start = time.perf_counter()
+        try:
+            results = await asyncio.gather(
+                *(self._prime(api, template["model"], template["prompt"]) for _ in range(count)),
+                return_exceptions=True
+            )
+        finally:
+            with self._lock:
+                template["pending"] -= count
+        now = time.time()
+        chat_ids = [chat_id for chat_id in results if isinstance(chat_id, str)]
+        with self._lock:
+            self.stats["primed"] += len(chat_ids)
+            self.stats["prime_failures"] += count - len(chat_ids)
+            # 模板在预热期间被淘汰时丢弃结果
+            if self._templates.get(key) is template:
+                template["chats"].extend((chat_id, now) for chat_id in chat_ids)
+        logger.info(
+            "预热模板会话",
+            extra={
+                "template": key,
+                "primed": len(chat_ids),
+                "failed": count - len(chat_ids),
+                "duration_ms": round((time.perf_counter() - start) * 1000, 2)
+            }
+        )
+
+    async def _prime(self, api: AnuNekoAPI, anuneko_model: str, system_prompt: str) -> Optional[str]:
+        """新建上游会话并发送 system 提示词，读完回复（结束时会确认分支）"""
+        chat_id = await api.create_session(anuneko_model)
+        if chat_id is None:
+            return None
+        text = [priming_service.format_item("system", system_prompt), PRIMING_SUFFIX]
+        try:
+            async for _ in api.stream_reply_generator(chat_id, text, raise_errors=True):
+                pass
+        except UpstreamError as e:
+            logger.warning(f"预热模板会话失败: {str(e)}", extra={"code": e.code})
+            return None
+        return chat_id
+
+    def first_turn_contents(
+        self,
+        messages: List[Dict[str, Any]],
+        user_message: str,
+        system_primed: bool
+    ) -> Union[str, List[str]]:
+        """新上游会话首轮的 contents
+
+        已预热的会话不再发送 system 提示词；未命中模板时把提示词与本轮消息放在同一请求中
+        """
+        if system_primed:
+            return priming_service.build_contents(
+                [msg for msg in messages if msg.get("role") != "system"], user_message
+            )
+        contents = priming_service.build_contents(messages, user_message)
+        if self.ENABLED and isinstance(contents, str):
+            system_prompt = system_prompt_of(messages)
+            if system_prompt:
+                return [priming_service.format_item("system", system_prompt), user_message]
+        return contents
+
+    def metrics(self) -> Dict[str, Any]:
+        """模板缓存指标"""
+        with self._lock:
+            templates = [
+                {
+                    "template": key,
+                    "model": template["model"],
+                    "prompt_chars": len(template["prompt"]),
+                    "requests": template["requests"],
+                    "hits": template["hits"],
+                    "primed_chats": len(template["chats"]),
+                    "pending": template["pending"]
+                }
+                for key, template in reversed(self._templates.items())
+            ]
+            stats = dict(self.stats)
+        return {
+            "enabled": self.ENABLED,
+            "templates": len(templates),
+            "primed_chats": sum(t["primed_chats"] for t in templates),
+            "hit_rate": round(stats["hits"] / stats["requests"], 4) if stats["requests"] else None,
+            **stats,
+            "by_template": templates
+        }
+
+
+# 全局会话模板服务实例
+template_service = TemplateService()
+metrics_service.register("templates", template_service.metrics)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+租户上游账号服务
+可选地按请求的 API Key 选择 AnuNeko 账号：直接把 Bearer Token 当作 AnuNeko Token，
+或按映射表把 API Key 换成对应账号的 Token。每个账号有独立的连接池，
+实例数由 LRU 限制，空闲过久的实例会被回收
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.services.anuneko_service import AnuNekoAPI
+from app.services.async_bridge import async_bridge
+from app.services.metrics_service import metrics_service
+from app.services.log_service import get_logger
+
+logger = get_logger("tenant")
+
+SHARED = "shared"
+PASSTHROUGH = "passthrough"
+MAPPED = "mapped"
+
+
+def parse_token_map(value: str) -> Dict[str, str]:
+    """解析 "api_key1=token1,api_key2=token2" 格式的映射"""
+    mapping = {}
+    for item in value.split(","):
+        api_key, sep, token = item.strip().partition("=")
+        if sep and api_key and token:
+            mapping[api_key] = token
+    return mapping
+
+
+class TenantService:
+    """租户上游账号服务类"""
+
+    def __init__(self):
+        # shared：所有请求共用 ANUNEKO_TOKEN；passthrough：Bearer Token 即 AnuNeko Token；
+        # mapped：按 UPSTREAM_TOKEN_MAP 把 API Key 映射为 AnuNeko Token，未映射的 Key 使用共享账号
+        self.MODE = os.environ.get("UPSTREAM_TOKEN_MODE", SHARED).lower()
+        self.TOKEN_MAP = parse_token_map(os.environ.get("UPSTREAM_TOKEN_MAP", ""))
+        # 同时保留的账号客户端上限与空闲回收时间（秒）
+        self.MAX_CLIENTS = int(os.environ.get("TENANT_MAX_CLIENTS", 64))
+        self.IDLE_TIMEOUT = float(os.environ.get("TENANT_IDLE_TIMEOUT", 900))
+        # Token -> (API 实例, 最后使用时间)，按最近使用排序
+        self._clients: "OrderedDict[str, Tuple[AnuNekoAPI, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.MODE in (PASSTHROUGH, MAPPED)
+
+    def resolve_token(self, api_key: Optional[str]) -> Optional[str]:
+        """API Key 对应的 AnuNeko Token，使用共享账号时返回 None"""
+        if not api_key:
+            return None
+        if self.MODE == PASSTHROUGH:
+            return api_key
+        if self.MODE == MAPPED:
+            return self.TOKEN_MAP.get(api_key)
+        return None
+
+    def api_for(self, api_key: Optional[str]) -> Optional[AnuNekoAPI]:
+        """获取 API Key 对应账号的 API 实例，使用共享账号时返回 None"""
+        token = self.resolve_token(api_key)
+        if token is None:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._clients.get(token)
+            if entry is not None:
+                self._clients[token] = (entry[0], now)
+                self._clients.move_to_end(token)
+                self.stats["hits"] += 1
+                api = entry[0]
+            else:
+                api = AnuNekoAPI(token=token)
+                self._clients[token] = (api, now)
+                self.stats["misses"] += 1
+            evicted = self._evict(now)
+
+        for old in evicted:
+            # 连接池属于常驻事件循环，在循环中关闭
+            async_bridge.submit(old.aclose())
+        return api
+
+    def _evict(self, now: float) -> list:
+        """回收超出上限或空闲过久的实例，跳过仍有上游调用进行中的实例（调用方持有锁）"""
+        evicted = []
+        for token, (api, last_used) in list(self._clients.items()):
+            over_limit = len(self._clients) > self.MAX_CLIENTS
+            idle = now - last_used > self.IDLE_TIMEOUT
+            if not over_limit and not idle:
+                # 按最近使用排序，之后的实例都更新
+                break
+            if api.in_flight > 0:
+                continue
+            del self._clients[token]
+            evicted.append(api)
+        if evicted:
+            self.stats["evictions"] += len(evicted)
+            logger.info("回收租户上游客户端", extra={"evicted": len(evicted), "clients": len(self._clients)})
+        return evicted
+
+    def metrics(self) -> Dict[str, Any]:
+        """租户客户端指标"""
+        with self._lock:
+            in_flight = sum(api.in_flight for api, _ in self._clients.values())
+            clients = len(self._clients)
+        return {"mode": self.MODE, "clients": clients, "max_clients": self.MAX_CLIENTS, "in_flight": in_flight, **self.stats}
+
+
+# 全局租户上游账号服务实例
+tenant_service = TenantService()
+metrics_service.register("tenants", tenant_service.metrics)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+请求耗时分解
+为每个聊天请求按阶段计时（模型映射刷新、会话查找、新建上游会话、切换模型、排队、
+上游首帧、流式传输、确认分支），通过 Server-Timing 响应头返回（流式响应在末尾以
+SSE 注释返回），并连同会话 ID 写入结构化日志
+
+计时对象保存在 contextvars 中，提交到常驻事件循环的协程会继承同一个对象
+"""
+
+import os
+import time
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from flask import Flask, g, request
+
+from app.services.log_service import get_logger
+
+logger = get_logger("timing")
+
+_current: "contextvars.ContextVar[Optional[RequestTiming]]" = contextvars.ContextVar("anuneko_request_timing", default=None)
+
+
+class RequestTiming:
+    """单个请求的分阶段耗时，同名阶段多次出现时累加"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # 阶段名 -> 耗时毫秒，按首次出现的顺序
+        self.phases: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds * 1000
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            result = {name: round(ms, 2) for name, ms in self.phases.items()}
+        result["total"] = round(self.total_ms(), 2)
+        return result
+
+    def header(self) -> str:
+        """Server-Timing 头的值，如 session;dur=1.2, ttft;dur=850.3, total;dur=912.0"""
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.as_dict().items())
+
+
+def current_timing() -> Optional[RequestTiming]:
+    """当前请求的计时对象，不在计时的请求中时为 None"""
+    return _current.get()
+
+
+def record(name: str, seconds: float) -> None:
+    """给当前请求记一个阶段耗时"""
+    timing = _current.get()
+    if timing is not None:
+        timing.add(name, seconds)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """计时一个阶段，可以包住同步代码或 await"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def timed(name: str) -> Callable:
+    """异步方法的计时装饰器"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with phase(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TimingService:
+    """请求耗时分解服务类"""
+
+    def __init__(self):
+        self.ENABLED = os.environ.get("SERVER_TIMING_ENABLED", "True").lower() == "true"
+
+    def log(self, timing: RequestTiming) -> None:
+        """写入结构化日志（会话 ID 等来自日志上下文）"""
+        logger.info("请求耗时分解", extra={"phases_ms": timing.as_dict()})
+
+    def init_app(self, app: Flask) -> None:
+        """启用时为聊天请求注册计时钩子"""
+        if not self.ENABLED:
+            return
+
+        @app.before_request
+        def start_timing():
+            if request.method == "POST" and request.path.rstrip("/") == "/v1/chat/completions":
+                g.timing_token = _current.set(RequestTiming())
+
+        @app.after_request
+        def add_server_timing(response):
+            timing = _current.get()
+            if timing is None:
+                return response
+            # 流式响应此时只有开始前的阶段，完整分解在流末尾的 SSE 注释中
+            response.headers["Server-Timing"] = timing.header()
+            if not response.is_streamed:
+                self.log(timing)
+            return response
+
+        @app.teardown_request
+        def reset_timing(exc):
+            token = g.pop("timing_token", None)
+            if token is not None:
+                try:
+                    _current.reset(token)
+                except ValueError:
+                    _current.set(None)
+
+
+# 全局请求耗时分解服务实例
+timing_service = TimingService()
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+上游流量录制与回放
+录制模式下记录每次上游请求的元数据与逐块到达的原始响应帧（带时间戳），
+敏感请求头脱敏，请求正文只记录长度；回放传输层按原速、倍速或最快速度
+重放这些录制，不访问网络，用于可复现的负载测试与解析器基准
+
+录制文件为 JSON Lines，每行一次请求，路径以 .gz 结尾时使用 gzip 压缩：
+每条记录单独写成一个完整的 gzip 成员，服务运行中或被强制结束后文件也能直接读取
+"""
+
+import re
+import gzip
+import atexit
+import time
+import base64
+import asyncio
+import codecs
+import itertools
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, List
+
+import httpx
+
+from app.services import json_service
+
+REDACTED = "[REDACTED]"
+SECRET_HEADERS = {"authorization", "cookie", "set-cookie", "x-token", "proxy-authorization"}
+
+
+def redact_headers(headers: httpx.Headers) -> Dict[str, str]:
+    """复制请求/响应头并隐去凭据"""
+    return {
+        name: REDACTED if name.lower() in SECRET_HEADERS else value
+        for name, value in headers.items()
+    }
+
+
+def route_key(method: str, url: str) -> str:
+    """回放时匹配请求用的路由：去掉协议、域名与路径中的会话 / 消息 ID"""
+    path = httpx.URL(url).path
+    path = re.sub(r"/msg/[^/]+/", "/msg/{id}/", path)
+    return f"{method.upper()} {path}"
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class TrafficRecorder:
+    """录制文件写入器，多个客户端共用（见 shared_recorder），逐条追加"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.started_at = time.monotonic()
+        self._compress = path.endswith(".gz")
+        self._file = open(path, "ab")
+        self._lock = threading.Lock()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        data = (json_service.dumps(record) + "\n").encode("utf-8")
+        if self._compress:
+            data = gzip.compress(data)
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(data)
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+_recorders: Dict[str, TrafficRecorder] = {}
+_recorders_lock = threading.Lock()
+
+
+def shared_recorder(path: str) -> TrafficRecorder:
+    """同一路径只打开一个写入器，所有上游客户端（含租户账号）共用，进程退出时关闭"""
+    with _recorders_lock:
+        recorder = _recorders.get(path)
+        if recorder is None:
+            recorder = TrafficRecorder(path)
+            _recorders[path] = recorder
+            atexit.register(recorder.close)
+        return recorder
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """透传响应体并记录每一块的到达时间"""
+
+    def __init__(self, inner: httpx.AsyncByteStream, record: Dict[str, Any], start: float, on_close: Callable[[Dict[str, Any]], None]):
+        self._inner = inner
+        self._record = record
+        self._start = start
+        self._on_close = on_close
+        self._closed = False
+        # 压缩过的响应体无法按文本记录，改用 base64
+        self._binary = record["frame_encoding"] == "base64"
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        frames = self._record["frames"]
+        async for chunk in self._inner:
+            offset = round(time.monotonic() - self._start, 4)
+            if self._binary:
+                frames.append([offset, base64.b64encode(chunk).decode("ascii")])
+            else:
+                frames.append([offset, self._decoder.decode(chunk)])
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+        if not self._closed:
+            self._closed = True
+            self._record["duration"] = round(time.monotonic() - self._start, 4)
+            self._on_close(self._record)
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """录制传输层：转发给真实传输层，同时把请求与响应帧写入录制文件"""
+
+    def __init__(self, recorder: TrafficRecorder, inner: httpx.AsyncBaseTransport):
+        self.recorder = recorder
+        self.inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.monotonic()
+        # 读入请求正文以记录长度（分块发送的正文没有 content-length），之后仍可照常发送
+        content = await request.aread()
+        record: Dict[str, Any] = {
+            "t": round(start - self.recorder.started_at, 4),
+            "method": request.method,
+            "url": str(request.url.copy_with(query=None)),
+            "request_headers": redact_headers(request.headers),
+            "request_bytes": len(content)
+        }
+        try:
+            response = await self.inner.handle_async_request(request)
+        except Exception as e:
+            record["error"] = type(e).__name__
+            record["duration"] = round(time.monotonic() - start, 4)
+            self.recorder.write(record)
+            raise
+
+        encoded = response.headers.get("content-encoding", "identity") != "identity"
+        record.update({
+            "status": response.status_code,
+            "ttfb": round(time.monotonic() - start, 4),
+            "response_headers": redact_headers(response.headers),
+            "frame_encoding": "base64" if encoded else "utf-8",
+            "frames": []
+        })
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, record, start, self.recorder.write),
+            extensions=response.extensions
+        )
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    """按录制的时间间隔产出响应帧"""
+
+    def __init__(self, record: Dict[str, Any], speed: float):
+        self._record = record
+        self._speed = speed
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        ttfb = self._record.get("ttfb", 0)
+        binary = self._record.get("frame_encoding") == "base64"
+        for offset, data in self._record.get("frames", []):
+            if self._speed:
+                delay = start + (offset - ttfb) / self._speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield base64.b64decode(data) if binary else data.encode("utf-8")
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """回放传输层：按路由轮流返回录制的响应，不访问网络
+
+    Args:
+        records: 录制记录列表
+        speed: 回放速度倍数，1 为原速，2 为两倍速，0 为不等待（最快）
+    """
+
+    def __init__(self, records: List[Dict[str, Any]], speed: float = 1.0):
+        self.speed = speed
+        self.records = records
+        self._routes: Dict[str, "itertools.cycle"] = {}
+        grouped: Dict[str, List[Dict[str, Any]]] = {}
+        for record in records:
+            grouped.setdefault(route_key(record["method"], record["url"]), []).append(record)
+        for key, items in grouped.items():
+            self._routes[key] = itertools.cycle(items)
+
+    @classmethod
+    def from_file(cls, path: str, speed: float = 1.0) -> "ReplayTransport":
+        """从录制文件加载"""
+        with _open(path, "r") as f:
+            records = [json_service.loads(line) for line in f if line.strip()]
+        return cls(records, speed)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        routes = self._routes.get(route_key(request.method, str(request.url)))
+        if routes is None:
+            return httpx.Response(404, json={"code": "not_recorded", "message": "录制中没有该接口的请求"})
+        record = next(routes)
+
+        if self.speed and record.get("ttfb"):
+            await asyncio.sleep(record["ttfb"] / self.speed)
+        if "error" in record:
+            # 按录制时的异常类型重现失败，找不到对应类型时视为网络错误
+            error_class = getattr(httpx, record["error"], httpx.NetworkError)
+            if not (isinstance(error_class, type) and issubclass(error_class, httpx.TransportError)):
+                error_class = httpx.NetworkError
+            raise error_class(f"回放录制的错误: {record['error']}", request=request)
+
+        headers = [
+            (name, value) for name, value in record.get("response_headers", {}).items()
+            if name.lower() not in ("content-length", "transfer-encoding")
+        ]
+        return httpx.Response(
+            status_code=record.get("status", 200),
+            headers=headers,
+            stream=_ReplayStream(record, self.speed)
+        )
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+启动预热服务
+启动时立即加载本地模型快照，随后在后台刷新模型目录、
+预先建立上游连接并创建备用会话
+"""
+
+import os
+import time
+import asyncio
+from typing import Any, Dict, Optional
+
+from app.services.async_bridge import async_bridge
+from app.services.session_service import session_service
+from app.services.log_service import get_logger
+
+logger = get_logger("warmup")
+
+
+class WarmupService:
+    """启动预热服务类"""
+
+    def __init__(self):
+        self.ENABLED = os.environ.get("WARMUP_ENABLED", "True").lower() == "true"
+        # 预先建立的上游连接数
+        self.WARMUP_CONNECTIONS = int(os.environ.get("WARMUP_CONNECTIONS", 0))
+        # 预热最长等待时间，超时后就绪检查不再等待预热
+        self.WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", 30))
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.snapshot_loaded = False
+        self.result: Dict[str, Any] = {}
+
+    @property
+    def in_progress(self) -> bool:
+        """预热是否仍在进行（超时后视为结束）"""
+        if self.started_at is None or self.finished_at is not None:
+            return False
+        return time.time() - self.started_at < self.WARMUP_TIMEOUT
+
+    def start(self) -> None:
+        """启动预热：同步加载快照，其余步骤在后台进行"""
+        if not self.ENABLED or self.started_at is not None:
+            return
+        self.started_at = time.time()
+        self.snapshot_loaded = session_service.load_model_snapshot()
+
+        try:
+            session_service.get_anuneko_api()
+        except ValueError as e:
+            logger.warning(f"跳过启动预热: {str(e)}")
+            self.finished_at = time.time()
+            return
+
+        async_bridge.submit(self._warmup())
+
+    async def _warmup(self) -> None:
+        api = session_service.get_anuneko_api()
+        start = time.perf_counter()
+        try:
+            self.result["catalog_refreshed"] = await session_service.refresh_model_mapping()
+
+            if self.WARMUP_CONNECTIONS > 0:
+                self.result["connections"] = await api.warm_connections(self.WARMUP_CONNECTIONS)
+
+            if session_service.SPARE_SESSIONS_PER_MODEL > 0:
+                created = await asyncio.gather(*(
+                    session_service.fill_spare_chats(anuneko_model)
+                    for anuneko_model in set(session_service.MODEL_MAPPING.values())
+                ))
+                self.result["spare_sessions"] = sum(created)
+        except Exception as e:
+            logger.exception(f"启动预热失败: {str(e)}")
+        finally:
+            self.finished_at = time.time()
+            logger.info(
+                "启动预热完成",
+                extra={
+                    "snapshot_loaded": self.snapshot_loaded,
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                    **self.result
+                }
+            )
+
+    def status(self) -> Dict[str, Any]:
+        """预热状态"""
+        return {
+            "enabled": self.ENABLED,
+            "in_progress": self.in_progress,
+            "snapshot_loaded": self.snapshot_loaded,
+            "duration_s": round(self.finished_at - self.started_at, 2) if self.finished_at and self.started_at else None,
+            **self.result
+        }
+
+
+# 全局启动预热服务实例
+warmup_service = WarmupService()
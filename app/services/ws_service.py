@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+WebSocket 聊天服务
+每个连接在第一轮消息时绑定一个会话（新建，或续用客户端指定的会话），之后每轮只需发送
+一个小消息帧，回复以增量帧流式返回；同一连接可以有多轮排队，按 id 对应
+"""
+
+import os
+import time
+import uuid
+import queue
+import threading
+from typing import Any, Dict, Optional, Set
+
+from app.services import json_service
+from app.services.anuneko_service import UpstreamError
+from app.services.session_service import session_service, SessionNotFoundError
+from app.services.chat_service import chat_service
+from app.services.async_bridge import async_bridge
+from app.services.metrics_service import metrics_service
+from app.services.log_service import get_logger
+
+logger = get_logger("websocket")
+
+
+class ChatConnection:
+    """单个 WebSocket 连接
+
+    连接线程负责接收帧，后台工作线程按顺序处理各轮消息：上游会话是一条线性的对话，
+    同一时间只能处理一轮，因此同一连接的各轮不会并发；需要并发的客户端应建立多个连接。
+    发送帧会阻塞到客户端读走数据为止，客户端读得慢时上游读取也随之放慢
+    """
+
+    def __init__(self, ws: Any, model: str, session_id: Optional[str], api_key: Optional[str], max_pending: int):
+        self.ws = ws
+        self.model = model
+        # 客户端指定的会话在第一轮时续用，未指定时第一轮才新建会话
+        self.session_id = session_id
+        self.bound = False
+        self.api_key = api_key
+        self.max_pending = max_pending
+        self.pending: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        self.cancelled: Set[str] = set()
+        self.closed = False
+        self._send_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._work, name="anuneko-ws-worker", daemon=True)
+
+    def send(self, frame: Dict[str, Any]) -> bool:
+        """发送一帧，连接已断开时返回 False"""
+        if self.closed:
+            return False
+        try:
+            with self._send_lock:
+                self.ws.send(json_service.dumps(frame))
+            return True
+        except Exception:
+            self.closed = True
+            return False
+
+    def serve(self, idle_timeout: float) -> None:
+        """接收并分派客户端帧，直到连接关闭或空闲超时"""
+        self._worker.start()
+        try:
+            while not self.closed:
+                data = self.ws.receive(timeout=idle_timeout or None)
+                if data is None:
+                    logger.info("WebSocket 连接空闲超时", extra={"session_id": self.session_id})
+                    break
+                self._handle(data)
+        finally:
+            self.closed = True
+            self.pending.put(None)
+
+    def _handle(self, data: Any) -> None:
+        try:
+            frame = json_service.loads(data)
+        except Exception:
+            self.send(self._error(None, "消息帧不是合法的 JSON", "invalid_frame"))
+            return
+        if not isinstance(frame, dict):
+            self.send(self._error(None, "消息帧必须是 JSON 对象", "invalid_frame"))
+            return
+
+        frame_type = frame.get("type", "chat")
+        turn_id = str(frame.get("id") or uuid.uuid4().hex[:12])
+
+        if frame_type == "ping":
+            self.send({"type": "pong", "id": frame.get("id")})
+        elif frame_type == "cancel":
+            self.cancelled.add(turn_id)
+        elif frame_type == "chat":
+            content = frame.get("content")
+            if not isinstance(content, str) or not content:
+                self.send(self._error(turn_id, "content 不能为空", "invalid_frame"))
+            elif self.pending.qsize() >= self.max_pending:
+                # 背压：排队的轮次过多时直接拒绝，客户端稍后重发
+                ws_service.stats["rejected_turns"] += 1
+                self.send(self._error(turn_id, "排队的消息过多，请等待之前的回复完成", "too_many_pending_turns"))
+            else:
+                self.pending.put({"id": turn_id, "content": content})
+                self.send({"type": "queued", "id": turn_id, "position": self.pending.qsize()})
+        else:
+            self.send(self._error(turn_id, f"未知的帧类型: {frame_type}", "invalid_frame"))
+
+    def _work(self) -> None:
+        while True:
+            turn = self.pending.get()
+            if turn is None or self.closed:
+                return
+            if turn["id"] in self.cancelled:
+                self.cancelled.discard(turn["id"])
+                self.send({"type": "done", "id": turn["id"], "finish_reason": "cancelled"})
+                continue
+            self._run_turn(turn)
+
+    def _bind_session(self, turn: Dict[str, Any]) -> bool:
+        """第一轮时绑定会话：续用客户端指定的会话，或新建一个不影响 API Key 会话绑定的会话
+
+        指定的会话不存在或已过期时发送错误帧并关闭连接，由客户端不带 session_id 重新连接
+        """
+        try:
+            self.session_id = session_service.get_session_for_request(
+                {"model": self.model, "messages": [{"role": "user", "content": turn["content"]}]},
+                self.api_key,
+                session_id=self.session_id,
+                bind=False
+            )
+        except SessionNotFoundError as e:
+            self.send(self._error(turn["id"], str(e), e.code))
+            self.closed = True
+            try:
+                self.ws.close()
+            except Exception:
+                pass
+            return False
+        except Exception as e:
+            logger.exception(f"WebSocket 会话创建失败: {str(e)}")
+            self.send(self._error(turn["id"], f"服务器内部错误: {str(e)}", "server_error", "server_error"))
+            return False
+        self.bound = True
+        logger.info("WebSocket 连接绑定会话", extra={"session_id": self.session_id, "model": self.model})
+        return self.send({"type": "session", "session_id": self.session_id, "model": self.model})
+
+    def _run_turn(self, turn: Dict[str, Any]) -> None:
+        turn_id = turn["id"]
+        if not self.bound and not self._bind_session(turn):
+            return
+        session = session_service.get_session(self.session_id)
+        if session is None:
+            self.send(self._error(turn_id, "会话已被删除，请重新建立连接", "session_not_found"))
+            return
+        session_service.session_last_used[self.session_id] = time.time()
+
+        start = time.perf_counter()
+        finish_reason = "stop"
+        chunk_count = 0
+        upstream = chat_service.session_reply(
+            session, self.session_id, turn["content"], api_key=self.api_key
+        )
+        try:
+            for chunk in async_bridge.iterate(upstream):
+                chunk_count += 1
+                if not self.send({"type": "delta", "id": turn_id, "content": chunk}):
+                    return
+                if turn_id in self.cancelled:
+                    self.cancelled.discard(turn_id)
+                    finish_reason = "cancelled"
+                    break
+            self.send({"type": "done", "id": turn_id, "finish_reason": finish_reason})
+        except UpstreamError as e:
+            self.send(self._error(turn_id, str(e), e.code, "upstream_error"))
+        except Exception as e:
+            logger.exception(f"WebSocket 回复失败: {str(e)}", extra={"session_id": self.session_id})
+            self.send(self._error(turn_id, f"服务器内部错误: {str(e)}", "server_error", "server_error"))
+        finally:
+            ws_service.stats["turns"] += 1
+            logger.info(
+                "WebSocket 回复结束",
+                extra={
+                    "session_id": self.session_id,
+                    "turn_id": turn_id,
+                    "chunks": chunk_count,
+                    "finish_reason": finish_reason,
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 2)
+                }
+            )
+
+    def _error(self, turn_id: Optional[str], message: str, code: str, error_type: str = "invalid_request_error") -> Dict[str, Any]:
+        return {
+            "type": "error",
+            "id": turn_id,
+            "error": {"message": message, "type": error_type, "code": code}
+        }
+
+
+class WebSocketService:
+    """WebSocket 聊天服务类"""
+
+    def __init__(self):
+        # 每个连接最多排队的轮次（不含正在处理的一轮）
+        self.MAX_PENDING_TURNS = int(os.environ.get("WS_MAX_PENDING_TURNS", 8))
+        # 连接空闲多少秒后关闭，0 表示不关闭
+        self.IDLE_TIMEOUT = float(os.environ.get("WS_IDLE_TIMEOUT", 600))
+        self.connections = 0
+        self.stats = {"connections_total": 0, "turns": 0, "rejected_turns": 0}
+        self._lock = threading.Lock()
+
+    def serve(self, ws: Any, api_key: Optional[str], model: str, session_id: Optional[str] = None) -> None:
+        """处理一个 WebSocket 连接：循环接收消息帧，会话在第一轮消息时绑定
+
+        Args:
+            session_id: 客户端指定续用的会话 ID，未指定时第一轮新建会话
+        """
+        connection = ChatConnection(ws, model, session_id, api_key, self.MAX_PENDING_TURNS)
+        with self._lock:
+            self.connections += 1
+            self.stats["connections_total"] += 1
+        logger.info("WebSocket 连接建立", extra={"session_id": session_id, "model": model})
+        try:
+            connection.serve(self.IDLE_TIMEOUT)
+        finally:
+            with self._lock:
+                self.connections -= 1
+            logger.info("WebSocket 连接关闭", extra={"session_id": connection.session_id})
+
+    def metrics(self) -> Dict[str, Any]:
+        """WebSocket 指标"""
+        return {"connections": self.connections, **self.stats}
+
+
+# 全局 WebSocket 聊天服务实例
+ws_service = WebSocketService()
+metrics_service.register("websocket", ws_service.metrics)
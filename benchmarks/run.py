@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""
+热点路径微基准测试
+全程使用离线上游桩，不访问网络
+
+每轮测量都与同一进程中的参照工作负载交替运行，结果以相对参照的耗时比值记录和对比，
+基线因此不依赖测量机器的绝对速度；回退判定的阈值随两次测量的离散程度（MAD）放宽
+
+用法:
+    python -m benchmarks.run                                  # 运行并与基线对比
+    python -m benchmarks.run --output results.json            # 保存结果
+    python -m benchmarks.run --update-baseline                # 以本次结果覆盖基线
+    python -m benchmarks.run --only sse_parse,chunk_encode    # 只运行部分基准
+    python -m benchmarks.run --recording trace.jsonl.gz       # 额外用录制的真实流量跑 sse_replay
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import statistics
+import importlib.util
+from typing import Any, Callable, Dict, List, Optional
+
+# 在导入服务前准备环境：不写日志和快照文件，不做启动预热，不需要真实 Token
+os.environ.setdefault("ANUNEKO_TOKEN", "bench-token")
+os.environ.setdefault("LOG_LEVEL", "warning")
+os.environ.setdefault("LOG_PATH", tempfile.mkdtemp(prefix="anuneko-bench-"))
+os.environ.setdefault("WARMUP_ENABLED", "false")
+os.environ.setdefault("MODEL_CATALOG_SNAPSHOT", "")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from app.services.anuneko_service import AnuNekoAPI
+from app.services.chat_service import chat_service
+from app.services.session_service import session_service
+from app.services.traffic_recorder import ReplayTransport, route_key
+from benchmarks.stub_upstream import build_transport
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# 变化需超过两次测量相对 MAD 之和的该倍数才视为回退，避免把测量噪声当作回退
+NOISE_FACTOR = 3
+
+# 基准注册表: 名称 -> 构造函数
+BENCHMARKS: Dict[str, Callable[[], Callable[[], int]]] = {}
+# 依赖录制文件的基准，只在指定 --recording 时运行，也不写入基线
+RECORDING_BENCHMARKS = {"sse_replay"}
+RECORDING_PATH: Optional[str] = None
+
+
+def benchmark(name: str):
+    """注册基准；被装饰函数负责准备数据并返回一个执行一轮、返回操作数的函数"""
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+_flask_app = None
+
+
+def load_flask_app():
+    """加载根目录的 app.py（与 app 包同名，需按文件路径导入）"""
+    global _flask_app
+    if _flask_app is None:
+        spec = importlib.util.spec_from_file_location("anuneko_server", os.path.join(ROOT, "app.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _flask_app = module.app
+    return _flask_app
+
+
+def install_stub_api(frames: int = 200, branches: int = 2) -> AnuNekoAPI:
+    """让会话服务使用离线上游桩"""
+    api = AnuNekoAPI(token="bench-token", transport=build_transport(frames, branches))
+    session_service._anuneko_api = api
+    return api
+
+
+def reference_workload() -> Callable[[], int]:
+    """参照工作负载：与项目代码无关的纯 Python 字典、字符串与列表操作，用于换算机器与负载的速度差异"""
+    words = [f"word{i}" for i in range(50)]
+
+    def run():
+        for i in range(200):
+            counts = {word: len(word) + i for word in words}
+            text = ",".join(f"{key}={value}" for key, value in counts.items())
+            sorted(text.split(","), reverse=True)
+        return 200
+
+    return run
+
+
+@benchmark("sse_parse")
+def bench_sse_parse():
+    """AnuNekoAPI.stream_reply_generator 逐帧解析（每次操作为一帧）"""
+    frames = 200
+    api = install_stub_api(frames=frames)
+    loop = asyncio.new_event_loop()
+
+    async def consume():
+        count = 0
+        async for _ in api.stream_reply_generator("bench-chat", "你好"):
+            count += 1
+        return count
+
+    def run():
+        loop.run_until_complete(consume())
+        return frames
+
+    return run
+
+
+@benchmark("sse_replay")
+def bench_sse_replay():
+    """以最快速度回放录制的上游流量并逐帧解析（每次操作为一个回复）"""
+    transport = ReplayTransport.from_file(RECORDING_PATH, speed=0)
+    api = AnuNekoAPI(token="bench-token", transport=transport)
+    replies = sum(1 for record in transport.records if route_key(record["method"], record["url"]).endswith("/stream"))
+    if not replies:
+        raise SystemExit(f"录制文件中没有流式回复: {RECORDING_PATH}")
+    loop = asyncio.new_event_loop()
+
+    async def consume():
+        for _ in range(replies):
+            async for _ in api.stream_reply_generator("bench-chat", "你好"):
+                pass
+
+    def run():
+        loop.run_until_complete(consume())
+        return replies
+
+    return run
+
+
+@benchmark("chunk_encode")
+def bench_chunk_encode():
+    """ChatService.format_openai_chunk 编码一个流式块"""
+    content = "这是一段用于基准测试的流式回复内容，"
+
+    def run():
+        for _ in range(1000):
+            chat_service.format_openai_chunk("mihoyo-orange_cat", content, "bench-session")
+        return 1000
+
+    return run
+
+
+def _register_json_benchmarks():
+    """为每个可用的 JSON 后端注册逐帧编解码基准，对比各后端的单帧开销"""
+    from app.services.json_service import _load_backend
+
+    frame = "data: " + json.dumps(
+        {"c": [{"v": "这是上游推送的一段回复内容，"}, {"v": "这是另一个分支的内容，", "c": 1}]},
+        ensure_ascii=False
+    )
+    chunk = {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion.chunk",
+        "created": 1700000000,
+        "model": "mihoyo-orange_cat",
+        "choices": [{"index": 0, "delta": {"content": "这是上游推送的一段回复内容，"}, "finish_reason": None}],
+        "session_id": "bench-session"
+    }
+
+    for name in ("json", "ujson", "orjson"):
+        try:
+            _, dumps_bytes, loads = _load_backend(name)
+        except ImportError:
+            continue
+
+        def make(dumps_bytes=dumps_bytes, loads=loads):
+            def run():
+                for _ in range(1000):
+                    loads(frame[6:])
+                    dumps_bytes(chunk)
+                return 1000
+            return run
+
+        make.__doc__ = f"{name} 解码一个上游帧并编码一个输出块"
+        benchmark(f"frame_json[{name}]")(make)
+
+
+_register_json_benchmarks()
+
+
+@benchmark("session_decision")
+def bench_session_decision():
+    """SessionService.should_create_new_session 对已有会话的判断"""
+    session_service.sessions["bench-session"] = {
+        "id": "bench-session",
+        "anuneko_chat_id": "bench-chat",
+        "model": "Orange Cat",
+        "openai_model": "mihoyo-orange_cat",
+        "created_at": "",
+        "has_anuneko_chat": True
+    }
+    session_service.session_last_used["bench-session"] = time.time()
+    messages = []
+    for i in range(20):
+        messages.append({"role": "user", "content": f"问题{i}"})
+        messages.append({"role": "assistant", "content": f"回答{i}"})
+
+    def run():
+        for _ in range(1000):
+            session_service.should_create_new_session(messages, "bench-session")
+        return 1000
+
+    return run
+
+
+@benchmark("session_reuse")
+def bench_session_reuse():
+    """SessionService.get_session_for_request 复用已有会话"""
+    install_stub_api()
+    session_service.MODEL_MAPPING = {"mihoyo-orange_cat": "Orange Cat"}
+    request_data = {
+        "model": "mihoyo-orange_cat",
+        "messages": [
+            {"role": "user", "content": "你好"},
+            {"role": "assistant", "content": "你好呀"},
+            {"role": "user", "content": "再聊聊"}
+        ]
+    }
+    session_service.api_key_sessions.pop(session_service.binding_key("bench-key", "Orange Cat"), None)
+    session_service.get_session_for_request(request_data, "bench-key")
+
+    def run():
+        for _ in range(200):
+            session_service.get_session_for_request(request_data, "bench-key")
+        return 200
+
+    return run
+
+
+@benchmark("session_create")
+def bench_session_create():
+    """SessionService.get_session_for_request 新建会话（上游桩）"""
+    install_stub_api()
+    session_service.MODEL_MAPPING = {"mihoyo-orange_cat": "Orange Cat"}
+    request_data = {"model": "mihoyo-orange_cat", "messages": [{"role": "user", "content": "你好"}]}
+
+    def run():
+        for _ in range(20):
+            session_service.get_session_for_request(request_data, "bench-create-key")
+        return 20
+
+    return run
+
+
+@benchmark("catalog_build")
+def bench_catalog_build():
+    """models.show 构建模型目录（上游桩）"""
+    from app.api.v1.models import models
+
+    install_stub_api()
+    app = load_flask_app()
+
+    def run():
+        with app.test_request_context("/v1/models"):
+            for _ in range(20):
+                models.show()
+        return 20
+
+    return run
+
+
+@benchmark("flask_request")
+def bench_flask_request():
+    """Flask 测试客户端发起一次非流式聊天请求的端到端开销"""
+    install_stub_api(frames=20)
+    session_service.MODEL_MAPPING = {"mihoyo-orange_cat": "Orange Cat"}
+    client = load_flask_app().test_client()
+    payload = {
+        "model": "mihoyo-orange_cat",
+        "messages": [
+            {"role": "user", "content": "你好"},
+            {"role": "assistant", "content": "你好呀"},
+            {"role": "user", "content": "再聊聊"}
+        ]
+    }
+    headers = {"Authorization": "Bearer bench-flask-key"}
+    client.post("/v1/chat/completions", json=payload, headers=headers)
+
+    def run():
+        for _ in range(20):
+            client.post("/v1/chat/completions", json=payload, headers=headers)
+        return 20
+
+    return run
+
+
+def _timed(run: Callable[[], int]) -> float:
+    """执行一轮，返回每次操作的秒数"""
+    start = time.perf_counter()
+    ops = run()
+    return (time.perf_counter() - start) / ops
+
+
+def relative_mad(values: List[float]) -> float:
+    """中位数绝对偏差相对中位数的比例"""
+    median = statistics.median(values)
+    if not median:
+        return 0.0
+    return statistics.median(abs(value - median) for value in values) / median
+
+
+def run_benchmark(name: str, repeat: int, warmup: int) -> Dict[str, Any]:
+    """运行单个基准：每轮测量前运行一轮参照工作负载，取各轮耗时比值的中位数"""
+    run = BENCHMARKS[name]()
+    reference = reference_workload()
+    for _ in range(warmup):
+        reference()
+        run()
+
+    per_op = []
+    ratios = []
+    for _ in range(repeat):
+        reference_per_op = _timed(reference)
+        per_op.append(_timed(run))
+        ratios.append(per_op[-1] / reference_per_op)
+
+    median = statistics.median(per_op)
+    return {
+        "name": name,
+        "description": (BENCHMARKS[name].__doc__ or "").strip(),
+        "repeat": repeat,
+        # 相对参照工作负载的耗时比值，用于与基线对比
+        "ratio": round(statistics.median(ratios), 4),
+        "ratio_mad": round(relative_mad(ratios), 4),
+        # 本机的绝对耗时，仅供参考
+        "ns_per_op": round(median * 1e9, 1),
+        "ns_per_op_min": round(min(per_op) * 1e9, 1),
+        "ops_per_s": round(1 / median, 1) if median else None
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """按参照比值与基线对比，返回变慢超过阈值且超出测量噪声的回退项"""
+    baseline_by_name = {item["name"]: item for item in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        base = baseline_by_name.get(result["name"])
+        if not base or not base.get("ratio"):
+            result["change"] = None
+            continue
+        change = result["ratio"] / base["ratio"] - 1
+        result["change"] = round(change, 4)
+        result["allowed"] = round(max(threshold, NOISE_FACTOR * (result["ratio_mad"] + base.get("ratio_mad", 0))), 4)
+        if change > result["allowed"]:
+            regressions.append(result)
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="AnuNeko 代理热点路径微基准测试")
+    parser.add_argument("--only", help="只运行指定基准，逗号分隔")
+    parser.add_argument("--repeat", type=int, default=7, help="每个基准的测量轮数")
+    parser.add_argument("--warmup", type=int, default=2, help="预热轮数")
+    parser.add_argument("--output", help="结果 JSON 输出路径")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基线文件路径")
+    parser.add_argument("--threshold", type=float, default=0.25, help="相对基线变慢超过该比例（且超出测量噪声）即视为回退")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果覆盖基线")
+    parser.add_argument("--recording", help="上游流量录制文件（UPSTREAM_RECORD_PATH 生成），用于 sse_replay")
+    args = parser.parse_args(argv)
+
+    global RECORDING_PATH
+    RECORDING_PATH = args.recording
+    if args.only:
+        names = args.only.split(",")
+    else:
+        names = [name for name in BENCHMARKS if RECORDING_PATH or name not in RECORDING_BENCHMARKS]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知基准: {', '.join(unknown)}")
+    if not RECORDING_PATH and RECORDING_BENCHMARKS.intersection(names):
+        parser.error("sse_replay 需要通过 --recording 指定录制文件")
+
+    results = []
+    for name in names:
+        result = run_benchmark(name, args.repeat, args.warmup)
+        results.append(result)
+        print(
+            f"{name:<20} {result['ns_per_op']:>14,.1f} ns/op  参照比值 {result['ratio']:>10,.4f} ±{result['ratio_mad']:.1%}",
+            file=sys.stderr
+        )
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": int(time.time()),
+        "results": results
+    }
+
+    regressions = []
+    if not args.update_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        report["threshold"] = args.threshold
+        report["regressions"] = [item["name"] for item in regressions]
+        for item in results:
+            if item.get("change") is not None:
+                print(f"{item['name']:<20} 相对基线 {item['change']:+.1%}（允许 {item['allowed']:+.1%}）", file=sys.stderr)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.update_baseline:
+        # 基线只保存与机器速度无关的参照比值
+        baseline = {
+            "python": report["python"],
+            "timestamp": report["timestamp"],
+            "results": [
+                {key: item[key] for key in ("name", "description", "repeat", "ratio", "ratio_mad")}
+                for item in results if item["name"] not in RECORDING_BENCHMARKS
+            ]
+        }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            f.write(json.dumps(baseline, ensure_ascii=False, indent=2) + "\n")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if regressions:
+        print(f"性能回退: {', '.join(item['name'] for item in regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+离线上游桩
+用 httpx.MockTransport 模拟 anuneko.com 的各个接口，基准测试全程不访问网络
+"""
+
+import json
+import itertools
+from typing import List
+
+import httpx
+
+
+def build_stream_body(frames: int = 200, branches: int = 2) -> bytes:
+    """构造与上游格式一致的 SSE 响应体"""
+    lines: List[str] = []
+    for i in range(frames):
+        choices = [{"v": f"第{i}段回复内容，"}]
+        for branch in range(1, branches):
+            choices.append({"v": f"分支{branch}的第{i}段，", "c": branch})
+        lines.append("data: " + json.dumps({"c": choices}, ensure_ascii=False))
+    lines.append("data: " + json.dumps({"msg_id": "bench-msg"}))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def build_transport(frames: int = 200, branches: int = 2, models: List[str] = None) -> httpx.MockTransport:
+    """构造模拟上游的传输层"""
+    stream_body = build_stream_body(frames, branches)
+    model_view = {"models": models or ["Orange Cat", "Exotic Shorthair"]}
+    chat_ids = itertools.count()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path.endswith("/user/view"):
+            return httpx.Response(200, json=model_view)
+        if path.endswith("/api/v1/chat"):
+            return httpx.Response(200, json={"chat_id": f"bench-chat-{next(chat_ids)}"})
+        if path.endswith("/select_model") or path.endswith("/select-choice"):
+            return httpx.Response(200, json={})
+        if path.endswith("/stream"):
+            return httpx.Response(200, content=stream_body)
+        return httpx.Response(404)
+
+    return httpx.MockTransport(handler)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+AnuNeko API 的单元测试：回复被提前截断时仍能确认分支，会话可以继续对话
+"""
+
+import json
+import asyncio
+
+import httpx
+
+from app.services.anuneko_service import AnuNekoAPI
+from app.services.reply_limits import ReplyLimits
+
+
+class FakeUpstream:
+    """模拟上游：流式回复的 msg_id 只在最后一帧给出"""
+
+    def __init__(self, words, msg_id="m1", gap=0.01):
+        self.words = words
+        self.msg_id = msg_id
+        self.gap = gap
+        self.choices = []
+
+    def handler(self, request):
+        if request.url.path.endswith("/select-choice"):
+            self.choices.append(json.loads(request.content))
+            return httpx.Response(200, json={})
+
+        async def body():
+            for word in self.words:
+                await asyncio.sleep(self.gap)
+                yield ("data: " + json.dumps({"c": [{"v": word}]}, ensure_ascii=False) + "\n").encode()
+            yield ("data: " + json.dumps({"msg_id": self.msg_id}) + "\n").encode()
+
+        return httpx.Response(200, content=body())
+
+
+def make_api(upstream):
+    return AnuNekoAPI(token="test", transport=httpx.MockTransport(upstream.handler))
+
+
+async def limited_reply(api, chat_id, limits):
+    """与聊天服务一样按限制截断回复并立即关闭上游流"""
+    output = []
+    stream = api.stream_reply_generator(chat_id, "hi", raise_errors=True)
+    try:
+        async for chunk in stream:
+            output.append(limits.feed(chunk))
+            if limits.finish_reason is not None:
+                break
+    finally:
+        await stream.aclose()
+    return "".join(output)
+
+
+def test_stop_sequence_mid_conversation_confirms_branch():
+    upstream = FakeUpstream(["第一句。", "第二句。", "第三句。"])
+    api = make_api(upstream)
+
+    async def run():
+        reply = await limited_reply(api, "chat-1", ReplyLimits(stop=["。"]))
+        # 截断时还没有收到 msg_id，分支在后台读完剩余的流后确认
+        unconfirmed = await api.take_unconfirmed("chat-1")
+        return reply, unconfirmed
+
+    reply, unconfirmed = asyncio.run(run())
+    assert reply == "第一句"
+    assert not unconfirmed
+    assert upstream.choices == [{"msg_id": "m1", "choice_idx": 0}]
+    assert api.in_flight == 0
+
+
+def test_max_tokens_mid_conversation_confirms_branch():
+    upstream = FakeUpstream(["你好", "世界", "再见"])
+    api = make_api(upstream)
+
+    async def run():
+        reply = await limited_reply(api, "chat-1", ReplyLimits(max_tokens=2))
+        return reply, await api.take_unconfirmed("chat-1")
+
+    reply, unconfirmed = asyncio.run(run())
+    assert reply == "你好"
+    assert not unconfirmed
+    assert upstream.choices == [{"msg_id": "m1", "choice_idx": 0}]
+
+
+def test_stream_without_msg_id_is_marked_unconfirmed():
+    upstream = FakeUpstream(["你好", "世界"], msg_id=None)
+    api = make_api(upstream)
+
+    async def run():
+        await limited_reply(api, "chat-1", ReplyLimits(max_tokens=1))
+        return await api.take_unconfirmed("chat-1")
+
+    assert asyncio.run(run())
+    assert upstream.choices == []
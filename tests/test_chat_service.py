@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+聊天服务的单元测试：并发限制器只按上游请求采样
+"""
+
+import asyncio
+import contextlib
+
+import pytest
+
+from app.services import chat_service as chat_module
+from app.services.chat_service import chat_service
+from app.services.limiter_service import AdaptiveLimiter
+
+
+class FakeAPI:
+    """只实现回复流程用到的接口"""
+
+    def __init__(self, alternate=None):
+        self.alternate = alternate
+
+    async def take_alternate(self, chat_id):
+        alternate, self.alternate = self.alternate, None
+        return alternate
+
+    async def take_unconfirmed(self, chat_id):
+        return False
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = AdaptiveLimiter()
+    monkeypatch.setattr(chat_module, "limiter_service", limiter)
+    return limiter
+
+
+@pytest.fixture
+def session():
+    return {"api_key": None, "anuneko_chat_id": "chat-1", "model": "Orange Cat", "turns": 1}
+
+
+def reply(session, regenerate=False):
+    """通过并发限制后生成一轮回复，返回拼接的文本"""
+    assert chat_module.limiter_service.try_acquire()
+    outcome = {}
+    upstream = chat_service._reply_chunks(session, "s1", "hi", [], regenerate=regenerate, outcome=outcome)
+    return asyncio.run(chat_service._collect_reply(chat_service._admitted(upstream, outcome)))
+
+
+def test_queue_wait_is_not_counted_as_upstream_latency(monkeypatch, limiter, session):
+    @contextlib.asynccontextmanager
+    async def slow_slot(api_key, interactive):
+        await asyncio.sleep(0.2)
+        yield
+
+    async def upstream_stream(*args, **kwargs):
+        yield "你好"
+
+    monkeypatch.setattr(chat_module.scheduler_service, "slot", slow_slot)
+    monkeypatch.setattr(chat_service, "get_anuneko_api", lambda api_key=None: FakeAPI())
+    monkeypatch.setattr(chat_service, "_upstream_stream", upstream_stream)
+
+    assert reply(session) == "你好"
+    assert limiter.in_flight == 0
+    assert limiter.baseline_ttft is not None and limiter.baseline_ttft < 0.1
+
+
+def test_regenerate_cache_hit_leaves_limiter_unchanged(monkeypatch, limiter, session):
+    async def upstream_stream(*args, **kwargs):
+        raise AssertionError("命中缓存时不应请求上游")
+        yield
+
+    monkeypatch.setattr(chat_service, "get_anuneko_api", lambda api_key=None: FakeAPI(alternate="备选回复"))
+    monkeypatch.setattr(chat_service, "_upstream_stream", upstream_stream)
+    before = limiter.metrics()
+
+    assert reply(session, regenerate=True) == "备选回复"
+    after = limiter.metrics()
+    # 只多了一次准入，上限、基线与拥塞统计都不变
+    assert after.pop("admitted") == before.pop("admitted") + 1
+    assert after == before
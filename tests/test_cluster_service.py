@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+集群转发标记的单元测试：只信任已知节点用共享密钥签名且未过期的标记
+"""
+
+import time
+
+import pytest
+from flask import Flask
+
+from app.services.cluster_service import ClusterService, FORWARDED_HEADER, FORWARDED_MAX_AGE
+
+NODE_A = "http://10.0.0.1:8000"
+NODE_B = "http://10.0.0.2:8000"
+
+
+def make_node(monkeypatch, node_url, secret="s3cret"):
+    monkeypatch.setenv("CLUSTER_ENABLED", "true")
+    monkeypatch.setenv("CLUSTER_NODE_URL", node_url)
+    monkeypatch.setenv("CLUSTER_PEERS", f"{NODE_A},{NODE_B}")
+    monkeypatch.setenv("CLUSTER_SECRET", secret)
+    return ClusterService()
+
+
+def is_forwarded(node, marker):
+    headers = {FORWARDED_HEADER: marker} if marker is not None else {}
+    with Flask(__name__).test_request_context(headers=headers):
+        return node.is_forwarded()
+
+
+def test_marker_from_peer_is_trusted(monkeypatch):
+    node_a = make_node(monkeypatch, NODE_A)
+    node_b = make_node(monkeypatch, NODE_B)
+    assert is_forwarded(node_b, node_a.forwarded_marker())
+
+
+@pytest.mark.parametrize("marker", [None, "", "1", NODE_A, f"{NODE_A};{int(time.time())};deadbeef"])
+def test_spoofed_marker_is_ignored(monkeypatch, marker):
+    node_b = make_node(monkeypatch, NODE_B)
+    assert not is_forwarded(node_b, marker)
+
+
+def test_marker_signed_with_other_secret_is_ignored(monkeypatch):
+    node_a = make_node(monkeypatch, NODE_A, secret="other")
+    node_b = make_node(monkeypatch, NODE_B)
+    assert not is_forwarded(node_b, node_a.forwarded_marker())
+
+
+def test_marker_from_unknown_node_is_ignored(monkeypatch):
+    outsider = make_node(monkeypatch, "http://10.0.0.9:8000")
+    node_b = make_node(monkeypatch, NODE_B)
+    assert not is_forwarded(node_b, outsider.forwarded_marker())
+
+
+def test_expired_marker_is_ignored(monkeypatch):
+    node_a = make_node(monkeypatch, NODE_A)
+    node_b = make_node(monkeypatch, NODE_B)
+    marker = node_a.forwarded_marker()
+    monkeypatch.setattr(time, "time", lambda: int(marker.split(";")[1]) + FORWARDED_MAX_AGE + 1)
+    assert not is_forwarded(node_b, marker)
+
+
+def test_cluster_requires_secret(monkeypatch):
+    assert not make_node(monkeypatch, NODE_A, secret="").ENABLED
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+对冲预算与对冲请求的单元测试
+"""
+
+import asyncio
+
+from app.services import hedging_service as hedging_module
+from app.services.hedging_service import HedgeBudget, HedgingService
+
+
+def test_hedge_budget_forgets_full_and_old_keys():
+    budget = HedgeBudget(ratio=0.5, burst=3, max_keys=10)
+    for _ in range(10):
+        budget.earn("steady")
+    assert "steady" not in budget._tokens
+
+    for i in range(100):
+        assert budget.take(f"key-{i}")
+    assert len(budget._tokens) == 10
+
+
+def test_hedge_budget_limits_hedges():
+    budget = HedgeBudget(ratio=0.5, burst=3)
+    assert [budget.take("k") for _ in range(4)] == [True, True, True, False]
+    budget.earn("k")
+    budget.earn("k")
+    assert budget.take("k")
+
+
+class FakeAPI:
+    """记录上游流的打开与关闭；delays 为各会话首帧前的等待秒数"""
+
+    def __init__(self, delays, create_delay=0.0):
+        self.delays = delays
+        self.create_delay = create_delay
+        self.open = set()
+        self.created = []
+
+    async def create_session(self, model):
+        await asyncio.sleep(self.create_delay)
+        chat_id = f"backup-{len(self.created)}"
+        self.created.append(chat_id)
+        return chat_id
+
+    async def stream_reply_generator(self, chat_id, text, raise_errors=False):
+        self.open.add(chat_id)
+        try:
+            await asyncio.sleep(self.delays.get(chat_id, 0))
+            yield chat_id
+            yield "done"
+        finally:
+            self.open.discard(chat_id)
+
+
+def make_service(monkeypatch, delay=0.05):
+    service = HedgingService()
+    service.ENABLED = True
+    service.DEFAULT_DELAY = delay
+    released = []
+    monkeypatch.setattr(hedging_module.session_service, "is_shared_api", lambda api: True)
+    monkeypatch.setattr(hedging_module.session_service, "acquire_spare_chat", lambda model: None)
+    monkeypatch.setattr(
+        hedging_module.session_service, "release_spare_chat", lambda model, chat_id: released.append(chat_id)
+    )
+    return service, released
+
+
+async def consume(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_cancel_while_waiting_for_first_chunk_closes_primary(monkeypatch):
+    service, _ = make_service(monkeypatch, delay=10)
+    api = FakeAPI({"primary": 10})
+
+    async def run():
+        task = asyncio.ensure_future(consume(service.stream(api, "primary", "hi", "m", hedge=True)))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # 在事件循环关闭（会取消所有剩余任务）之前检查
+        await asyncio.sleep(0.05)
+        assert api.open == set()
+        assert len(asyncio.all_tasks()) == 1
+
+    asyncio.run(run())
+
+
+def test_cancel_during_race_closes_both_streams(monkeypatch):
+    service, _ = make_service(monkeypatch)
+    api = FakeAPI({"primary": 10, "backup-0": 10})
+
+    async def run():
+        task = asyncio.ensure_future(consume(service.stream(api, "primary", "hi", "m", hedge=True)))
+        await asyncio.sleep(0.2)
+        assert api.open == {"primary", "backup-0"}
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # 在事件循环关闭（会取消所有剩余任务）之前检查
+        await asyncio.sleep(0.05)
+        assert api.open == set()
+        assert len(asyncio.all_tasks()) == 1
+
+    asyncio.run(run())
+
+
+def test_backup_wins_and_primary_is_closed(monkeypatch):
+    service, _ = make_service(monkeypatch)
+    api = FakeAPI({"primary": 10})
+    switched = []
+
+    chunks = asyncio.run(consume(service.stream(api, "primary", "hi", "m", hedge=True, on_switch=switched.append)))
+    assert chunks == ["backup-0", "done"]
+    assert switched == ["backup-0"]
+    assert api.open == set()
+
+
+def test_unused_backup_chat_is_returned_to_spare_pool(monkeypatch):
+    service, released = make_service(monkeypatch)
+    # 主请求在新建备用会话期间产出首帧
+    api = FakeAPI({"primary": 0.1}, create_delay=0.2)
+
+    chunks = asyncio.run(consume(service.stream(api, "primary", "hi", "m", hedge=True)))
+    assert chunks == ["primary", "done"]
+    assert released == ["backup-0"]
+    assert service.stats["hedged"] == 0
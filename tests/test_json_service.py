@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+JSON 编解码服务的单元测试：各后端的输出与 Flask 默认的 JSON 提供器一致
+"""
+
+import json
+import uuid
+import decimal
+import dataclasses
+from datetime import date, datetime, timezone
+
+import pytest
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from app.services import json_service
+
+
+@dataclasses.dataclass
+class Point:
+    x: int
+    y: int
+
+
+VALUE = {
+    "text": "你好",
+    "created": datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+    "naive": datetime(2024, 1, 2, 3, 4, 5),
+    "day": date(2024, 1, 2),
+    "id": uuid.UUID(int=1),
+    "price": decimal.Decimal("1.50"),
+    "point": Point(1, 2),
+}
+
+
+def available_backends():
+    names = []
+    for name in ["orjson", "ujson", "json"]:
+        try:
+            json_service._load_backend(name)
+            names.append(name)
+        except ImportError:
+            pass
+    return names
+
+
+@pytest.mark.parametrize("name", available_backends())
+def test_backend_matches_flask_default_provider(name):
+    _, dumps_bytes, loads = json_service._load_backend(name)
+    expected = json.loads(DefaultJSONProvider(Flask(__name__)).dumps(VALUE))
+    assert loads(dumps_bytes(VALUE)) == expected
+    assert expected["created"] == "Tue, 02 Jan 2024 03:04:05 GMT"
+
+
+@pytest.mark.parametrize("name", available_backends())
+def test_backend_rejects_unknown_types(name):
+    _, dumps_bytes, _ = json_service._load_backend(name)
+    with pytest.raises(TypeError):
+        dumps_bytes({"value": object()})
+
+
+def test_provider_response_uses_backend(monkeypatch):
+    calls = []
+    monkeypatch.setattr(json_service, "dumps", lambda obj: calls.append(obj) or json.dumps(obj, separators=(",", ":")))
+    app = Flask(__name__)
+    app.json = json_service.FastJSONProvider(app)
+    with app.app_context():
+        response = app.json.response({"text": "你好"})
+    assert calls == [{"text": "你好"}]
+    assert json.loads(response.get_data()) == {"text": "你好"}
+    assert response.get_data().endswith(b"\n")
+    assert response.mimetype == "application/json"
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+日志服务的单元测试：流式响应的完成日志在响应体发送完毕后才记录
+"""
+
+import time
+import logging
+
+import pytest
+from flask import Flask, Response
+from werkzeug.test import EnvironBuilder
+
+from app.services.log_service import LOGGER_NAME, LogService, get_logger
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def logged_app(tmp_path, monkeypatch):
+    monkeypatch.setenv("LOG_PATH", str(tmp_path))
+    monkeypatch.setenv("LOG_LEVEL", "info")
+    root = logging.getLogger(LOGGER_NAME)
+    saved = (list(root.handlers), root.level, root.propagate)
+
+    app = Flask(__name__)
+
+    @app.route("/plain")
+    def plain():
+        return "ok"
+
+    @app.route("/stream")
+    def stream():
+        def generate():
+            for _ in range(3):
+                time.sleep(0.05)
+                yield "data: x\n\n"
+        return Response(generate(), mimetype="text/event-stream")
+
+    service = LogService()
+    service.init_app(app)
+    handler = ListHandler()
+    http_logger = get_logger("http")
+    http_logger.addHandler(handler)
+    yield app, handler
+    http_logger.removeHandler(handler)
+    service.shutdown()
+    root.handlers[:], root.level, root.propagate = saved
+
+
+def completions(handler):
+    return [record for record in handler.records if record.getMessage() == "请求完成"]
+
+
+def test_plain_response_logged_after_request(logged_app):
+    app, handler = logged_app
+    response = app.test_client().get("/plain")
+    records = completions(handler)
+    assert len(records) == 1
+    assert records[0].status == 200
+    assert records[0].request_id == response.headers["X-Request-ID"]
+
+
+def test_stream_duration_covers_whole_body(logged_app):
+    app, handler = logged_app
+    environ = EnvironBuilder(path="/stream", headers={"X-Request-ID": "req-1"}).get_environ()
+    body = app.wsgi_app(environ, lambda status, headers: None)
+    assert completions(handler) == []
+
+    chunks = list(body)
+    assert len(chunks) == 3
+    assert completions(handler) == []
+
+    body.close()
+    records = completions(handler)
+    assert len(records) == 1
+    assert records[0].path == "/stream"
+    assert records[0].request_id == "req-1"
+    assert records[0].duration_ms >= 150
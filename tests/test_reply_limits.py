@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+回复长度与停止序列限制的单元测试
+"""
+
+import pytest
+
+from app.services.reply_limits import ReplyLimits, estimate_tokens
+
+
+def feed_all(limits, chunks):
+    """依次输入片段，上游正常结束时追加 flush 的输出"""
+    output = "".join(limits.feed(chunk) for chunk in chunks)
+    return output + limits.flush()
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("你好") == 2
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("") == 0
+
+
+def test_no_limits_passes_through():
+    limits = ReplyLimits()
+    assert not limits.active
+    assert feed_all(limits, ["Hello", " world"]) == "Hello world"
+    assert limits.finish_reason is None
+
+
+def test_stop_within_single_chunk():
+    limits = ReplyLimits(stop=["END"])
+    assert limits.feed("abc END tail") == "abc "
+    assert limits.finish_reason == "stop"
+    # 触发后不再输出
+    assert limits.feed("more") == ""
+    assert limits.flush() == ""
+
+
+def test_stop_across_chunk_boundary():
+    limits = ReplyLimits(stop=["END"])
+    assert [limits.feed(chunk) for chunk in ["abc E", "N", "D tail"]] == ["abc ", "", ""]
+    assert limits.finish_reason == "stop"
+
+
+def test_held_tail_released_when_not_a_match():
+    limits = ReplyLimits(stop=["END"])
+    assert limits.feed("abc E") == "abc "
+    # "EN" + "x" 不构成停止序列，暂缓的尾部随下一片段输出
+    assert limits.feed("Nx") == "ENx"
+    assert limits.finish_reason is None
+
+
+def test_held_tail_flushed_at_end_of_stream():
+    limits = ReplyLimits(stop=["END"])
+    assert limits.feed("abc EN") == "abc "
+    assert limits.flush() == "EN"
+    assert limits.finish_reason is None
+
+
+def test_earliest_of_several_stop_sequences_wins():
+    limits = ReplyLimits(stop=["world", "lo"])
+    assert limits.feed("hello world") == "hel"
+    assert limits.finish_reason == "stop"
+
+
+def test_max_tokens_truncates_mid_chunk():
+    limits = ReplyLimits(max_tokens=5)
+    assert [limits.feed(chunk) for chunk in ["你好世界", "再见", "x"]] == ["你好世界", "再", ""]
+    assert limits.finish_reason == "length"
+
+
+def test_max_tokens_exactly_reached():
+    limits = ReplyLimits(max_tokens=2)
+    assert limits.feed("你好") == "你好"
+    assert limits.finish_reason == "length"
+    assert limits.feed("再见") == ""
+
+
+def test_stop_and_max_tokens_combined():
+    # 截断到停止序列前的文本仍受 token 预算限制
+    limits = ReplyLimits(max_tokens=2, stop=["。"])
+    assert limits.feed("你好世界。") == "你好"
+    assert limits.finish_reason == "length"
+
+    limits = ReplyLimits(max_tokens=10, stop=["。"])
+    assert limits.feed("你好。世界") == "你好"
+    assert limits.finish_reason == "stop"
+
+
+def test_held_tail_counts_against_budget_on_flush():
+    limits = ReplyLimits(max_tokens=1, stop=["END"])
+    assert limits.feed("abE") == "ab"
+    assert limits.flush() == "E"
+    assert limits.finish_reason is None
+    assert limits.tokens == 0.75
+
+
+def test_from_request_defaults():
+    limits = ReplyLimits.from_request({})
+    assert limits.max_tokens is None
+    assert limits.stop == []
+    assert not limits.active
+
+
+def test_from_request_max_completion_tokens_takes_precedence():
+    limits = ReplyLimits.from_request({"max_tokens": 100, "max_completion_tokens": 5})
+    assert limits.max_tokens == 5
+    assert ReplyLimits.from_request({"max_tokens": 100}).max_tokens == 100
+
+
+def test_from_request_stop_forms():
+    assert ReplyLimits.from_request({"stop": "END"}).stop == ["END"]
+    assert ReplyLimits.from_request({"stop": ["a", "", "b"]}).stop == ["a", "b"]
+    assert ReplyLimits.from_request({"stop": None}).stop == []
+
+
+@pytest.mark.parametrize("request_data", [
+    {"max_tokens": 0},
+    {"max_tokens": -1},
+    {"max_tokens": 1.5},
+    {"max_tokens": True},
+    {"max_tokens": "10"},
+    {"max_completion_tokens": 0, "max_tokens": 10},
+    {"stop": 5},
+    {"stop": ["a", 1]},
+    {"stop": ["a", "b", "c", "d", "e"]},
+])
+def test_from_request_rejects_invalid_values(request_data):
+    with pytest.raises(ValueError):
+        ReplyLimits.from_request(request_data)
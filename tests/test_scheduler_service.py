@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+上游调度的单元测试
+"""
+
+import asyncio
+
+from app.services.scheduler_service import SchedulerService
+
+
+def test_rotating_keys_do_not_grow_scheduler_state():
+    scheduler = SchedulerService()
+    scheduler.MAX_TRACKED_KEYS = 100
+
+    async def run():
+        for i in range(5000):
+            async with scheduler.slot(f"key-{i}", interactive=i % 2 == 0):
+                pass
+
+    asyncio.run(run())
+    assert scheduler.active == 0
+    assert len(scheduler._key_stats) == 100
+    assert len(scheduler._last_finish) <= 1024
+
+
+def test_weighted_fair_order_is_kept():
+    scheduler = SchedulerService()
+    scheduler.MAX_UPSTREAM_STREAMS = 1
+    order = []
+
+    async def request(key):
+        async with scheduler.slot(key, interactive=True):
+            order.append(key)
+            await asyncio.sleep(0)
+
+    async def run():
+        await asyncio.gather(*(request(key) for key in ["a"] * 3 + ["b"] * 3))
+
+    asyncio.run(run())
+    # 第一个请求直接获得名额，之后两个 Key 交替
+    assert order == ["a", "a", "b", "a", "b", "b"]
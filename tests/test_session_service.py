@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+会话服务的单元测试：指定会话只能由创建它的 API Key 续用
+"""
+
+import time
+
+import pytest
+
+from app.services.session_service import SessionNotFoundError, session_service
+
+
+REQUEST = {"model": "mihoyo-orange_cat", "messages": [{"role": "user", "content": "hi"}]}
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    monkeypatch.setattr(session_service, "MODEL_MAPPING", {"mihoyo-orange_cat": "Orange Cat"})
+    monkeypatch.setattr(session_service, "sessions", {})
+    monkeypatch.setattr(session_service, "session_last_used", {})
+
+    def add(session_id, api_key):
+        session_service.sessions[session_id] = {
+            "api_key": api_key, "anuneko_chat_id": f"chat-{session_id}", "model": "Orange Cat", "turns": 1
+        }
+        session_service.session_last_used[session_id] = time.time()
+
+    return add
+
+
+def test_owner_can_resume(sessions):
+    sessions("owned", "k1")
+    assert session_service.get_session_for_request(REQUEST, "k1", session_id="owned") == "owned"
+
+
+def test_other_key_cannot_resume(sessions):
+    sessions("owned", "k1")
+    with pytest.raises(SessionNotFoundError):
+        session_service.get_session_for_request(REQUEST, "k2", session_id="owned")
+    with pytest.raises(SessionNotFoundError):
+        session_service.get_session_for_request(REQUEST, None, session_id="owned")
+
+
+def test_anonymous_session_cannot_be_resumed(sessions):
+    sessions("anonymous", None)
+    # 两个都未带 API Key 的调用方无法区分，匿名会话对任何调用方都不可续用
+    with pytest.raises(SessionNotFoundError) as exc:
+        session_service.get_session_for_request(REQUEST, None, session_id="anonymous")
+    assert exc.value.code == "session_not_found"
+    with pytest.raises(SessionNotFoundError):
+        session_service.get_session_for_request(REQUEST, "k1", session_id="anonymous")
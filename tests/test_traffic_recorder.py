@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+上游流量录制的单元测试
+"""
+
+import json
+import asyncio
+
+import httpx
+
+from app.services.traffic_recorder import RecordingTransport, TrafficRecorder
+
+
+def test_chunked_request_body_length_is_recorded(tmp_path):
+    path = str(tmp_path / "traffic.jsonl")
+    received = []
+
+    def handler(request):
+        received.append(request.content)
+        return httpx.Response(200, content=b"data: {}\n")
+
+    async def body():
+        yield b'{"contents": '
+        yield '["你好"]}'.encode("utf-8")
+
+    async def run():
+        recorder = TrafficRecorder(path)
+        transport = RecordingTransport(recorder, httpx.MockTransport(handler))
+        async with httpx.AsyncClient(transport=transport) as client:
+            resp = await client.post("https://example.com/api/v1/chat", content=body())
+            await resp.aread()
+        recorder.close()
+
+    asyncio.run(run())
+    expected = '{"contents": ["你好"]}'.encode("utf-8")
+    # 正文仍完整发送给上游
+    assert received == [expected]
+    with open(path, encoding="utf-8") as f:
+        record = json.loads(f.readline())
+    assert "content-length" not in {name.lower() for name in record["request_headers"]}
+    assert record["request_bytes"] == len(expected)